@@ -51,11 +51,14 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'medicine.MedicineUser'
 
 MIDDLEWARE = [
+    'medicine.middleware.MetricsMiddleware',
+    'medicine.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'medicine.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,6 +94,62 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds the dashboard KPIs stay cached; writes invalidate them through signals
+DASHBOARD_CACHE_TIMEOUT = 300
+
+
+# Expiry alert windows in days; EXPIRY_ALERT_DAYS is the default "expiring soon" window
+EXPIRY_ALERT_WINDOWS = (7, 30, 90)
+EXPIRY_ALERT_DAYS = 30
+
+
+# Background jobs run by `manage.py run_workers`; result files are written
+# under JOB_RESULTS_DIR and served back to the job's owner
+JOB_RESULTS_DIR = BASE_DIR / 'job_results'
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_INTERVAL = 2
+# Finished jobs and their result files are deleted after this many days
+JOB_RETENTION_DAYS = 7
+
+
+# Per-request SQL instrumentation: query count, SQL time, repeated statements
+# and the slowest one go out as Server-Timing headers and "medicine.sql" log
+# lines; requests over either budget are logged as warnings
+SQL_INSTRUMENTATION = True
+SQL_QUERY_BUDGET = 50
+SQL_TIME_BUDGET_MS = 200
+
+
+# Request profiling: staff add ?profile=1 or an "X-Profile: 1" header to a
+# request to save a cProfile capture, listed in the admin under Profile
+# captures. PROFILE_SAMPLE_RATE profiles that fraction of all requests too.
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_SAMPLE_RATE = 0
+PROFILE_MAX_CAPTURES = 200
+
+
+# Prometheus metrics at /metrics. Each process writes its samples to its own
+# file in METRICS_DIR within METRICS_FLUSH_INTERVAL seconds and the endpoint
+# adds them up; clearing the directory resets the counters. With
+# METRICS_TOKEN set, scrapers must send "Authorization: Bearer <token>";
+# without it only logged-in staff can read the endpoint.
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = None
+
+# Keeps the samples recorded by the test suite out of METRICS_DIR
+TEST_RUNNER = 'medicine.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
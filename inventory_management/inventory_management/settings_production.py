@@ -0,0 +1,97 @@
+"""
+Production settings for inventory_management.
+
+Run gunicorn and the job workers with
+``DJANGO_SETTINGS_MODULE=inventory_management.settings_production``.
+Everything not set here comes from ``settings.py``; this profile tunes
+SQLite for several worker processes sharing one database file and gives
+them one shared cache.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+
+DATABASE_PATH = BASE_DIR / 'db.sqlite3'
+
+# Applied to every new connection
+SQLITE_PRAGMAS = {
+    # Readers and the writer no longer block each other
+    'journal_mode': 'WAL',
+    # In WAL mode only a power loss, never a crash, can drop the latest commits
+    'synchronous': 'NORMAL',
+    # Read pages through a 256 MB memory map instead of read() calls
+    'mmap_size': 256 * 1024 * 1024,
+    # 64 MB page cache per connection (negative values are KiB)
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Seconds a connection waits for the write lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = 20
+
+
+def sqlite_init_command(pragmas):
+    return ';'.join(f'PRAGMA {name} = {value}' for name, value in pragmas.items())
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATABASE_PATH,
+        # Keep connections across requests instead of reopening one per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            # Writers take the write lock at BEGIN and wait for it there. A
+            # deferred transaction that reads before writing fails at once
+            # with "database is locked" when another writer got in first.
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': sqlite_init_command(SQLITE_PRAGMAS),
+        },
+    },
+    # Read-only connection to the same file for reports and exports, see
+    # medicine.routers. The journal mode is a property of the file, so it is
+    # only set by the writable connection.
+    'reports': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'{DATABASE_PATH.as_uri()}?mode=ro',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'init_command': sqlite_init_command({
+                name: value for name, value in SQLITE_PRAGMAS.items() if name not in ('journal_mode', 'synchronous')
+            }),
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['medicine.routers.ReportsRouter']
+
+# One cache for all gunicorn and job worker processes. The dashboard KPI
+# versions, the expiry and import invalidations and the cache hit counters
+# must be seen by every worker, which a per-process LocMemCache cannot do.
+# FileBasedCache has no atomic incr and culls at MAX_ENTRIES; the KPI
+# versions are random tokens (see medicine.kpis) so neither can bring back
+# stale values, and the limit is set well above the keys the app keeps.
+CACHE_DIR = BASE_DIR / 'cache'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100_000,
+        },
+    }
+}
+
+# Scrapers authenticate to /metrics with this bearer token; the system
+# checks refuse to start management commands until it is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_REQUIRE_TOKEN = True
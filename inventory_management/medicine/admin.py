@@ -1,7 +1,17 @@
+from collections import defaultdict
+
 from django.contrib import admin
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from .profiling import delete_capture_files
+from .services import rebuild_daily_sales
 from .models import (
     Medicine, Sale, SaleItem,
- PurchaseOrder, PurchaseOrderItem,MedicineUser
+ PurchaseOrder, PurchaseOrderItem,MedicineUser, DailySalesSummary,
+ BatchWriteOff, Job, ProfileCapture
 )
 
 admin.site.register(MedicineUser)
@@ -9,7 +19,93 @@ admin.site.register(MedicineUser)
 
 admin.site.register(Medicine)
 
-admin.site.register(Sale)
-admin.site.register(SaleItem)
+
+
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    """
+    Rebuild the daily sales rollup for the days an edit or delete touches.
+
+    ``commit_sale`` keeps the rollup up to date as sales are recorded; the
+    admin writes sales and items directly, so it recomputes the affected
+    days, before and after the change, from the sale items.
+    """
+    # Path from the model to its Sale
+    sale_lookup = ''
+
+    def _sale_days(self, queryset):
+        days = defaultdict(set)
+        for user_id, sale_date in queryset.values_list(f'{self.sale_lookup}user_id', f'{self.sale_lookup}sale_date'):
+            days[user_id].add(timezone.localdate(sale_date))
+        return days
+
+    def _rebuild(self, *day_sets):
+        merged = defaultdict(set)
+        for days in day_sets:
+            for user_id, dates in days.items():
+                merged[user_id] |= dates
+        for user_id, dates in merged.items():
+            rebuild_daily_sales(user_id=user_id, days=dates)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            before = self._sale_days(self.model.objects.filter(pk=obj.pk)) if change else {}
+            super().save_model(request, obj, form, change)
+            self._rebuild(before, self._sale_days(self.model.objects.filter(pk=obj.pk)))
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            days = self._sale_days(self.model.objects.filter(pk=obj.pk))
+            super().delete_model(request, obj)
+            self._rebuild(days)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            days = self._sale_days(queryset)
+            super().delete_queryset(request, queryset)
+            self._rebuild(days)
+
+
+@admin.register(Sale)
+class SaleAdmin(DailySalesRollupAdmin):
+    pass
+
+
+@admin.register(SaleItem)
+class SaleItemAdmin(DailySalesRollupAdmin):
+    sale_lookup = 'sale__'
+
 admin.site.register(PurchaseOrder)
-admin.site.register(PurchaseOrderItem)
\ No newline at end of file
+admin.site.register(PurchaseOrderItem)
+admin.site.register(DailySalesSummary)
+admin.site.register(BatchWriteOff)
+admin.site.register(Job)
+
+
+@admin.register(ProfileCapture)
+class ProfileCaptureAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'method', 'path', 'status_code', 'duration_ms', 'user', 'sampled', 'files']
+    list_filter = ['sampled', 'method']
+    search_fields = ['path']
+
+    @admin.display(description='Files')
+    def files(self, capture):
+        return format_html(
+            '<a href="{}">pstats</a> | <a href="{}">collapsed stacks</a>',
+            reverse('profile_capture_download', args=[capture.pk, 'stats']),
+            reverse('profile_capture_download', args=[capture.pk, 'stacks']),
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        delete_capture_files(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for capture in queryset:
+            delete_capture_files(capture)
+        super().delete_queryset(request, queryset)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def metrics_token_check(app_configs, **kwargs):
+    """Profiles with METRICS_REQUIRE_TOKEN must not serve /metrics without a scrape token."""
+    if getattr(settings, 'METRICS_REQUIRE_TOKEN', False) and not getattr(settings, 'METRICS_TOKEN', None):
+        return [Error(
+            "METRICS_TOKEN is not set.",
+            hint="Set the METRICS_TOKEN environment variable to the token the Prometheus scraper sends.",
+            id='medicine.E001',
+        )]
+    return []
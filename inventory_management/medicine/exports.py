@@ -0,0 +1,131 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import DailySalesSummary, Medicine, MedicineBatch
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Rows fetched per round trip while streaming; keeps memory flat for any export size
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write() hands the line back to the csv writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def requested_export_format(request):
+    """Return the export format asked for with ``?format=``, or None for the HTML page."""
+    export_format = request.GET.get('format', '').lower()
+    return export_format if export_format in EXPORT_FORMATS else None
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(queryset, header, export_format, filename):
+    """Stream a ``values_list`` queryset as CSV or NDJSON without materializing it."""
+    content_type, extension = EXPORT_FORMATS[export_format]
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    lines = _csv_lines(header, rows) if export_format == 'csv' else _ndjson_lines(header, rows)
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
+def write_export(queryset, header, export_format, stream, progress=None):
+    """
+    Write a ``values_list`` queryset as CSV or NDJSON to a text stream.
+
+    ``progress`` is called with the number of rows written after every chunk,
+    for callers that report on long exports. Returns the number of rows.
+    """
+    written = 0
+
+    def counted(rows):
+        nonlocal written
+        for row in rows:
+            yield row
+            written += 1
+            if progress and written % EXPORT_CHUNK_SIZE == 0:
+                progress(written)
+
+    rows = counted(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    lines = _csv_lines(header, rows) if export_format == 'csv' else _ndjson_lines(header, rows)
+    stream.writelines(lines)
+    return written
+
+
+SALES_EXPORT_FIELDS = ['invoice_number', 'sale_date', 'customer_name', 'customer_phone', 'total_amount']
+
+
+def sales_export(sales):
+    """Rows and header of a sales export."""
+    return sales.values_list(*SALES_EXPORT_FIELDS), SALES_EXPORT_FIELDS
+
+
+def inventory_report_querysets(user, low_stock=False, expiry_filter=None):
+    """The medicines and batches of ``user``'s inventory report, with the report page's filters applied."""
+    medicines = Medicine.objects.filter(user=user).with_stock().order_by('name')
+    batches = MedicineBatch.objects.order_by('expiry_date', 'pk')
+
+    if low_stock:
+        medicines = medicines.low_stock()
+
+    today = timezone.now().date()
+    # Both the medicine filter and the batch rows shown follow the expiry filter
+    if expiry_filter == 'expired':
+        medicines = medicines.with_expired_batches()
+        batches = batches.filter(expiry_date__lt=today, is_active=True)
+    elif expiry_filter == 'soon':
+        medicines = medicines.with_expiring_batches(days=30)
+        batches = batches.filter(expiry_date__gte=today, expiry_date__lte=today + timedelta(days=30), is_active=True)
+    return medicines, batches
+
+
+def inventory_export(user, medicines, batches):
+    """Rows and header of an inventory report export: one row per batch."""
+    rows = batches.filter(
+        user=user,
+        medicine__in=medicines.values('pk')
+    ).order_by('medicine__name', 'expiry_date', 'pk').values_list(
+        'medicine__name', 'batch_number', 'expiry_date', 'current_quantity',
+        'medicine__stock_on_hand', 'medicine__minimum_stock', 'selling_price', 'is_active'
+    )
+    header = [
+        'medicine', 'batch_number', 'expiry_date', 'batch_quantity',
+        'current_stock', 'minimum_stock', 'selling_price', 'is_active'
+    ]
+    return rows, header
+
+
+def sales_summary_export(user, start, end):
+    """Rows and header of the per-medicine daily sales rollup between two dates."""
+    rows = DailySalesSummary.objects.filter(
+        user=user,
+        medicine__isnull=False,
+        date__range=(start, end),
+    ).order_by('date', 'medicine__name').values_list(
+        'date', 'medicine__name', 'units', 'revenue', 'cost', 'line_count'
+    )
+    return rows, ['date', 'medicine', 'units', 'revenue', 'cost', 'line_count']
@@ -6,25 +6,52 @@ from .models import (
 )
 from django.db import transaction
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.db.models import Subquery, OuterRef, Sum, Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, When
+from django.utils.functional import cached_property
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from . import kpis, metrics
+from .services import sellable_batches
+
 from django.forms.models import BaseInlineFormSet
 
 from django.forms.models import BaseInlineFormSet
 
 from django.forms.models import BaseInlineFormSet
 
+def submitted_pks(formset, field_name):
+    """Integer pks submitted for ``field_name`` across every form of a bound formset."""
+    values = (
+        formset.data.get(f'{formset.add_prefix(i)}-{field_name}', '')
+        for i in range(formset.total_form_count())
+    )
+    return {int(value) for value in values if value.isdigit()}
+
+
 class BaseSaleItemFormSet(BaseInlineFormSet):
+    """Loads the batches picked across all lines once and shares them with every form."""
+
     def __init__(self, *args, **kwargs):
         self.request = kwargs.pop('request', None)  # Grab the request object safely
         super().__init__(*args, **kwargs)
-    
-    def _construct_form(self, i, **kwargs):
-        # This is the key change - pass request to the form kwargs
-        kwargs['request'] = self.request
-        return super()._construct_form(i, **kwargs)
+
+    @cached_property
+    def selected_batches(self):
+        """The sellable batches picked in the submitted lines, with their medicine, in one query."""
+        if not self.is_bound or self.request is None:
+            return {}
+        return sellable_batches(self.request.user).select_related('medicine').in_bulk(
+            submitted_pks(self, 'medicine_batch')
+        )
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs.update(request=self.request, batches=self.selected_batches)
+        return kwargs
+
 
 class LoginForm(AuthenticationForm):
     username = forms.EmailField(
@@ -104,6 +131,19 @@ class MedicineBatchForm(forms.ModelForm):
         }
 
 
+class BatchImportForm(MedicineBatchForm):
+    """Batch rules of ``MedicineBatchForm`` for imported rows, whose medicine is matched by name."""
+
+    class Meta(MedicineBatchForm.Meta):
+        fields = [name for name in MedicineBatchForm.Meta.fields if name != 'medicine']
+
+
+class InventoryImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV with a header row, or JSON with one object per line.")
+    dry_run = forms.BooleanField(required=False, help_text="Validate and report without saving anything.")
+    background = forms.BooleanField(required=False, help_text="Import in the background; large files do not have to finish before the page loads.")
+
+
 class SaleForm(forms.ModelForm):
     class Meta:
         model = Sale
@@ -116,35 +156,73 @@ class SaleForm(forms.ModelForm):
         }
 
 
+def batch_label(batch):
+    """Label shown for a batch in the sale form and the batch search results."""
+    return f"{batch.medicine.name} (Batch: {batch.batch_number}) - Stock: {batch.current_quantity}"
+
+
+class BatchAutocompleteSelect(forms.Select):
+    """
+    Select that renders only the chosen batch instead of every sellable one.
+
+    The remaining options are fetched from the ``batch_search`` endpoint as the
+    cashier types. A chosen batch is labelled from the field's precomputed
+    choices when it is among them, and only looked up otherwise, among
+    ``user``'s batches; ids it cannot label are not rendered.
+    """
+
+    def __init__(self, attrs=None, choices=(), user=None):
+        super().__init__(attrs, choices)
+        self.user = user
+
+    def optgroups(self, name, value, attrs=None):
+        selected_ids = [v for v in value if v]
+        options = [self.create_option(name, '', '---------', not selected_ids, 0)]
+        labels = {str(pk): label for pk, label in self.choices if pk != ''}
+        missing = [v for v in selected_ids if v not in labels and v.isdigit()]
+        if missing and self.user is not None:
+            batches = MedicineBatch.objects.filter(pk__in=missing, user=self.user).select_related('medicine')
+            for batch in batches:
+                labels[str(batch.pk)] = batch_label(batch)
+        for index, pk in enumerate((v for v in selected_ids if v in labels), start=1):
+            options.append(self.create_option(name, pk, labels[pk], True, index))
+        return [(None, options, 0)]
+
+
 class SaleItemForm(forms.ModelForm):
     class Meta:
         model = SaleItem
         fields = ['medicine_batch', 'quantity', 'price']
         widgets = {
-            'medicine_batch': forms.Select(attrs={'class': 'form-control item-medicine_batch', 'required': 'required'}),
+            'medicine_batch': BatchAutocompleteSelect(attrs={'class': 'form-control item-medicine_batch', 'required': 'required'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control item-quantity', 'min': '1', 'required': 'required'}),
             'price': forms.NumberInput(attrs={'class': 'form-control item-price', 'step': '0.01', 'min': '0.01', 'required': 'required'}),
         }
     
-    def __init__(self, *args, **kwargs):
-        # We can get request from kwargs (from _construct_form) 
-        # or it might be set as an attribute later (from add_fields)
+    def __init__(self, *args, batches=None, **kwargs):
         self.request = kwargs.pop('request', None)
         super().__init__(*args, **kwargs)
         
-        # Note: filtering is now handled directly in the view, but we'll leave this as a backup
-        if self.request:
-            today = timezone.now().date()
-            self.fields['medicine_batch'].queryset = MedicineBatch.objects.filter(
-                user=self.request.user,
-                expiry_date__gte=today,
-                current_quantity__gt=0,
-                is_active=True
-            )
+        # Only batches picked in this submission are loaded, once for the whole
+        # formset; the widget fetches the other options as the cashier types
+        batches = batches or {}
+        self.fields['medicine_batch'] = PrecomputedModelChoiceField(
+            MedicineBatch.objects.all(),
+            [(pk, batch_label(batch)) for pk, batch in batches.items()],
+            batches,
+            widget=self.fields['medicine_batch'].widget,
+        )
+        self.fields['medicine_batch'].widget.user = self.request.user if self.request else None
         
         # Make sure the 'medicine_batch' field is required
         self.fields['medicine_batch'].required = True
-        self.fields['medicine_batch'].label_from_instance = lambda obj: f"{obj.medicine.name} (Batch: {obj.batch_number}) - Stock: {obj.current_quantity}"
+    
+    def _get_validation_exclusions(self):
+        # The batch field already resolved the pk among the user's sellable
+        # batches; model validation would check it exists once per line
+        exclude = super()._get_validation_exclusions()
+        exclude.add('medicine_batch')
+        return exclude
     
     def clean_medicine_batch(self):
         """Explicit validation for medicine_batch field."""
@@ -205,32 +283,69 @@ class PurchaseOrderForm(forms.ModelForm):
         })
 
 
+# Seconds the purchase order medicine choices stay cached; stock writes invalidate them sooner
+MEDICINE_CHOICES_CACHE_TIMEOUT = getattr(settings, 'MEDICINE_CHOICES_CACHE_TIMEOUT', 300)
+
+
+def purchase_order_medicine_choices(user):
+    """
+    ``(pk, name)`` of the user's medicines to order, those below minimum stock first.
+
+    Cached per user under the version of the dashboard's stock KPIs, so any
+    write that changes stock or the catalog makes the next form recompute it.
+    """
+    key = f'purchase-order-choices:{user.pk}:{kpis.group_version(user.pk, "stock")}'
+    choices = cache.get(key)
+    metrics.inc('pharmacy_cache_requests_total', cache='purchase_order_choices', result='miss' if choices is None else 'hit')
+    if choices is None:
+        choices = list(
+            Medicine.objects.filter(user=user)
+            .annotate(restock=Case(When(stock_on_hand__lt=F('minimum_stock'), then=0), default=1))
+            .order_by('restock', 'name', 'pk')
+            .values_list('pk', 'name')
+        )
+        cache.set(key, choices, MEDICINE_CHOICES_CACHE_TIMEOUT)
+    return choices
+
+
+class PrecomputedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField over ``(pk, label)`` choices computed once for a whole formset.
+
+    Rendering runs no query. A submitted pk must be one of the choices and is
+    looked up in ``instances``, a pk to instance mapping the formset shares.
+    """
+
+    def __init__(self, queryset, choices, instances, **kwargs):
+        super().__init__(queryset, **kwargs)
+        empty = [('', self.empty_label)] if self.empty_label is not None else []
+        self.choices = [*empty, *choices]
+        self.instances = instances
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.instances[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value}
+            )
+
+
 class PurchaseOrderItemForm(forms.ModelForm):
     class Meta:
         model = PurchaseOrderItem
         fields = ['medicine', 'quantity', 'unit_price']
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, medicine_choices=(), medicines=None, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Get medicines with low stock
-        low_stock_qs = Medicine.objects.filter(
-            minimum_stock__gt=Subquery(
-                MedicineBatch.objects.filter(
-                    medicine=OuterRef('pk'),
-                    is_active=True
-                ).values('medicine').annotate(
-                    total=Sum('current_quantity')
-                ).values('total')[:1]
-            )
+        # Choices come precomputed from the formset instead of a query per line
+        self.fields['medicine'] = PrecomputedModelChoiceField(
+            Medicine.objects.all(), medicine_choices, medicines or {}
         )
         
-        # Get all medicines excluding low stock ones
-        queryset = Medicine.objects.all()
-        
-        # Combine low stock medicines and others using the | operator
-        self.fields['medicine'].queryset = low_stock_qs | queryset.exclude(pk__in=low_stock_qs.values_list('pk', flat=True))
-        
         # Make required fields more obvious
         self.fields['medicine'].required = True
         self.fields['quantity'].required = True
@@ -238,14 +353,76 @@ class PurchaseOrderItemForm(forms.ModelForm):
         self.fields['quantity'].widget.attrs['required'] = True
         self.fields['quantity'].widget.attrs['min'] = 1
 
+    def _get_validation_exclusions(self):
+        # The medicine field already resolved the pk among the user's own
+        # medicines; model validation would check it exists once per line
+        exclude = super()._get_validation_exclusions()
+        exclude.add('medicine')
+        return exclude
+
+
+class BasePurchaseOrderItemFormSet(BaseInlineFormSet):
+    """Computes the medicine choices once per request and shares them with every line."""
+
+    def __init__(self, *args, user=None, **kwargs):
+        self.user = user
+        super().__init__(*args, **kwargs)
+        self.medicine_choices = purchase_order_medicine_choices(user)
+
+    @cached_property
+    def selected_medicines(self):
+        """The medicines picked in the submitted lines, fetched in one query."""
+        if not self.is_bound:
+            return {}
+        allowed = {pk for pk, _ in self.medicine_choices}
+        return Medicine.objects.filter(user=self.user).in_bulk(submitted_pks(self, 'medicine') & allowed)
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs.update(medicine_choices=self.medicine_choices, medicines=self.selected_medicines)
+        return kwargs
+
 
 # Create a formset for purchase order items
 PurchaseOrderItemFormSet = inlineformset_factory(
     PurchaseOrder, 
     PurchaseOrderItem,
     form=PurchaseOrderItemForm,
+    formset=BasePurchaseOrderItemFormSet,
     extra=1,
     can_delete=True,
     min_num=1,
     validate_min=True,
 )
+
+
+class ReceiveItemForm(forms.Form):
+    """One purchase order line of a delivery; a blank or zero quantity leaves the line for later."""
+    item = forms.IntegerField(widget=forms.HiddenInput)
+    quantity = forms.IntegerField(min_value=0, required=False)
+    batch_number = forms.CharField(max_length=50, required=False)
+    manufacturing_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    expiry_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    purchase_price = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    selling_price = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
+    BATCH_FIELDS = ['batch_number', 'manufacturing_date', 'expiry_date', 'purchase_price', 'selling_price']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('quantity'):
+            return cleaned_data
+        for name in self.BATCH_FIELDS:
+            if cleaned_data.get(name) in (None, '') and name not in self.errors:
+                self.add_error(name, 'This field is required when receiving this item.')
+        manufactured, expires = cleaned_data.get('manufacturing_date'), cleaned_data.get('expiry_date')
+        if manufactured and expires and expires <= manufactured:
+            self.add_error('expiry_date', 'Expiry date must be after the manufacturing date.')
+        return cleaned_data
+
+    @property
+    def receives(self):
+        return self.is_valid() and bool(self.cleaned_data.get('quantity'))
+
+
+ReceiveItemFormSet = forms.formset_factory(ReceiveItemForm, extra=0)
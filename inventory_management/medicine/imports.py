@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
+
+from . import kpis
+from .forms import BatchImportForm, MedicineForm
+from .models import CatalogVersion, Medicine, MedicineBatch
+from .services import adjust_medicine_totals
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Rows validated, looked up and written together; each chunk is its own transaction
+IMPORT_CHUNK_SIZE = 1000
+
+MEDICINE_FIELDS = MedicineForm._meta.fields
+BATCH_FIELDS = BatchImportForm._meta.fields
+# Medicine fields an import may overwrite on an existing medicine of the same name
+UPDATABLE_FIELDS = [name for name in MEDICINE_FIELDS if name != 'name']
+
+
+class ImportResult:
+    """Counts and per-row errors of one import run."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.medicines_created = 0
+        self.medicines_updated = 0
+        self.batches_created = 0
+        self.errors = []
+
+    def add_error(self, row, message):
+        self.errors.append((row, message))
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def import_format(filename):
+    """Pick the input format from a file name; JSON input is one object per line."""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(stream, import_format):
+    """Yield ``(row_number, dict)`` from a text stream without reading it all into memory."""
+    if import_format == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            # Surfaced by validation as a row error rather than aborting the import
+            row = {'__invalid__': 'Line is not a JSON object.'}
+        yield number, {key: '' if value is None else str(value) for key, value in row.items()}
+
+
+def _with_defaults(data, form_class):
+    """Fill blank fields that have a model default, as the create views would."""
+    model = form_class._meta.model
+    for name in form_class._meta.fields:
+        field = model._meta.get_field(name)
+        if not data.get(name) and field.has_default():
+            data[name] = field.get_default()
+    return data
+
+
+def _provided_fields(row):
+    """
+    Updatable medicine fields a row sets on an existing medicine.
+
+    Columns missing from the file leave the stored value alone, and so do
+    blank cells of fields with a default, which only apply to new medicines.
+    """
+    return [
+        name for name in UPDATABLE_FIELDS
+        if name in row and (row[name] or not Medicine._meta.get_field(name).has_default())
+    ]
+
+
+def _form_errors(form):
+    return '; '.join(
+        f"{name}: {' '.join(messages)}" if name != '__all__' else ' '.join(messages)
+        for name, messages in form.errors.items()
+    )
+
+
+def _import_chunk(user, chunk, result):
+    """Validate, resolve and write one chunk of rows with a fixed number of queries."""
+    valid = []
+    for number, row in chunk:
+        if '__invalid__' in row:
+            result.add_error(number, row['__invalid__'])
+            continue
+        medicine_form = MedicineForm(data=_with_defaults(
+            {name: row.get(name, '') for name in MEDICINE_FIELDS}, MedicineForm
+        ))
+        batch_form = None
+        if row.get('batch_number'):
+            batch_form = BatchImportForm(data=_with_defaults(
+                {name: row.get(name, '') for name in BATCH_FIELDS}, BatchImportForm
+            ))
+        errors = [_form_errors(form) for form in (medicine_form, batch_form) if form and not form.is_valid()]
+        if errors:
+            result.add_error(number, '; '.join(errors))
+            continue
+        valid.append((
+            number, medicine_form.cleaned_data, _provided_fields(row), batch_form.cleaned_data if batch_form else None
+        ))
+
+    # Same duplicate rule as MedicineCreateView: one medicine per name per user
+    names = {medicine['name'] for _, medicine, _, _ in valid}
+    existing = {medicine.name: medicine for medicine in Medicine.objects.filter(user=user, name__in=names)}
+    existing_batches = set(MedicineBatch.objects.filter(
+        medicine__in=existing.values(),
+        batch_number__in={batch['batch_number'] for _, _, _, batch in valid if batch},
+    ).values_list('medicine__name', 'batch_number'))
+
+    new_medicines = {}
+    changed = {}
+    changed_fields = set()
+    batch_rows = []
+    for number, medicine_data, provided, batch_data in valid:
+        name = medicine_data['name']
+        if batch_data:
+            key = (name, batch_data['batch_number'])
+            if key in existing_batches:
+                result.add_error(number, f"Batch {key[1]} of {name} already exists.")
+                continue
+            existing_batches.add(key)
+
+        medicine = existing.get(name) or new_medicines.get(name)
+        if medicine is None:
+            new_medicines[name] = Medicine(user=user, **medicine_data)
+        elif medicine.pk:
+            fields = [field for field in provided if getattr(medicine, field) != medicine_data[field]]
+            for field in fields:
+                setattr(medicine, field, medicine_data[field])
+            if fields:
+                changed[medicine.pk] = medicine
+                changed_fields.update(fields)
+        if batch_data:
+            batch_rows.append((name, batch_data))
+
+    result.medicines_created += len(new_medicines)
+    result.medicines_updated += len(changed)
+    result.batches_created += len(batch_rows)
+    if result.dry_run:
+        return
+
+    with transaction.atomic():
+        Medicine.objects.bulk_create(new_medicines.values())
+        if changed:
+            # Medicines whose row skipped one of these fields write back the value they were read with
+            Medicine.objects.bulk_update(changed.values(), sorted(changed_fields))
+        medicines = {**existing, **new_medicines}
+        version = CatalogVersion.next()
+        batches = MedicineBatch.objects.bulk_create([
+            MedicineBatch(
+                medicine=medicines[name],
+                user=user,
+                current_quantity=batch_data['quantity_received'],
+                sync_version=version,
+                **batch_data
+            )
+            for name, batch_data in batch_rows
+        ])
+        # bulk_create skips MedicineBatch.save, so add the new stock to the totals here
+        quantities = defaultdict(int)
+        for batch in batches:
+            quantities[batch.medicine_id] += batch.current_quantity
+        adjust_medicine_totals(quantities)
+
+
+def import_inventory(user, stream, import_format, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Import medicines and their batches for ``user`` from a CSV or NDJSON text stream.
+
+    Each row holds the ``MedicineForm`` fields and, when ``batch_number`` is
+    set, the batch fields of ``MedicineBatchForm``. A row naming an existing
+    medicine updates the fields the file has columns for instead of creating
+    a duplicate. Invalid rows are
+    reported in the result and skipped; valid rows are still imported.
+    With ``dry_run`` nothing is written.
+    """
+    result = ImportResult(dry_run=dry_run)
+    rows = read_rows(stream, import_format)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        result.rows += len(chunk)
+        _import_chunk(user, chunk, result)
+
+    if not dry_run and (result.medicines_created or result.medicines_updated or result.batches_created):
+        # Bulk writes send no signals, so drop the cached dashboard figures here
+        transaction.on_commit(lambda: kpis.invalidate(user.pk))
+    return result
+
+
+def text_stream(uploaded_file):
+    """Decode an uploaded file lazily, chunk by chunk."""
+    return io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', newline='')
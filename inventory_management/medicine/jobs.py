@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .exports import (
+    EXPORT_FORMATS, inventory_export, inventory_report_querysets, sales_export, sales_summary_export, write_export
+)
+from .imports import import_inventory
+from .models import Job, Sale
+from .routers import reads_from_reports
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a progress report after which a running job counts as abandoned
+JOB_STALE_AFTER = getattr(settings, 'JOB_STALE_AFTER', 15 * 60)
+# Days finished jobs and their result files are kept before being deleted
+JOB_RETENTION_DAYS = getattr(settings, 'JOB_RETENTION_DAYS', 7)
+# Seconds between two maintenance passes of a running worker
+JOB_MAINTENANCE_INTERVAL = getattr(settings, 'JOB_MAINTENANCE_INTERVAL', 60)
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind, params=None):
+    """
+    Register a function as the handler of one job kind.
+
+    Handlers take ``(job, context)`` and return the success message. Kinds
+    registered with ``params`` may be queued by users through the API with
+    those params; the others only from server code that checks its params.
+    """
+    def register(func):
+        JOB_HANDLERS[kind] = (func, params)
+        return func
+    return register
+
+
+def results_dir():
+    path = Path(getattr(settings, 'JOB_RESULTS_DIR', Path(settings.BASE_DIR) / 'job_results'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def result_path(job):
+    return results_dir() / job.result_file
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def api_params(kind):
+    """Params users may set when queueing ``kind`` through the API, or None if they may not queue it."""
+    return JOB_HANDLERS.get(kind, (None, None))[1]
+
+
+def enqueue(user, kind, **params):
+    """Queue a job for the workers and return it; the caller responds without waiting."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(user=user, kind=kind, params=params)
+
+
+def claim_next_job(worker=None):
+    """
+    Take the oldest queued job for this worker, or return None when the queue is empty.
+
+    The claim is a conditional UPDATE, so when several workers race for the
+    same job exactly one of them gets it and the others try the next one.
+    """
+    worker = worker or worker_name()
+    while True:
+        job = Job.objects.filter(status=Job.QUEUED).order_by('created_at', 'pk').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs():
+    """Put jobs whose worker stopped reporting back in the queue; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=JOB_STALE_AFTER)
+    return Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff).update(
+        status=Job.QUEUED, worker='', progress=0
+    )
+
+
+def delete_expired_jobs():
+    """Delete jobs finished more than JOB_RETENTION_DAYS ago with their files; returns how many."""
+    cutoff = timezone.now() - timedelta(days=JOB_RETENTION_DAYS)
+    expired = Job.objects.filter(status__in=(Job.SUCCEEDED, Job.FAILED), finished_at__lt=cutoff)
+    deleted = 0
+    for job in expired.only('pk', 'kind', 'params', 'result_file').iterator():
+        if job.result_file:
+            result_path(job).unlink(missing_ok=True)
+        # A failed import never got to remove its upload
+        if job.kind == 'import_inventory' and job.params.get('upload'):
+            (results_dir() / job.params['upload']).unlink(missing_ok=True)
+        deleted += Job.objects.filter(pk=job.pk).delete()[0]
+    return deleted
+
+
+def maintain_jobs():
+    """Requeue abandoned jobs and delete expired ones; returns ``(requeued, deleted)``."""
+    return requeue_stale_jobs(), delete_expired_jobs()
+
+
+class JobContext:
+    """What a running handler uses to report progress and write its result file."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, percent, message=''):
+        percent = max(0, min(int(percent), 100))
+        Job.objects.filter(pk=self.job.pk).update(progress=percent, message=message, heartbeat_at=timezone.now())
+
+    def open_result(self, extension):
+        self.job.result_file = f'{self.job.pk}-{self.job.kind}.{extension}'
+        return open(result_path(self.job), 'w', encoding='utf-8', newline='')
+
+
+def run_job(job):
+    """Run a claimed job to completion, recording its outcome on the row."""
+    handler, _ = JOB_HANDLERS.get(job.kind, (None, None))
+    context = JobContext(job)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+        message = handler(job, context)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, message=str(e), finished_at=timezone.now())
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.SUCCEEDED,
+        progress=100,
+        message=message or '',
+        result_file=job.result_file,
+        finished_at=timezone.now(),
+    )
+    return True
+
+
+def run_pending_jobs(worker=None, limit=None):
+    """Run queued jobs in this process until the queue is empty; returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_next_job(worker)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def worker_loop(stop, poll_interval):
+    """Body of one ``run_workers`` process: run jobs until ``stop`` is set."""
+    # Never reuse a connection inherited from the parent process
+    connections.close_all()
+    # Finish the current job on Ctrl-C or SIGTERM. The handler must not touch
+    # ``stop`` itself: it may interrupt stop.wait() while that holds its lock.
+    terminated = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    worker = worker_name()
+    # Workers die without warning, so every live worker looks after the queue
+    next_maintenance = 0
+    while not stop.is_set() and not terminated:
+        if time.monotonic() >= next_maintenance:
+            maintain_jobs()
+            next_maintenance = time.monotonic() + JOB_MAINTENANCE_INTERVAL
+        if not run_pending_jobs(worker, limit=1):
+            stop.wait(poll_interval)
+    connections.close_all()
+
+
+def _export_format(job):
+    export_format = job.params.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    return export_format
+
+
+def _write_rows(context, rows, header, export_format):
+    total = rows.count() or 1
+    with context.open_result(EXPORT_FORMATS[export_format][1]) as stream:
+        written = write_export(
+            rows, header, export_format, stream,
+            progress=lambda done: context.progress(done * 100 / total, f"{done} of {total} rows"),
+        )
+    return f"Exported {written} row(s)."
+
+
+@job_handler('export_sales', params=('format',))
+@reads_from_reports
+def export_sales_job(job, context):
+    rows, header = sales_export(Sale.objects.filter(user=job.user).order_by('-sale_date', '-id'))
+    return _write_rows(context, rows, header, _export_format(job))
+
+
+@job_handler('export_inventory', params=('format', 'low_stock', 'expiry'))
+@reads_from_reports
+def export_inventory_job(job, context):
+    medicines, batches = inventory_report_querysets(
+        job.user, job.params.get('low_stock'), job.params.get('expiry')
+    )
+    rows, header = inventory_export(job.user, medicines, batches)
+    return _write_rows(context, rows, header, _export_format(job))
+
+
+@job_handler('export_sales_summary', params=('format', 'start', 'end'))
+@reads_from_reports
+def export_sales_summary_job(job, context):
+    end = parse_date(job.params.get('end') or '') or timezone.localdate()
+    start = parse_date(job.params.get('start') or '') or end.replace(day=1)
+    rows, header = sales_summary_export(job.user, start, end)
+    return _write_rows(context, rows, header, _export_format(job))
+
+
+def enqueue_import(user, uploaded_file, import_format, dry_run=False):
+    """Save an uploaded import file next to the job results and queue its import."""
+    upload = Path('uploads') / f'{uuid.uuid4().hex}.{import_format}'
+    (results_dir() / upload.parent).mkdir(exist_ok=True)
+    with open(results_dir() / upload, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    return enqueue(user, 'import_inventory', upload=str(upload), format=import_format, dry_run=dry_run)
+
+
+@job_handler('import_inventory')
+def import_inventory_job(job, context):
+    upload = results_dir() / job.params['upload']
+    size = upload.stat().st_size or 1
+
+    with open(upload, encoding='utf-8-sig', newline='') as stream:
+        rows = _ProgressStream(stream, lambda done: context.progress(done * 100 / size))
+        result = import_inventory(job.user, rows, job.params['format'], dry_run=job.params.get('dry_run', False))
+    upload.unlink(missing_ok=True)
+
+    with context.open_result('json') as report:
+        json.dump({
+            'rows': result.rows,
+            'medicines_created': result.medicines_created,
+            'medicines_updated': result.medicines_updated,
+            'batches_created': result.batches_created,
+            'errors': [{'row': row, 'message': message} for row, message in result.errors],
+        }, report)
+    summary = (
+        f"{result.rows} row(s): {result.medicines_created} new medicine(s), "
+        f"{result.medicines_updated} updated medicine(s), {result.batches_created} new batch(es), "
+        f"{len(result.errors)} rejected."
+    )
+    return f"Dry run, nothing saved. {summary}" if result.dry_run else summary
+
+
+class _ProgressStream:
+    """Line iterator over a text file that reports how far into the file it is."""
+
+    # Report every this many lines
+    EVERY = 5000
+
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+        self.read = 0
+        self.lines = 0
+
+    def __iter__(self):
+        for line in self.stream:
+            self.read += len(line.encode())
+            self.lines += 1
+            if self.lines % self.EVERY == 0:
+                self.progress(self.read)
+            yield line
@@ -0,0 +1,146 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import DailySalesSummary, Medicine, Sale
+
+# Seconds a computed KPI group stays cached; signals invalidate it sooner on writes
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+EXPIRY_ALERT_DAYS = getattr(settings, 'EXPIRY_ALERT_DAYS', 30)
+
+STATS_KEYS = {'hits': 'dashboard:stats:hits', 'misses': 'dashboard:stats:misses'}
+# Result label of each stat in pharmacy_cache_requests_total
+STATS_RESULTS = {'hits': 'hit', 'misses': 'miss'}
+
+
+def _low_stock(user, today):
+    low_stock_medicines = list(Medicine.objects.filter(user=user).low_stock().order_by('name'))
+    return {
+        'low_stock_medicines': low_stock_medicines,
+        'low_stock_count': len(low_stock_medicines),
+    }
+
+
+def _alerts(user, today):
+    summary = Medicine.objects.filter(user=user).alert_summary()
+    return {
+        'alert_summary': summary,
+        'expired_batches': summary['expired'],
+        'expiring_soon_count': summary['expiring'][EXPIRY_ALERT_DAYS],
+    }
+
+
+def _sales(user, today):
+    return {
+        'recent_sales': list(Sale.objects.filter(user=user).order_by('-sale_date')[:5]),
+        # Month to date from the daily rollup: at most 31 rows instead of every sale
+        'monthly_sales': DailySalesSummary.objects.filter(
+            user=user,
+            medicine__isnull=True,
+            date__gte=today.replace(day=1)
+        ).aggregate(Sum('revenue'))['revenue__sum'] or 0,
+    }
+
+
+# Each KPI group is cached and invalidated on its own, so a batch edit does not
+# force the sales figures to be recomputed and vice versa
+KPI_GROUPS = {
+    'stock': _low_stock,
+    'alerts': _alerts,
+    'sales': _sales,
+}
+
+# Which groups a write to each model invalidates
+INVALIDATES = {
+    'Medicine': ('stock', 'alerts'),
+    'MedicineBatch': ('stock', 'alerts'),
+    'Sale': ('stock', 'alerts', 'sales'),
+    'SaleItem': ('stock', 'alerts', 'sales'),
+}
+
+
+def _version_key(user_id, group):
+    return f'dashboard:version:{user_id}:{group}'
+
+
+def _versions(user_id, groups):
+    """
+    Current version of each group, a random token.
+
+    Tokens are replaced, never incremented, so invalidating needs no atomic
+    read-modify-write from the cache backend: every bump yields a value no
+    cached entry was stored under. A version the cache lost, to culling or
+    a restart, comes back as a fresh token for the same reason.
+    """
+    keys = {group: _version_key(user_id, group) for group in groups}
+    found = cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        # Another process may have added its token first
+        found.update(cache.get_many(missing))
+    return {group: found.get(key) or uuid.uuid4().hex for group, key in keys.items()}
+
+
+def group_version(user_id, group):
+    """Current version of a KPI group, for caching other per-user data that changes with it."""
+    return _versions(user_id, [group])[group]
+
+
+def invalidate(user_id, groups=KPI_GROUPS):
+    """Give the given KPI groups new versions so their cached values are never read again."""
+    cache.set_many({_version_key(user_id, group): uuid.uuid4().hex for group in groups}, timeout=None)
+
+
+def _count(stat, amount):
+    # Only statistics: a lost concurrent increment on a non-atomic backend is acceptable
+    if not amount:
+        return
+    metrics.inc('pharmacy_cache_requests_total', amount, cache='dashboard', result=STATS_RESULTS[stat])
+    try:
+        cache.incr(STATS_KEYS[stat], amount)
+    except ValueError:
+        cache.add(STATS_KEYS[stat], amount, timeout=None)
+
+
+def cache_stats():
+    """Hit and miss counts of the dashboard KPI cache, across all users."""
+    values = cache.get_many(STATS_KEYS.values())
+    return {stat: values.get(key, 0) for stat, key in STATS_KEYS.items()}
+
+
+def dashboard_kpis(user):
+    """
+    Return the dashboard context, recomputing only the KPI groups that were invalidated.
+
+    Values are keyed by group version and by date, so date-relative counts
+    roll over at midnight even without writes.
+    """
+    today = timezone.now().date()
+    versions = _versions(user.pk, KPI_GROUPS)
+    value_keys = {
+        group: f'dashboard:{user.pk}:{group}:{version}:{today.isoformat()}'
+        for group, version in versions.items()
+    }
+    cached = cache.get_many(value_keys.values())
+
+    context = {}
+    missing = {}
+    for group, key in value_keys.items():
+        if key in cached:
+            context.update(cached[key])
+        else:
+            missing[key] = KPI_GROUPS[group](user, today)
+            context.update(missing[key])
+
+    if missing:
+        cache.set_many(missing, timeout=DASHBOARD_CACHE_TIMEOUT)
+    _count('hits', len(value_keys) - len(missing))
+    _count('misses', len(missing))
+    return context
@@ -0,0 +1,134 @@
+import importlib
+import multiprocessing
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+# Settings modules whose default database options are compared
+PROFILES = {
+    'default': 'inventory_management.settings',
+    'production': 'inventory_management.settings_production',
+}
+
+# Batches the simulated sales spread over; fewer means more contention
+BENCHMARK_BATCHES = 20
+
+
+def _profile_options(module):
+    return importlib.import_module(module).DATABASES['default'].get('OPTIONS', {})
+
+
+def _connect(path, options):
+    """Open a connection the way Django's SQLite backend does for these OPTIONS."""
+    connection = sqlite3.connect(path, timeout=options.get('timeout', 5), isolation_level=None)
+    for command in options.get('init_command', '').split(';'):
+        if command.strip():
+            connection.execute(command)
+    return connection
+
+
+def _create_database(path, options):
+    connection = _connect(path, options)
+    connection.executescript("""
+        CREATE TABLE batch (id INTEGER PRIMARY KEY, current_quantity INTEGER NOT NULL);
+        CREATE TABLE sale_item (id INTEGER PRIMARY KEY, batch_id INTEGER NOT NULL, quantity INTEGER NOT NULL);
+    """)
+    connection.executemany(
+        "INSERT INTO batch (id, current_quantity) VALUES (?, ?)",
+        [(pk, 10 ** 9) for pk in range(1, BENCHMARK_BATCHES + 1)],
+    )
+    connection.close()
+
+
+def _client(path, options, operations, read_share, seed):
+    """
+    One simulated gunicorn worker: sales that read then update stock, and report reads.
+
+    Returns ``(completed, locked)``, the operations that succeeded and those
+    that failed with "database is locked".
+    """
+    connection = _connect(path, options)
+    begin = f"BEGIN {options.get('transaction_mode') or ''}".strip()
+    rng = random.Random(seed)
+    completed = locked = 0
+    for _ in range(operations):
+        try:
+            if rng.random() < read_share:
+                connection.execute("SELECT COUNT(*), SUM(quantity) FROM sale_item").fetchone()
+            else:
+                # Same shape as commit_sale: check stock, then write
+                batch = rng.randint(1, BENCHMARK_BATCHES)
+                connection.execute(begin)
+                try:
+                    connection.execute("SELECT current_quantity FROM batch WHERE id = ?", [batch]).fetchone()
+                    connection.execute(
+                        "UPDATE batch SET current_quantity = current_quantity - 1 WHERE id = ?", [batch]
+                    )
+                    connection.execute("INSERT INTO sale_item (batch_id, quantity) VALUES (?, 1)", [batch])
+                    connection.execute("COMMIT")
+                except sqlite3.Error:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    raise
+            completed += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    connection.close()
+    return completed, locked
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the \"database is locked\" rate of concurrent sales and report reads "
+        "under the default and the production SQLite settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help="Concurrent client processes.")
+        parser.add_argument('--operations', type=int, default=500, help="Operations per process.")
+        parser.add_argument(
+            '--read-share', type=float, default=0.5, help="Fraction of operations that are report reads."
+        )
+        parser.add_argument(
+            '--profile', choices=sorted(PROFILES), action='append',
+            help="Profile to run; repeat for several. Defaults to all of them.",
+        )
+
+    def handle(self, *args, **options):
+        processes = max(options['processes'], 1)
+        self.stdout.write(
+            f"{processes} process(es) x {options['operations']} operation(s), "
+            f"{options['read_share']:.0%} reads, {BENCHMARK_BATCHES} batches"
+        )
+        self.stdout.write(f"{'profile':<12}{'completed':>10}{'locked':>10}{'lock rate':>11}{'ops/s':>10}")
+
+        for profile in options['profile'] or PROFILES:
+            db_options = _profile_options(PROFILES[profile])
+            with tempfile.TemporaryDirectory() as directory:
+                path = str(Path(directory) / 'benchmark.sqlite3')
+                _create_database(path, db_options)
+                started = time.perf_counter()
+                with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+                    results = list(pool.map(
+                        _client,
+                        [path] * processes,
+                        [db_options] * processes,
+                        [options['operations']] * processes,
+                        [options['read_share']] * processes,
+                        range(processes),
+                    ))
+                elapsed = time.perf_counter() - started
+
+            completed = sum(done for done, _ in results)
+            locked = sum(failed for _, failed in results)
+            total = completed + locked
+            self.stdout.write(
+                f"{profile:<12}{completed:>10}{locked:>10}{locked / total:>11.2%}{completed / elapsed:>10.0f}"
+            )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from medicine.services import EXPIRY_SWEEP_CHUNK_SIZE, expire_batches
+
+
+class Command(BaseCommand):
+    help = "Deactivate expired batches, recording a write-off of their remaining stock. Meant to run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Treat batches expiring before this date (YYYY-MM-DD) as expired; defaults to today.")
+        parser.add_argument('--chunk-size', type=int, default=EXPIRY_SWEEP_CHUNK_SIZE, help="Batches deactivated per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be written off.")
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            today = parse_date(options['date'])
+            if today is None:
+                raise CommandError("--date must be a date in YYYY-MM-DD format.")
+
+        batches, quantity, value = expire_batches(
+            today=today, chunk_size=options['chunk_size'], dry_run=options['dry_run']
+        )
+        verb = "Would write off" if options['dry_run'] else "Wrote off"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {quantity} unit(s) worth {value} from {batches} expired batch(es)."
+        ))
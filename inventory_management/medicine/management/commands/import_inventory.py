@@ -0,0 +1,50 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicine.imports import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, import_format, import_inventory
+from medicine.models import MedicineUser
+
+
+class Command(BaseCommand):
+    help = "Import medicines and batches for one user from a CSV or JSON-lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument('--user', required=True, help="Email of the user who owns the imported stock.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="Input format; guessed from the file name by default.")
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help="Rows written per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and report without saving anything.")
+
+    def handle(self, *args, **options):
+        try:
+            user = MedicineUser.objects.get(email=options['user'])
+        except MedicineUser.DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}.")
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+                result = import_inventory(
+                    user,
+                    stream,
+                    options['format'] or import_format(options['path']),
+                    dry_run=options['dry_run'],
+                    chunk_size=options['chunk_size'],
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Chunks read before the error are already saved, unless this is a dry run
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        for row, message in result.errors:
+            self.stderr.write(f"Row {row}: {message}")
+        summary = (
+            f"{result.rows} row(s): {result.medicines_created} new medicine(s), "
+            f"{result.medicines_updated} updated medicine(s), {result.batches_created} new batch(es)."
+        )
+        if result.dry_run:
+            summary = f"Dry run, nothing saved. {summary}"
+        self.stdout.write(self.style.SUCCESS(summary) if result.ok else self.style.WARNING(summary))
+        if not result.ok:
+            raise CommandError(f"{len(result.errors)} row(s) were rejected.")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from medicine.services import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild the daily sales rollup from the recorded sale items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only rebuild the rollup of one user id.")
+        parser.add_argument('--since', help="Only rebuild days on or after this date (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError("--since must be a date in YYYY-MM-DD format.")
+
+        deleted, created = rebuild_daily_sales(user_id=options['user'], since=since)
+        self.stdout.write(self.style.SUCCESS(f"Replaced {deleted} rollup row(s) with {created}."))
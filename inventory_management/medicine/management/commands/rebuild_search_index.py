@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from medicine.search import create_index, fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Create the medicine full-text search index if missing and repopulate it from the catalog."
+
+    def handle(self, *args, **options):
+        if not fts_available() and not create_index():
+            raise CommandError("This database does not support SQLite FTS5; search uses substring matching.")
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the medicine search index."))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from medicine.models import Medicine, MedicineBatch
+
+
+class Command(BaseCommand):
+    help = "Check the stored per-medicine stock totals against the active batches and rebuild them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report medicines whose stored total has drifted; exit with an error if any have.",
+        )
+        parser.add_argument('--user', type=int, help="Limit to the medicines of one user id.")
+
+    def handle(self, *args, **options):
+        active_stock = MedicineBatch.objects.filter(
+            medicine=OuterRef('pk'),
+            is_active=True
+        ).values('medicine').annotate(total=Sum('current_quantity')).values('total')[:1]
+
+        medicines = Medicine.objects.all()
+        if options['user']:
+            medicines = medicines.filter(user_id=options['user'])
+
+        with transaction.atomic():
+            drifted = medicines.annotate(
+                actual_stock=Coalesce(Subquery(active_stock), 0)
+            ).exclude(stock_on_hand=F('actual_stock'))
+
+            rows = list(drifted.values_list('pk', 'name', 'stock_on_hand', 'actual_stock'))
+            for pk, name, stored, actual in rows:
+                self.stdout.write(f"{name} (#{pk}): stored {stored}, actual {actual}")
+
+            if options['check']:
+                if rows:
+                    raise CommandError(f"{len(rows)} medicine stock total(s) out of date.")
+                self.stdout.write(self.style.SUCCESS("All stock totals are up to date."))
+                return
+
+            if rows:
+                medicines.filter(pk__in=[row[0] for row in rows]).update(
+                    stock_on_hand=Coalesce(Subquery(active_stock), 0)
+                )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} stock total(s)."))
@@ -0,0 +1,60 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from medicine.jobs import maintain_jobs, run_pending_jobs, worker_loop
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (exports, imports, reports) with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help="Worker processes to run.")
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'JOB_POLL_INTERVAL', 2),
+            help="Seconds an idle worker waits before checking the queue again.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Run the jobs queued right now in this process, then exit (e.g. from cron).",
+        )
+
+    def handle(self, *args, **options):
+        requeued, deleted = maintain_jobs()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} abandoned job(s)."))
+        if deleted:
+            self.stdout.write(f"Deleted {deleted} expired job(s).")
+
+        if options['once']:
+            ran = run_pending_jobs()
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} job(s)."))
+            return
+
+        # Forked workers must open their own connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        workers = [
+            context.Process(target=worker_loop, args=(stop, options['poll_interval']), name=f'job-worker-{i}')
+            for i in range(max(options['processes'], 1))
+        ]
+        for worker in workers:
+            worker.start()
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        self.stdout.write(f"Started {len(workers)} worker(s); stopping after the current jobs on Ctrl-C.")
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped."))
@@ -0,0 +1,202 @@
+import atexit
+import json
+import math
+import os
+import threading
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+# Every metric the app exports: name -> (type, help)
+METRICS = {
+    'pharmacy_http_requests_total': ('counter', 'HTTP requests handled, by view, method and status.'),
+    'pharmacy_http_request_duration_seconds': ('histogram', 'Time to build a response, by view.'),
+    'pharmacy_db_queries_total': ('counter', 'SQL queries run while handling requests, by view.'),
+    'pharmacy_sales_committed_total': ('counter', 'Sales recorded.'),
+    'pharmacy_units_sold_total': ('counter', 'Units sold across all sale lines.'),
+    'pharmacy_stock_update_conflicts_total': (
+        'counter', 'Conditional stock updates that lost a race with a concurrent write, by operation.'
+    ),
+    'pharmacy_cache_requests_total': ('counter', 'Cache lookups, by cache and hit or miss.'),
+}
+
+# Upper bounds in seconds of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Most seconds a process's new samples wait before they are written to its file
+METRICS_FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+
+def _configured_dir():
+    return Path(getattr(settings, 'METRICS_DIR', Path(settings.BASE_DIR) / 'metrics'))
+
+
+def metrics_dir():
+    path = _configured_dir()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _process_exists(pid):
+    if os.name != 'posix':
+        # Without signal 0 there is no cheap check; keep every file
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    This process's samples, written now and then to a file of its own.
+
+    Every gunicorn worker keeps its own file in ``METRICS_DIR``, so they never
+    contend for a lock; ``collect`` adds the files up. New samples are
+    written within ``METRICS_FLUSH_INTERVAL`` seconds even when no request
+    follows, and at exit. A scrape folds the files of workers that have
+    exited into the scraping worker's own, so counters never go backwards
+    and the directory does not grow with every restart.
+
+    The directory is fixed when the registry is created, so a pending flush
+    never writes into a directory swapped in later.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory is not None else _configured_dir()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # Unique per process start: a recycled pid must not overwrite an old file
+        self.file_name = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.samples = defaultdict(float)
+        self._timer = None
+
+    def _check_process(self):
+        if os.getpid() != self.pid:
+            # A forked worker starts from zero; its parent still owns the inherited samples
+            self._reset()
+
+    def add(self, name, labels, amount):
+        with self._lock:
+            self._check_process()
+            self.samples[name, tuple(sorted(labels.items()))] += amount
+            if self._timer is None:
+                # Idle workers must still write their last samples
+                self._timer = threading.Timer(METRICS_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / self.file_name
+        temporary = path.with_suffix('.tmp')
+        with open(temporary, 'w', encoding='utf-8') as stream:
+            json.dump([[name, labels, value] for (name, labels), value in self.samples.items()], stream)
+        # Readers only ever see a complete file
+        os.replace(temporary, path)
+
+    def flush(self):
+        with self._lock:
+            self._check_process()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.samples:
+                self._flush()
+
+    def _adopt_exited(self):
+        """Add the samples of exited workers to this process's and delete their files."""
+        for path in self.directory.glob('*.json'):
+            pid = path.name.split('-', 1)[0]
+            if path.name == self.file_name or not pid.isdigit() or _process_exists(int(pid)):
+                continue
+            claimed = path.with_name(f'{path.name}.{self.pid}.adopting')
+            try:
+                # Only one of several concurrent scrapes can take the file
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                samples = json.loads(claimed.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                samples = []
+            with self._lock:
+                self._check_process()
+                for name, labels, value in samples:
+                    self.samples[name, tuple(tuple(label) for label in labels)] += value
+                self._flush()
+            claimed.unlink(missing_ok=True)
+
+    def collect(self):
+        """Samples of every worker, from their files after this process has written its own."""
+        self._adopt_exited()
+        self.flush()
+        totals = defaultdict(float)
+        for path in self.directory.glob('*.json'):
+            try:
+                samples = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in samples:
+                totals[name, tuple(tuple(label) for label in labels)] += value
+        return totals
+
+
+registry = Registry()
+# Counts since the last flush would otherwise be lost when a worker exits
+atexit.register(registry.flush)
+
+
+def inc(name, amount=1, **labels):
+    """Add ``amount`` to a counter."""
+    registry.add(name, labels, amount)
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram."""
+    for bound in DURATION_BUCKETS:
+        if value <= bound:
+            registry.add(f'{name}_bucket', {**labels, 'le': str(bound)}, 1)
+    registry.add(f'{name}_bucket', {**labels, 'le': '+Inf'}, 1)
+    registry.add(f'{name}_sum', labels, value)
+    registry.add(f'{name}_count', labels, 1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _sample_order(item):
+    (name, labels), _ = item
+    labels = dict(labels)
+    bound = labels.pop('le', None)
+    return name, sorted(labels.items()), math.inf if bound in (None, '+Inf') else float(bound)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    samples = sorted(registry.collect().items(), key=_sample_order)
+    lines = []
+    for family, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        names = {family} if kind != 'histogram' else {f'{family}_bucket', f'{family}_sum', f'{family}_count'}
+        for (name, labels), value in samples:
+            if name not in names:
+                continue
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+            series = f'{name}{{{label_text}}}' if label_text else name
+            lines.append(f'{series} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,175 @@
+import cProfile
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+from .profiling import save_capture
+
+logger = logging.getLogger('medicine.sql')
+
+
+class QueryStats:
+    """Execute wrapper that records the queries one request runs, on every connection."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.slowest = (0.0, '')
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.statements[sql] += 1
+            if duration > self.slowest[0]:
+                self.slowest = (duration, sql)
+
+    @property
+    def duplicates(self):
+        """Executions of a statement beyond its first: N+1 loops show up here."""
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        return self.statements.most_common(1)[0] if self.statements else ('', 0)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Report each request's SQL as ``Server-Timing`` headers and a log line.
+
+    Records the query count, total SQL time, repeated statements and the
+    slowest statement, and logs a warning when a request goes over
+    ``SQL_QUERY_BUDGET`` queries or ``SQL_TIME_BUDGET_MS`` of SQL. With
+    ``SQL_INSTRUMENTATION`` off the middleware removes itself at startup.
+    Queries run while a streaming response is sent are not counted.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'SQL_QUERY_BUDGET', 50)
+        self.time_budget = getattr(settings, 'SQL_TIME_BUDGET_MS', 200) / 1000
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        slowest, slowest_sql = stats.slowest
+        response.headers['Server-Timing'] = ', '.join(filter(None, [
+            response.headers.get('Server-Timing'),
+            f'total;dur={total * 1000:.1f}',
+            f'sql;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"',
+            f'sql-slowest;dur={slowest * 1000:.1f}',
+            f'sql-duplicates;desc="{stats.duplicates} repeated"',
+        ]))
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'sql_ms': round(stats.duration * 1000, 1),
+            'duplicates': stats.duplicates,
+            'slowest_ms': round(slowest * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+        }
+        message = ' '.join(f'{key}={value}' for key, value in record.items())
+        if stats.count > self.query_budget or stats.duration > self.time_budget:
+            repeated_sql, repeated = stats.most_repeated()
+            logger.warning(
+                "Over SQL budget: %s slowest=%r most_repeated=%r x%d",
+                message, slowest_sql, repeated_sql, repeated, extra={'sql': record},
+            )
+        else:
+            logger.info(message, extra={'sql': record})
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Run a request under cProfile and save the capture for the admin.
+
+    Staff users ask for a capture with ``?profile=1`` or an ``X-Profile: 1``
+    header; ``PROFILE_SAMPLE_RATE`` also profiles that fraction of all other
+    requests. The view, its template rendering and the middleware below
+    this one are inside the capture, so it must come after
+    AuthenticationMiddleware. The capture id is sent back in
+    ``X-Profile-Capture``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+
+    def _requested(self, request):
+        flagged = request.GET.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+        # Only look the user up when the flag is there
+        return flagged and request.user.is_staff
+
+    def __call__(self, request):
+        requested = self._requested(request)
+        sampled = not requested and random.random() < self.sample_rate
+        if not (requested or sampled):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        response = profiler.runcall(self.get_response, request)
+        duration = time.perf_counter() - start
+        capture = save_capture(profiler, request, response, duration, sampled=sampled)
+        response.headers['X-Profile-Capture'] = str(capture.pk)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Count and time every request, with the SQL queries it ran, per view for ``/metrics``.
+
+    Goes first in ``MIDDLEWARE`` so the latency covers the whole stack.
+    Requests that match no URL are labelled ``unmatched``; scrapes of
+    ``/metrics`` itself are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_query))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        if view != 'metrics':
+            metrics.inc('pharmacy_http_requests_total', view=view, method=request.method, status=response.status_code)
+            metrics.observe('pharmacy_http_request_duration_seconds', duration, view=view)
+            metrics.inc('pharmacy_db_queries_total', queries, view=view)
+        return response
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_stock_on_hand(apps, schema_editor):
+    Medicine = apps.get_model('medicine', 'Medicine')
+    MedicineBatch = apps.get_model('medicine', 'MedicineBatch')
+    active_stock = MedicineBatch.objects.filter(
+        medicine=OuterRef('pk'),
+        is_active=True
+    ).values('medicine').annotate(total=Sum('current_quantity')).values('total')[:1]
+    Medicine.objects.update(stock_on_hand=Coalesce(Subquery(active_stock), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0006_alter_medicine_name_alter_sale_total_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='stock_on_hand',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_stock_on_hand, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0007_medicine_stock_on_hand'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['user', 'name'], name='medicine_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'expiry_date'], name='batch_user_active_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['medicine', 'expiry_date', 'current_quantity'], name='batch_medicine_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(condition=models.Q(('current_quantity__gt', 0), ('is_active', True)), fields=['user', 'expiry_date'], name='batch_sellable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['user', '-sale_date'], name='sale_user_date_idx'),
+        ),
+    ]
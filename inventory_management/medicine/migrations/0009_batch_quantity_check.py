@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0008_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='medicinebatch',
+            constraint=models.CheckConstraint(condition=models.Q(('current_quantity__gte', 0)), name='batch_current_quantity_non_negative'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0009_batch_quantity_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicinebatch',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(fields=['user', 'updated_at'], name='batch_user_updated_idx'),
+        ),
+    ]
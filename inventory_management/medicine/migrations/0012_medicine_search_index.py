@@ -0,0 +1,75 @@
+from django.db import OperationalError, migrations, transaction
+
+# The DDL is spelled out here rather than imported from medicine.search, so
+# later edits to that module cannot change what this migration did.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS medicine_medicine_fts USING fts5(
+        name, generic_name, category, description, user_id UNINDEXED,
+        content='medicine_medicine', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS medicine_medicine_fts_ai AFTER INSERT ON medicine_medicine BEGIN
+        INSERT INTO medicine_medicine_fts(rowid, name, generic_name, category, description, user_id)
+        VALUES (new.id, new.name, new.generic_name, new.category, new.description, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS medicine_medicine_fts_ad AFTER DELETE ON medicine_medicine BEGIN
+        INSERT INTO medicine_medicine_fts(medicine_medicine_fts, rowid, name, generic_name, category, description, user_id)
+        VALUES ('delete', old.id, old.name, old.generic_name, old.category, old.description, old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS medicine_medicine_fts_au
+    AFTER UPDATE OF name, generic_name, category, description, user_id ON medicine_medicine BEGIN
+        INSERT INTO medicine_medicine_fts(medicine_medicine_fts, rowid, name, generic_name, category, description, user_id)
+        VALUES ('delete', old.id, old.name, old.generic_name, old.category, old.description, old.user_id);
+        INSERT INTO medicine_medicine_fts(rowid, name, generic_name, category, description, user_id)
+        VALUES (new.id, new.name, new.generic_name, new.category, new.description, new.user_id);
+    END
+    """,
+    "INSERT INTO medicine_medicine_fts(medicine_medicine_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS medicine_medicine_fts_ai",
+    "DROP TRIGGER IF EXISTS medicine_medicine_fts_ad",
+    "DROP TRIGGER IF EXISTS medicine_medicine_fts_au",
+    "DROP TABLE IF EXISTS medicine_medicine_fts",
+]
+
+
+class SQLiteFTSRunSQL(migrations.RunSQL):
+    """
+    RunSQL that only runs on SQLite with FTS5.
+
+    Other backends, and SQLite builds without FTS5, keep the substring
+    search fallback.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                super().database_forwards(app_label, schema_editor, from_state, to_state)
+        except OperationalError:
+            pass
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0011_daily_sales_summary'),
+    ]
+
+    operations = [
+        SQLiteFTSRunSQL(CREATE_SQL, DROP_SQL),
+    ]
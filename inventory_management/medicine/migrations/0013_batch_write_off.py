@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0012_medicine_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchWriteOff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('expired', 'Expired')], default='expired', max_length=20)),
+                ('quantity', models.PositiveIntegerField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('written_off_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='write_offs', to='medicine.medicinebatch')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='write_offs', to='medicine.medicine')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='write_offs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'written_off_at'], name='writeoff_user_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0014_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicinebatch',
+            name='purchase_order_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batches', to='medicine.purchaseorderitem'),
+        ),
+        migrations.AddField(
+            model_name='purchaseorderitem',
+            name='received_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
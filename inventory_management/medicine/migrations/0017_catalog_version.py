@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0016_profile_capture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='medicinebatch',
+            name='batch_user_updated_idx',
+        ),
+        migrations.AddField(
+            model_name='medicinebatch',
+            name='sync_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(fields=['user', 'sync_version'], name='batch_user_sync_version_idx'),
+        ),
+    ]
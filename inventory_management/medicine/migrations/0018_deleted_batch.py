@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicine', '0017_catalog_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.PositiveBigIntegerField()),
+                ('sync_version', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='deleted_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'sync_version'], name='deleted_batch_user_version_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
 # models.py
 from django.db import models,transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
@@ -66,6 +68,79 @@ class MedicineUser(AbstractUser):
         verbose_name_plural = 'Users'
 
 
+class MedicineQuerySet(models.QuerySet):
+    def with_stock(self):
+        """Annotate each medicine with the summed quantity of its active batches."""
+        active_stock = MedicineBatch.objects.filter(
+            medicine=OuterRef('pk'),
+            is_active=True
+        ).values('medicine').annotate(total=Sum('current_quantity')).values('total')[:1]
+        return self.annotate(active_stock=Coalesce(Subquery(active_stock), 0))
+
+    def low_stock(self):
+        """Medicines whose active stock is below their minimum stock level."""
+        queryset = self if 'active_stock' in self.query.annotations else self.with_stock()
+        return queryset.filter(active_stock__lt=F('minimum_stock'))
+
+    def alert_summary(self, windows=None, risk_window=None):
+        """
+        Expiry and stock alert counts for these medicines in one aggregate query.
+
+        Returns expired and out-of-stock/low-stock counts, the number of batches
+        expiring within each of ``windows`` days (keyed by days), and the
+        purchase value of active stock that is expired or expires within
+        ``risk_window`` days, which is always one of the windows.
+        """
+        risk_window = risk_window or getattr(settings, 'EXPIRY_ALERT_DAYS', 30)
+        windows = sorted({*(windows or getattr(settings, 'EXPIRY_ALERT_WINDOWS', (7, 30, 90))), risk_window})
+        today = timezone.now().date()
+        active = Q(batches__is_active=True)
+
+        aggregates = {
+            'expired': Count('batches', filter=active & Q(batches__expiry_date__lt=today)),
+            'out_of_stock': Count('pk', filter=Q(stock_on_hand=0), distinct=True),
+            'low_stock': Count('pk', filter=Q(stock_on_hand__lt=F('minimum_stock')), distinct=True),
+            'value_at_risk': Sum(
+                F('batches__current_quantity') * F('batches__purchase_price'),
+                filter=active & Q(batches__expiry_date__lte=today + timedelta(days=risk_window)),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+        }
+        for days in windows:
+            aggregates[f'expiring_{days}'] = Count('batches', filter=active & Q(
+                batches__expiry_date__gte=today,
+                batches__expiry_date__lte=today + timedelta(days=days),
+            ))
+
+        summary = self.aggregate(**aggregates)
+        return {
+            'expired': summary['expired'],
+            'expiring': {days: summary[f'expiring_{days}'] for days in windows},
+            'out_of_stock': summary['out_of_stock'],
+            'low_stock': summary['low_stock'],
+            'value_at_risk': summary['value_at_risk'] or 0,
+        }
+
+    def with_expired_batches(self):
+        """Medicines that have at least one active batch past its expiry date."""
+        today = timezone.now().date()
+        return self.filter(Exists(MedicineBatch.objects.filter(
+            medicine=OuterRef('pk'),
+            expiry_date__lt=today,
+            is_active=True
+        )))
+
+    def with_expiring_batches(self, days=30):
+        """Medicines that have an active batch expiring within the next ``days`` days."""
+        today = timezone.now().date()
+        return self.filter(Exists(MedicineBatch.objects.filter(
+            medicine=OuterRef('pk'),
+            expiry_date__gte=today,
+            expiry_date__lte=today + timedelta(days=days),
+            is_active=True
+        )))
+
+
 class Medicine(models.Model):
     name = models.CharField(max_length=100)
     generic_name = models.CharField(max_length=100, blank=True, null=True)
@@ -74,13 +149,53 @@ class Medicine(models.Model):
     minimum_stock = models.PositiveIntegerField(default=10)
     supplier = models.TextField(max_length=50)
     user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='medicines')
+    # Denormalized sum of current_quantity over active batches, maintained by MedicineBatch
+    stock_on_hand = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = MedicineQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # stock_on_hand is owned by the batch write path, so never write back a stale copy of it
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'stock_on_hand'
+            ]
+        with transaction.atomic():
+            renamed = (
+                not self._state.adding
+                and 'name' in (kwargs.get('update_fields') or ['name'])
+                and Medicine.objects.filter(pk=self.pk).exclude(name=self.name).exists()
+            )
+            super().save(*args, **kwargs)
+            if renamed:
+                # The catalog sends the medicine name with every batch row
+                self.batches.update(sync_version=CatalogVersion.next(), updated_at=timezone.now())
+
+    @classmethod
+    def adjust_stock(cls, medicine_id, delta):
+        """Apply a stock delta to the stored total with a single UPDATE."""
+        if delta:
+            cls.objects.filter(pk=medicine_id).update(stock_on_hand=F('stock_on_hand') + delta)
+
+    def calculate_stock(self):
+        """Recompute the stock total from the active batches."""
+        return self.batches.filter(is_active=True).aggregate(
+            total=Sum('current_quantity')
+        )['total'] or 0
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name'], name='medicine_user_name_idx'),
+        ]
+
     @property
     def current_stock(self):
-        return sum(batch.current_quantity for batch in self.batches.filter(is_active=True))
+        # Prefer the value annotated by MedicineQuerySet.with_stock() when the row carries it
+        return getattr(self, 'active_stock', self.stock_on_hand)
 
     @property
     def is_low_stock(self):
@@ -102,6 +217,27 @@ class Medicine(models.Model):
         )
 
 
+class CatalogVersion(models.Model):
+    """
+    Counter that orders batch changes for catalog sync.
+
+    Every transaction that changes batches stamps them with ``next()``.
+    Taking a value writes this row, which holds the write lock until the
+    transaction commits, so versions follow commit order; timestamps taken
+    before the lock do not.
+    """
+    value = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def next(cls):
+        """Take the next version; call it inside the transaction that writes the batches."""
+        if not cls.objects.filter(pk=1).update(value=F('value') + 1):
+            # The UPDATE already holds the write lock, so no one else can create the row meanwhile
+            cls.objects.create(pk=1, value=1)
+            return 1
+        return cls.objects.values_list('value', flat=True).get(pk=1)
+
+
 class MedicineBatch(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='batches')
     user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='medicine_batches')
@@ -114,10 +250,92 @@ class MedicineBatch(models.Model):
     current_quantity = models.PositiveIntegerField()
     received_date = models.DateField(default=timezone.now)
     is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Change cursor for catalog sync; bulk writes of the batch must set it from CatalogVersion.next()
+    sync_version = models.PositiveBigIntegerField(default=0, editable=False)
+    # Purchase order line the batch was received against, if any
+    purchase_order_item = models.ForeignKey(
+        'PurchaseOrderItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='batches'
+    )
 
     def __str__(self):
         return f"{self.medicine.name} - {self.batch_number}"
 
+    @classmethod
+    def deduct_stock(cls, batch_id, quantity):
+        """
+        Take ``quantity`` units from a batch with one conditional UPDATE.
+
+        Returns False, leaving the batch untouched, when it holds fewer than
+        ``quantity`` units, so concurrent sales can never oversell it.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(pk=batch_id, current_quantity__gte=quantity).update(
+                current_quantity=F('current_quantity') - quantity,
+                updated_at=timezone.now(),
+            )
+            if updated:
+                # Only a deduction that happened moves the catalog cursor
+                cls.objects.filter(pk=batch_id).update(sync_version=CatalogVersion.next())
+                cls._adjust_medicine_stock(batch_id, -quantity)
+            return bool(updated)
+
+    @classmethod
+    def restock(cls, batch_id, quantity):
+        """Return ``quantity`` units to a batch, e.g. when a sale item is removed."""
+        with transaction.atomic():
+            cls.objects.filter(pk=batch_id).update(
+                current_quantity=F('current_quantity') + quantity,
+                sync_version=CatalogVersion.next(),
+                updated_at=timezone.now(),
+            )
+            cls._adjust_medicine_stock(batch_id, quantity)
+
+    @staticmethod
+    def _adjust_medicine_stock(batch_id, delta):
+        # Only active batches count towards the stored total
+        Medicine.objects.filter(batches__pk=batch_id, batches__is_active=True).update(
+            stock_on_hand=F('stock_on_hand') + delta
+        )
+
+    @property
+    def stock_contribution(self):
+        """Quantity this batch adds to its medicine's stock total."""
+        return self.current_quantity if self.is_active else 0
+
+    def save(self, *args, **kwargs):
+        """Save the batch and keep the medicine's stock total in step."""
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = MedicineBatch.objects.filter(pk=self.pk).values(
+                    'medicine_id', 'current_quantity', 'is_active'
+                ).first()
+
+            self.sync_version = CatalogVersion.next()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'sync_version'}
+            super().save(*args, **kwargs)
+
+            if previous is None:
+                Medicine.adjust_stock(self.medicine_id, self.stock_contribution)
+                return
+
+            old_contribution = previous['current_quantity'] if previous['is_active'] else 0
+            if previous['medicine_id'] != self.medicine_id:
+                Medicine.adjust_stock(previous['medicine_id'], -old_contribution)
+                Medicine.adjust_stock(self.medicine_id, self.stock_contribution)
+            else:
+                Medicine.adjust_stock(self.medicine_id, self.stock_contribution - old_contribution)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            stored_quantity = MedicineBatch.objects.filter(pk=self.pk, is_active=True).values_list(
+                'current_quantity', flat=True
+            ).first()
+            Medicine.adjust_stock(self.medicine_id, -(stored_quantity or 0))
+            return super().delete(*args, **kwargs)
+
     @property
     def is_expired(self):
         return self.expiry_date < timezone.now().date()
@@ -131,6 +349,50 @@ class MedicineBatch(models.Model):
 
     class Meta:
         verbose_name_plural = "Medicine Batches"
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(current_quantity__gte=0),
+                name='batch_current_quantity_non_negative',
+            ),
+        ]
+        indexes = [
+            # Dashboard counts and expiry alerts: active batches by user and expiry range
+            models.Index(
+                fields=['user', 'expiry_date'],
+                name='batch_user_active_expiry_idx',
+                condition=Q(is_active=True),
+            ),
+            # Per-medicine stock sums and expiry lookups, covering current_quantity
+            models.Index(
+                fields=['medicine', 'expiry_date', 'current_quantity'],
+                name='batch_medicine_active_idx',
+                condition=Q(is_active=True),
+            ),
+            # Catalog delta sync: batches changed since a cursor
+            models.Index(fields=['user', 'sync_version'], name='batch_user_sync_version_idx'),
+            # Sale form batch picker: only sellable rows are indexed
+            models.Index(
+                fields=['user', 'expiry_date'],
+                name='batch_sellable_idx',
+                condition=Q(is_active=True, current_quantity__gt=0),
+            ),
+        ]
+
+
+class DeletedBatch(models.Model):
+    """Tombstone of a deleted batch, so catalog delta clients drop it as well."""
+    batch_id = models.PositiveBigIntegerField()
+    # No constraint: deleting a user cascades to its batches, whose tombstones are written meanwhile
+    user = models.ForeignKey(
+        MedicineUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='deleted_batches'
+    )
+    sync_version = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'sync_version'], name='deleted_batch_user_version_idx'),
+        ]
 
 
 class Sale(models.Model):
@@ -141,6 +403,11 @@ class Sale(models.Model):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='sales')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-sale_date'], name='sale_user_date_idx'),
+        ]
+
     def clean(self):
         """Validate the sale."""
         if not self.invoice_number:
@@ -154,14 +421,7 @@ class Sale(models.Model):
             raise ValidationError({'invoice_number': 'This invoice number is already in use.'})
     
     def save(self, *args, **kwargs):
-        """Save the sale and update the stock."""
-        # First, save the Sale object to generate a primary key
-        if not self.pk:  # Only save if it's a new instance (without pk)
-            super().save(*args, **kwargs)
-
-        # Calculate the total_amount after the Sale instance has a primary key
-
-        # Save again with the calculated total_amount
+        """Save the sale. total_amount is computed by the caller before saving."""
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -185,14 +445,15 @@ class SaleItem(models.Model):
      if not self.medicine_batch_id:
         raise ValidationError({'medicine_batch': 'Medicine batch is required.'})
 
-     if self.quantity <= 0:
+     # A missing quantity or price was already rejected by form or field validation
+     if self.quantity is not None and self.quantity <= 0:
         raise ValidationError({'quantity': 'Quantity must be greater than zero.'})
 
-     if self.price <= 0:
+     if self.price is not None and self.price <= 0:
         raise ValidationError({'price': 'Price must be greater than zero.'})
 
     # Check if we have enough stock
-     if self.medicine_batch and self.medicine_batch.current_quantity < self.quantity:
+     if self.medicine_batch and self.quantity is not None and self.medicine_batch.current_quantity < self.quantity:
         raise ValidationError({
             'quantity': f'Not enough stock. Available: {self.medicine_batch.current_quantity}'
         })
@@ -223,17 +484,19 @@ class SaleItem(models.Model):
                 # Calculate the change in quantity
                 qty_change = self.quantity - old_quantity
                 
-                # Update the batch stock
-                batch = self.medicine_batch
-                batch.current_quantity -= qty_change
-                batch.save()
+                # Update the batch stock in place, refusing to oversell
+                if qty_change > 0 and not MedicineBatch.deduct_stock(self.medicine_batch_id, qty_change):
+                    self.medicine_batch.refresh_from_db(fields=['current_quantity'])
+                    raise ValidationError({
+                        'quantity': f'Not enough stock. Available: {self.medicine_batch.current_quantity}'
+                    })
+                if qty_change < 0:
+                    MedicineBatch.restock(self.medicine_batch_id, -qty_change)
     
     def delete(self, *args, **kwargs):
     
      with transaction.atomic():
-        batch = self.medicine_batch
-        batch.current_quantity += self.quantity
-        batch.save()
+        MedicineBatch.restock(self.medicine_batch_id, self.quantity)
         super().delete(*args, **kwargs)
 
     
@@ -242,7 +505,165 @@ class SaleItem(models.Model):
 
 
 
+class DailySalesSummary(models.Model):
+    """
+    Per-user daily sales rollup, kept up to date by the sale commit path and
+    rebuilt for the affected days by admin edits of sales and sale items.
+
+    Rows with no medicine hold the day's totals; rows with a medicine hold
+    that medicine's share of the day.
+    """
+    user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Daily Sales Summaries"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date'],
+                condition=Q(medicine__isnull=True),
+                name='daily_sales_user_date_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'date', 'medicine'],
+                condition=Q(medicine__isnull=False),
+                name='daily_sales_user_date_medicine_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.medicine or 'All medicines'}"
+
+
+class BatchWriteOff(models.Model):
+    """Stock taken out of the inventory when a batch was deactivated, e.g. by the expiry sweep."""
+    REASON_EXPIRED = 'expired'
+    REASON_CHOICES = [(REASON_EXPIRED, 'Expired')]
+
+    batch = models.ForeignKey(MedicineBatch, on_delete=models.CASCADE, related_name='write_offs')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='write_offs')
+    user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='write_offs')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default=REASON_EXPIRED)
+    quantity = models.PositiveIntegerField()
+    # Purchase value of the written-off quantity
+    value = models.DecimalField(max_digits=14, decimal_places=2)
+    written_off_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'written_off_at'], name='writeoff_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.batch} - {self.quantity} written off"
+
+
+class Job(models.Model):
+    """A unit of background work queued by a view and run by ``manage.py run_workers``."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.TextField(blank=True)
+    # Path of the result file relative to settings.JOB_RESULTS_DIR
+    result_file = models.CharField(max_length=255, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Bumped with every progress report, so a job whose worker died can be spotted
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued job
+            models.Index(fields=['created_at'], name='job_queued_idx', condition=Q(status='queued')),
+            models.Index(fields=['user', '-created_at'], name='job_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class ProfileCapture(models.Model):
+    """A cProfile capture of one request, taken by ``ProfilingMiddleware``."""
+    user = models.ForeignKey(
+        MedicineUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='profile_captures'
+    )
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    # Taken by PROFILE_SAMPLE_RATE rather than asked for by a staff user
+    sampled = models.BooleanField(default=False)
+    # File names relative to settings.PROFILE_DIR: pstats dump and collapsed stacks
+    stats_file = models.CharField(max_length=255)
+    stacks_file = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class PurchaseOrderQuerySet(models.QuerySet):
+    def with_receipt_totals(self):
+        """Annotate each order with the units ordered and received across its items."""
+        ordered = PurchaseOrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+            total=Sum('quantity')
+        ).values('total')[:1]
+        received = PurchaseOrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+            total=Sum('received_quantity')
+        ).values('total')[:1]
+        return self.annotate(
+            ordered_units=Coalesce(Subquery(ordered), 0),
+            received_units=Coalesce(Subquery(received), 0),
+        )
+
+    def with_status(self, status):
+        """Orders in one receiving status: 'ordered', 'partial' or 'received'."""
+        queryset = self if 'received_units' in self.query.annotations else self.with_receipt_totals()
+        if status == PurchaseOrder.ORDERED:
+            return queryset.filter(received_units=0)
+        if status == PurchaseOrder.PARTIAL:
+            return queryset.filter(received_units__gt=0, received_units__lt=F('ordered_units'))
+        if status == PurchaseOrder.RECEIVED:
+            return queryset.filter(received_units__gt=0, received_units__gte=F('ordered_units'))
+        return queryset
+
+
 class PurchaseOrder(models.Model):
+    ORDERED = 'ordered'
+    PARTIAL = 'partial'
+    RECEIVED = 'received'
+    STATUS_CHOICES = [
+        (ORDERED, 'Ordered'),
+        (PARTIAL, 'Partially received'),
+        (RECEIVED, 'Received'),
+    ]
     
     order_number = models.CharField(max_length=50, unique=True)
     supplier = models.TextField(max_length=50)
@@ -251,9 +672,26 @@ class PurchaseOrder(models.Model):
     notes = models.TextField(blank=True, null=True)
     user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='purchase_orders')
 
+    objects = PurchaseOrderQuerySet.as_manager()
+
     def __str__(self):
         return self.order_number
 
+    @property
+    def status(self):
+        """Receiving status, from the annotated totals when the row carries them."""
+        if hasattr(self, 'received_units'):
+            ordered, received = self.ordered_units, self.received_units
+        else:
+            totals = self.items.aggregate(ordered=Sum('quantity'), received=Sum('received_quantity'))
+            ordered, received = totals['ordered'] or 0, totals['received'] or 0
+        if not received:
+            return self.ORDERED
+        return self.RECEIVED if received >= ordered else self.PARTIAL
+
+    def get_status_display(self):
+        return dict(self.STATUS_CHOICES)[self.status]
+
 
 class PurchaseOrderItem(models.Model):
     order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='items')
@@ -261,6 +699,16 @@ class PurchaseOrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     user = models.ForeignKey(MedicineUser, on_delete=models.CASCADE, related_name='purchase_order_items')
+    # Units already booked in as batches; a delivery can be received over several visits
+    received_quantity = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return f"{self.order.order_number} - {self.medicine.name}"
\ No newline at end of file
+        return f"{self.order.order_number} - {self.medicine.name}"
+
+    @property
+    def outstanding_quantity(self):
+        return max(self.quantity - self.received_quantity, 0)
+
+    @property
+    def line_total(self):
+        return self.quantity * self.unit_price if self.unit_price is not None else None
\ No newline at end of file
@@ -0,0 +1,133 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+# Seconds an estimated total stays cached for a list page
+KEYSET_COUNT_CACHE_TIMEOUT = getattr(settings, 'KEYSET_COUNT_CACHE_TIMEOUT', 300)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _cursor_value(value):
+    # Full isoformat: DjangoJSONEncoder truncates microseconds, which would skip rows
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class KeysetPage:
+    """One page of a keyset-paginated list, with opaque tokens for its neighbours."""
+
+    def __init__(self, object_list, next_token=None, previous_token=None, estimated_total=None):
+        self.object_list = object_list
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.estimated_total = estimated_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginationMixin:
+    """
+    Paginate a ListView by seeking past the last row shown instead of using OFFSET.
+
+    ``keyset_ordering`` must be a unique ordering ending in the primary key,
+    e.g. ``('-sale_date', '-id')``, and every field in it must be non-null.
+    Page N costs the same as page 1 and no COUNT(*) runs per request; set
+    ``estimate_total`` to show a total that is counted at most once per
+    ``KEYSET_COUNT_CACHE_TIMEOUT``.
+    """
+    keyset_ordering = ('-id',)
+    cursor_kwarg = 'cursor'
+    estimate_total = False
+
+    def _keyset_fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.keyset_ordering]
+
+    def _encode_cursor(self, direction, obj):
+        values = [getattr(obj, name) for name, _ in self._keyset_fields()]
+        raw = json.dumps([direction, values], default=_cursor_value).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def _decode_cursor(self, token):
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            direction, values = json.loads(raw)
+            fields = self._keyset_fields()
+            if direction not in ('next', 'previous') or len(values) != len(fields):
+                raise ValueError
+            opts = self.model._meta
+            return direction, [opts.get_field(name).to_python(value) for (name, _), value in zip(fields, values)]
+        except Exception as e:
+            raise InvalidCursor from e
+
+    def _seek(self, values, forward):
+        """Rows strictly after ``values`` in the list order (or before it, going backward)."""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self._keyset_fields(), values):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _estimated_total(self, queryset):
+        params = self.request.GET.copy()
+        params.pop(self.cursor_kwarg, None)
+        key = f'keyset-total:{self.__class__.__name__}:{self.request.user.pk}:{params.urlencode()}'
+        total = cache.get(key)
+        if total is None:
+            total = queryset.count()
+            cache.set(key, total, KEYSET_COUNT_CACHE_TIMEOUT)
+        return total
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = list(self.keyset_ordering)
+        reverse_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+
+        unpaginated = queryset
+        token = self.request.GET.get(self.cursor_kwarg)
+        direction, values = None, None
+        if token:
+            try:
+                direction, values = self._decode_cursor(token)
+            except InvalidCursor:
+                # A stale or tampered token just starts over from the first page
+                direction = None
+
+        if direction == 'previous':
+            rows = list(queryset.filter(self._seek(values, forward=False)).order_by(*reverse_ordering)[:page_size + 1])
+            has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next = True
+        else:
+            if direction == 'next':
+                queryset = queryset.filter(self._seek(values, forward=True))
+            rows = list(queryset.order_by(*ordering)[:page_size + 1])
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_previous = direction == 'next'
+
+        page = KeysetPage(
+            rows,
+            next_token=self._encode_cursor('next', rows[-1]) if has_next and rows else None,
+            previous_token=self._encode_cursor('previous', rows[0]) if has_previous and rows else None,
+            estimated_total=self._estimated_total(unpaginated) if self.estimate_total else None,
+        )
+        return None, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,112 @@
+import pstats
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import ProfileCapture
+
+# Most captures kept on disk; older ones are deleted as new ones are saved
+PROFILE_MAX_CAPTURES = getattr(settings, 'PROFILE_MAX_CAPTURES', 200)
+
+# Call paths that took less than this many seconds are left out of the collapsed stacks
+STACK_MIN_SECONDS = 1e-5
+
+STACK_MAX_DEPTH = 100
+
+
+def profile_dir():
+    path = Path(getattr(settings, 'PROFILE_DIR', Path(settings.BASE_DIR) / 'profiles'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def capture_path(file_name):
+    return profile_dir() / file_name
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-ins have no file, e.g. "<method 'execute' of 'sqlite3.Cursor' objects>"
+        return name.replace(';', ',')
+    return f'{name} ({Path(filename).name}:{line})'.replace(';', ',')
+
+
+def collapsed_stacks(stats):
+    """
+    Approximate collapsed stacks (``a;b;c microseconds`` lines) from a cProfile call graph.
+
+    cProfile only records caller/callee pairs, so the time of a function
+    called from several places is split between them in proportion to the
+    time each caller spent in it. The output loads into flamegraph.pl,
+    speedscope or inferno.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+
+    lines = Counter()
+
+    def walk(func, path, seconds):
+        _, _, own, cumulative, _ = stats.stats[func]
+        path = path + [func]
+        share = seconds / cumulative if cumulative else 0
+        lines[';'.join(_label(frame) for frame in path)] += own * share
+        if len(path) >= STACK_MAX_DEPTH:
+            return
+        for callee, callee_seconds in callees[func].items():
+            # Recursion shows up as one frame; its time is already in the outer call's
+            if callee not in path and callee_seconds * share >= STACK_MIN_SECONDS:
+                walk(callee, path, callee_seconds * share)
+
+    roots = [func for func, (_, _, _, _, callers) in stats.stats.items() if not callers]
+    # An entry point that recurses, like Django's middleware chain, is its own caller
+    entry = max(stats.stats, key=lambda func: stats.stats[func][3], default=None)
+    if entry is not None and not any(stats.stats[root][3] >= stats.stats[entry][3] for root in roots):
+        roots.append(entry)
+    for root in roots:
+        walk(root, [], stats.stats[root][3])
+    return [f'{stack} {round(seconds * 1e6)}' for stack, seconds in lines.items() if seconds * 1e6 >= 1]
+
+
+def save_capture(profiler, request, response, duration, sampled=False):
+    """Write a profiler's pstats dump and collapsed stacks and record them for the admin."""
+    now = timezone.now()
+    name = f"{now:%Y%m%d-%H%M%S}-{request.method.lower()}-{slugify(request.path)[:60] or 'root'}-{uuid.uuid4().hex[:8]}"
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(capture_path(f'{name}.prof'))
+    with open(capture_path(f'{name}.folded'), 'w', encoding='utf-8') as stacks:
+        stacks.writelines(f'{line}\n' for line in collapsed_stacks(stats))
+
+    user = getattr(request, 'user', None)
+    capture = ProfileCapture.objects.create(
+        user=user if user is not None and user.is_authenticated else None,
+        method=request.method,
+        path=request.path[:255],
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        sampled=sampled,
+        stats_file=f'{name}.prof',
+        stacks_file=f'{name}.folded',
+        created_at=now,
+    )
+    prune_captures()
+    return capture
+
+
+def delete_capture_files(capture):
+    for file_name in (capture.stats_file, capture.stacks_file):
+        capture_path(file_name).unlink(missing_ok=True)
+
+
+def prune_captures(keep=PROFILE_MAX_CAPTURES):
+    """Delete all but the newest ``keep`` captures with their files."""
+    old = list(ProfileCapture.objects.order_by('-created_at', '-pk')[keep:])
+    for capture in old:
+        delete_capture_files(capture)
+    ProfileCapture.objects.filter(pk__in=[capture.pk for capture in old]).delete()
@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Alias of the read-only connection reports read from, when settings define one
+REPORTS_DATABASE = 'reports'
+
+_reading_reports = ContextVar('reading_reports', default=False)
+
+
+@contextmanager
+def reports_database():
+    """Send the reads made inside the block to the read-only reports connection."""
+    token = _reading_reports.set(True)
+    try:
+        yield
+    finally:
+        _reading_reports.reset(token)
+
+
+def _streamed_from_reports(content):
+    # Streaming responses run their queries after the view has returned
+    with reports_database():
+        yield from content
+
+
+def reads_from_reports(view):
+    """Run a report or export view, including any response it streams, against the reports connection."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with reports_database():
+            response = view(*args, **kwargs)
+        if getattr(response, 'streaming', False):
+            response.streaming_content = _streamed_from_reports(response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReportsRouter:
+    """
+    Route reads made inside ``reports_database()`` to the ``reports`` alias.
+
+    Without that alias in ``DATABASES`` everything stays on ``default``.
+    Writes always go to ``default``, even for rows read through ``reports``,
+    and migrations only run there: both aliases are the same database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _reading_reports.get() and REPORTS_DATABASE in settings.DATABASES:
+            return REPORTS_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db == REPORTS_DATABASE else None
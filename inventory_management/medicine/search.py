@@ -0,0 +1,142 @@
+import re
+
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Case, Q, When
+from django.db.models.expressions import RawSQL
+
+# External-content FTS5 index over medicine_medicine, kept in sync by the
+# triggers created in migration 0012, which keeps its own copy of this DDL
+# (change both together). user_id is stored unindexed so a
+# search can be scoped to one catalog without a join.
+FTS_TABLE = 'medicine_medicine_fts'
+
+# Most medicines a ranked search returns; callers page or slice below this
+SEARCH_RESULT_LIMIT = 500
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, generic_name, category, description, user_id UNINDEXED,
+        content='medicine_medicine', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON medicine_medicine BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name, category, description, user_id)
+        VALUES (new.id, new.name, new.generic_name, new.category, new.description, new.user_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON medicine_medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name, category, description, user_id)
+        VALUES ('delete', old.id, old.name, old.generic_name, old.category, old.description, old.user_id);
+    END
+    """,
+    # Only the searched columns: stock_on_hand updates on every sale must not touch the index
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, generic_name, category, description, user_id ON medicine_medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name, category, description, user_id)
+        VALUES ('delete', old.id, old.name, old.generic_name, old.category, old.description, old.user_id);
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name, category, description, user_id)
+        VALUES (new.id, new.name, new.generic_name, new.category, new.description, new.user_id);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+# Whether each database has the index, so searches do not look it up every time
+_fts_databases = {}
+
+
+def fts_available():
+    """Whether the current database has the full-text index (SQLite built with FTS5)."""
+    if connection.vendor != 'sqlite':
+        return False
+    database = connection.settings_dict['NAME']
+    if database not in _fts_databases:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_databases[database] = cursor.fetchone() is not None
+    return _fts_databases[database]
+
+
+def create_index(using='default'):
+    """Create the index and its triggers; returns False when SQLite lacks FTS5."""
+    _fts_databases.clear()
+    try:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            for statement in CREATE_SQL:
+                cursor.execute(statement)
+    except OperationalError:
+        return False
+    return True
+
+
+def drop_index(using='default'):
+    _fts_databases.clear()
+    with connections[using].cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def rebuild_index():
+    """Repopulate the index from medicine_medicine, e.g. after a bulk load with triggers disabled."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query matching every word as a prefix.
+
+    Each word is quoted, so FTS5 operators and punctuation typed by the user
+    are searched for literally rather than parsed.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def ranked_medicine_ids(user, query, limit=SEARCH_RESULT_LIMIT):
+    """Ids of ``user``'s medicines matching ``query``, best bm25 match first; name hits weigh most."""
+    expression = match_expression(query)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND user_id = %s "
+            f"ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 2.0, 1.0) LIMIT %s",
+            [expression, user.pk, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_medicines(queryset, query):
+    """
+    Filter a medicine queryset to those matching ``query``.
+
+    Uses the full-text index as a subquery when it exists, leaving the
+    queryset's ordering alone; otherwise falls back to substring matching.
+    """
+    if not fts_available():
+        return queryset.filter(Q(name__icontains=query) | Q(generic_name__icontains=query))
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression]
+    ))
+
+
+def rank_by(field, ids):
+    """An ordering expression that sorts rows in the order of ``ids``."""
+    return Case(*[When(**{field: pk}, then=position) for position, pk in enumerate(ids)], default=len(ids))
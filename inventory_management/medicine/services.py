@@ -0,0 +1,455 @@
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, PositiveIntegerField, Q, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import kpis, metrics
+from .models import (
+    BatchWriteOff, CatalogVersion, DailySalesSummary, Medicine, MedicineBatch, PurchaseOrderItem, SaleItem,
+)
+
+
+def sellable_batches(user):
+    """Active, unexpired batches with stock left that ``user`` can sell from."""
+    return MedicineBatch.objects.filter(
+        user=user,
+        expiry_date__gte=timezone.now().date(),
+        current_quantity__gt=0,
+        is_active=True
+    )
+
+
+def _line_error(message, line, code='invalid_line'):
+    return ValidationError(message, code=code, params={'line': line})
+
+
+def _deduct_batches(demand):
+    """
+    Take every batch's demanded quantity in a single conditional UPDATE.
+
+    Returns True only when every batch still held enough stock; otherwise
+    nothing is written by the caller's transaction.
+    """
+    if not demand:
+        # An empty Q() would match, and update, every batch
+        return True
+    enough_stock = Q()
+    new_quantity = []
+    for batch_id, quantity in demand.items():
+        enough_stock |= Q(pk=batch_id, current_quantity__gte=quantity)
+        new_quantity.append(When(pk=batch_id, then=F('current_quantity') - quantity))
+    updated = MedicineBatch.objects.filter(enough_stock).update(
+        current_quantity=Case(*new_quantity, default=F('current_quantity'), output_field=PositiveIntegerField()),
+        sync_version=CatalogVersion.next(),
+        updated_at=timezone.now(),
+    )
+    return updated == len(demand)
+
+
+def adjust_medicine_totals(deltas):
+    """Apply ``{medicine_id: delta}`` to the stored stock totals with a single UPDATE."""
+    deltas = {medicine_id: delta for medicine_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Medicine.objects.filter(pk__in=deltas).update(stock_on_hand=Case(
+        *[When(pk=medicine_id, then=F('stock_on_hand') + delta) for medicine_id, delta in deltas.items()],
+        default=F('stock_on_hand'),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def _deduct_medicine_totals(batches, demand):
+    per_medicine = defaultdict(int)
+    for batch_id, quantity in demand.items():
+        per_medicine[batches[batch_id].medicine_id] -= quantity
+    adjust_medicine_totals(per_medicine)
+
+
+def _rollup_increment(field, totals, output_field):
+    whens = [
+        When(medicine_id=medicine_id, then=F(field) + values[field])
+        for medicine_id, values in totals.items() if medicine_id is not None
+    ]
+    whens.append(When(medicine__isnull=True, then=F(field) + totals[None][field]))
+    return Case(*whens, default=F(field), output_field=output_field)
+
+
+def record_daily_sales(sale, lines, batches):
+    """
+    Add a committed sale to the daily rollup with a fixed number of queries.
+
+    Missing rows for the day and each medicine sold are inserted empty,
+    then every row is incremented by a single UPDATE.
+    """
+    day = timezone.localdate(sale.sale_date)
+    totals = defaultdict(lambda: {'revenue': 0, 'cost': 0, 'units': 0, 'line_count': 0})
+    for _, batch_id, quantity, price in lines:
+        batch = batches[batch_id]
+        for medicine_id in (batch.medicine_id, None):
+            totals[medicine_id]['revenue'] += quantity * price
+            totals[medicine_id]['cost'] += quantity * batch.purchase_price
+            totals[medicine_id]['units'] += quantity
+            totals[medicine_id]['line_count'] += 1
+
+    DailySalesSummary.objects.bulk_create(
+        [DailySalesSummary(user=sale.user, date=day, medicine_id=medicine_id) for medicine_id in totals],
+        ignore_conflicts=True,
+    )
+    money = DecimalField(max_digits=14, decimal_places=2)
+    count = PositiveIntegerField()
+    DailySalesSummary.objects.filter(
+        Q(medicine__isnull=True) | Q(medicine_id__in=[m for m in totals if m is not None]),
+        user=sale.user,
+        date=day,
+    ).update(
+        revenue=_rollup_increment('revenue', totals, money),
+        cost=_rollup_increment('cost', totals, money),
+        units=_rollup_increment('units', totals, count),
+        line_count=_rollup_increment('line_count', totals, count),
+    )
+
+
+def rebuild_daily_sales(user_id=None, since=None, days=None):
+    """
+    Recompute rollup rows from the recorded sale items and replace the old ones.
+
+    Limited to one user, to days on or after ``since`` and to the dates in
+    ``days`` when those are given. Returns the number of rows deleted and
+    created. Writes other than ``commit_sale``, like admin edits, rebuild
+    the days they touch with this.
+    """
+    items = SaleItem.objects.annotate(day=TruncDate('sale__sale_date'))
+    summaries = DailySalesSummary.objects.all()
+    if user_id is not None:
+        items = items.filter(sale__user_id=user_id)
+        summaries = summaries.filter(user_id=user_id)
+    if since is not None:
+        items = items.filter(day__gte=since)
+        summaries = summaries.filter(date__gte=since)
+    if days is not None:
+        items = items.filter(day__in=days)
+        summaries = summaries.filter(date__in=days)
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    measures = {
+        'revenue': Sum(F('quantity') * F('price'), output_field=money),
+        'cost': Sum(F('quantity') * F('medicine_batch__purchase_price'), output_field=money),
+        'units': Sum('quantity'),
+        'line_count': Count('pk'),
+    }
+    rows = [
+        DailySalesSummary(user_id=row.pop('sale__user'), date=row.pop('day'), medicine_id=None, **row)
+        for row in items.values('sale__user', 'day').annotate(**measures).order_by()
+    ]
+    rows += [
+        DailySalesSummary(
+            user_id=row.pop('sale__user'),
+            date=row.pop('day'),
+            medicine_id=row.pop('medicine_batch__medicine'),
+            **row
+        )
+        for row in items.values('sale__user', 'day', 'medicine_batch__medicine').annotate(**measures).order_by()
+    ]
+
+    with transaction.atomic():
+        deleted, _ = summaries.delete()
+        DailySalesSummary.objects.bulk_create(rows, batch_size=1000)
+    return deleted, len(rows)
+
+
+def _price_error(price):
+    """
+    The message a sale line's price is rejected with, or None when it is valid.
+
+    ``bulk_create`` skips field validation, so the price's digit limits are
+    checked here before anything is written.
+    """
+    if not isinstance(price, (int, Decimal)) or not Decimal(price).is_finite() or price <= 0:
+        return 'Price must be greater than zero.'
+    try:
+        SaleItem._meta.get_field('price').run_validators(Decimal(price))
+    except ValidationError as e:
+        return e.messages[0]
+    return None
+
+
+def commit_sale(sale, lines):
+    """
+    Validate and record a sale and its lines with a fixed number of queries.
+
+    ``lines`` is a list of ``(line_number, medicine_batch_id, quantity, price)``.
+    All lines are checked against one batch query; the items are inserted
+    with ``bulk_create`` and every stock change is applied in one statement.
+    Raises ``ValidationError`` whose errors carry the offending ``line`` in
+    their params, using the same wording as ``SaleItemForm``.
+    """
+    if not lines:
+        raise ValidationError('Add at least one item to the sale.', code='empty')
+    batch_ids = {batch_id for _, batch_id, _, _ in lines}
+    batches = sellable_batches(sale.user).in_bulk(batch_ids)
+
+    errors = []
+    demand = defaultdict(int)
+    for line, batch_id, quantity, price in lines:
+        batch = batches.get(batch_id)
+        if batch is None:
+            errors.append(_line_error('Medicine batch is required.', line))
+            continue
+        if not quantity or quantity <= 0:
+            errors.append(_line_error('Quantity must be greater than zero.', line))
+            continue
+        price_error = _price_error(price)
+        if price_error:
+            errors.append(_line_error(price_error, line))
+            continue
+        demand[batch_id] += quantity
+        if demand[batch_id] > batch.current_quantity:
+            errors.append(_line_error(
+                f"Requested quantity ({demand[batch_id]}) exceeds available stock ({batch.current_quantity})",
+                line,
+            ))
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        sale.total_amount = sum(quantity * price for _, _, quantity, price in lines)
+        sale.save()
+
+        SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, medicine_batch_id=batch_id, quantity=quantity, price=price, user=sale.user)
+            for _, batch_id, quantity, price in lines
+        ])
+
+        if not _deduct_batches(demand):
+            # Another sale took the stock between our read and this write
+            metrics.inc('pharmacy_stock_update_conflicts_total', operation='sale')
+            current = dict(MedicineBatch.objects.filter(pk__in=demand).values_list('pk', 'current_quantity'))
+            raise ValidationError([
+                _line_error(
+                    f"Requested quantity ({demand[batch_id]}) exceeds available stock ({current.get(batch_id, 0)})",
+                    line,
+                    code='stock_conflict',
+                )
+                for line, batch_id, _, _ in lines
+                if demand[batch_id] > current.get(batch_id, 0)
+            ] or ValidationError(
+                'Stock changed while the sale was being recorded. Please try again.', code='stock_conflict'
+            ))
+        _deduct_medicine_totals(batches, demand)
+        record_daily_sales(sale, lines, batches)
+        # Counted once the sale is durable: a retried allocation rolls back its failed attempts
+        transaction.on_commit(partial(metrics.inc, 'pharmacy_sales_committed_total'))
+        transaction.on_commit(partial(metrics.inc, 'pharmacy_units_sold_total', sum(demand.values())))
+    return sale
+
+
+# How often an allocation is re-planned when a concurrent sale takes the planned stock
+ALLOCATION_ATTEMPTS = 5
+
+
+def plan_fefo_allocation(user, requests):
+    """
+    Split each ``(medicine_id, quantity, price)`` request across batches, earliest expiry first.
+
+    Reads all candidate batches with one ordered query. Rows are locked in
+    (expiry_date, pk) order on backends that support it, so concurrent
+    allocations always acquire locks in the same order and cannot deadlock.
+    Returns ``commit_sale`` lines; ``price`` of None uses the batch's selling price.
+    """
+    medicine_ids = {medicine_id for medicine_id, _, _ in requests}
+    candidates = defaultdict(list)
+    batches = sellable_batches(user).filter(medicine_id__in=medicine_ids).order_by('expiry_date', 'pk')
+    for batch in batches.select_for_update().only('pk', 'medicine_id', 'current_quantity', 'selling_price'):
+        candidates[batch.medicine_id].append(batch)
+
+    lines = []
+    errors = []
+    for line, (medicine_id, quantity, price) in enumerate(requests):
+        if not quantity or quantity <= 0:
+            errors.append(_line_error('Quantity must be greater than zero.', line))
+            continue
+        remaining = quantity
+        for batch in candidates[medicine_id]:
+            if not remaining:
+                break
+            take = min(remaining, batch.current_quantity)
+            if not take:
+                continue
+            # Later requests for the same medicine see what this one already took
+            batch.current_quantity -= take
+            remaining -= take
+            lines.append((line, batch.pk, take, batch.selling_price if price is None else price))
+        if remaining:
+            errors.append(_line_error(
+                f"Requested quantity ({quantity}) exceeds available stock ({quantity - remaining})", line
+            ))
+    if errors:
+        raise ValidationError(errors)
+    return lines
+
+
+def allocate_sale(sale, requests):
+    """
+    Record a sale by medicine and quantity, allocating stock first-expiry-first-out.
+
+    One ``SaleItem`` is created per batch touched. If a concurrent sale takes
+    planned stock between the read and the conditional update, the plan is
+    rebuilt from fresh stock and retried.
+    """
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return commit_sale(sale, plan_fefo_allocation(sale.user, requests))
+        except ValidationError as e:
+            conflict = all(error.code == 'stock_conflict' for error in e.error_list)
+            if not conflict or attempt == ALLOCATION_ATTEMPTS - 1:
+                raise
+            # The rolled-back insert must be repeated on the next attempt
+            sale.pk = None
+            sale._state.adding = True
+
+
+# Batches deactivated per transaction by the expiry sweep
+EXPIRY_SWEEP_CHUNK_SIZE = 500
+
+
+def expire_batches(today=None, chunk_size=EXPIRY_SWEEP_CHUNK_SIZE, dry_run=False):
+    """
+    Deactivate every active batch that expired before ``today``, writing off its stock.
+
+    Works in chunks, each in its own transaction: the chunk's batches are
+    read once, a ``BatchWriteOff`` is recorded per batch with stock left,
+    the batches are deactivated with one UPDATE and the medicine totals are
+    reduced with another. Returns ``(batches, quantity, value)`` written off.
+    """
+    today = today or timezone.now().date()
+    expired = MedicineBatch.objects.filter(is_active=True, expiry_date__lt=today).order_by('pk')
+    if dry_run:
+        batches = list(expired.only('pk', 'current_quantity', 'purchase_price'))
+        return (
+            len(batches),
+            sum(batch.current_quantity for batch in batches),
+            sum(batch.current_quantity * batch.purchase_price for batch in batches),
+        )
+
+    totals = [0, 0, 0]
+    users = set()
+    while True:
+        with transaction.atomic():
+            batches = {
+                batch.pk: batch for batch in expired.select_for_update().only(
+                    'pk', 'medicine_id', 'user_id', 'current_quantity', 'purchase_price'
+                )[:chunk_size]
+            }
+            if not batches:
+                break
+            now = timezone.now()
+            BatchWriteOff.objects.bulk_create([
+                BatchWriteOff(
+                    batch_id=batch.pk,
+                    medicine_id=batch.medicine_id,
+                    user_id=batch.user_id,
+                    quantity=batch.current_quantity,
+                    value=batch.current_quantity * batch.purchase_price,
+                    written_off_at=now,
+                )
+                for batch in batches.values() if batch.current_quantity
+            ])
+            MedicineBatch.objects.filter(pk__in=batches, is_active=True).update(
+                is_active=False, sync_version=CatalogVersion.next(), updated_at=now
+            )
+            _deduct_medicine_totals(batches, {
+                pk: batch.current_quantity for pk, batch in batches.items() if batch.current_quantity
+            })
+
+        totals[0] += len(batches)
+        totals[1] += sum(batch.current_quantity for batch in batches.values())
+        totals[2] += sum(batch.current_quantity * batch.purchase_price for batch in batches.values())
+        users.update(batch.user_id for batch in batches.values())
+
+    # Bulk updates send no signals, so drop the affected users' cached dashboard figures here
+    for user_id in users:
+        kpis.invalidate(user_id)
+    return tuple(totals)
+
+
+def receive_purchase_order(order, lines):
+    """
+    Book a delivery against ``order``, creating one batch per received line.
+
+    ``lines`` is a list of ``(line_number, item_id, batch)`` where ``batch``
+    holds the received ``quantity``, ``batch_number``, dates and prices.
+    Everything is written in one transaction with a fixed number of queries:
+    the received quantities in one conditional UPDATE, the batches with
+    ``bulk_create`` and the stock totals in one more UPDATE. Items may be
+    received over several deliveries until their ordered quantity is in.
+    """
+    if not lines:
+        raise ValidationError('Enter a received quantity for at least one item.', code='empty')
+
+    items = order.items.in_bulk({item_id for _, item_id, _ in lines})
+    errors = []
+    received = defaultdict(int)
+    for line, item_id, batch in lines:
+        item = items.get(item_id)
+        if item is None:
+            errors.append(_line_error('Purchase order item is required.', line))
+            continue
+        received[item_id] += batch['quantity']
+        if received[item_id] > item.outstanding_quantity:
+            errors.append(_line_error(
+                f"Received quantity ({received[item_id]}) exceeds the outstanding quantity "
+                f"({item.outstanding_quantity})",
+                line,
+            ))
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        still_outstanding = Q()
+        new_received = []
+        for item_id, quantity in received.items():
+            still_outstanding |= Q(pk=item_id, received_quantity__lte=F('quantity') - quantity)
+            new_received.append(When(pk=item_id, then=F('received_quantity') + quantity))
+        updated = PurchaseOrderItem.objects.filter(still_outstanding).update(received_quantity=Case(
+            *new_received, default=F('received_quantity'), output_field=PositiveIntegerField()
+        ))
+        if updated != len(received):
+            # Another receipt of the same items committed between our read and this write
+            metrics.inc('pharmacy_stock_update_conflicts_total', operation='receipt')
+            raise ValidationError(
+                'Part of this delivery was received meanwhile. Reload the order and try again.',
+                code='receipt_conflict',
+            )
+
+        version = CatalogVersion.next()
+        batches = MedicineBatch.objects.bulk_create([
+            MedicineBatch(
+                medicine_id=items[item_id].medicine_id,
+                user=order.user,
+                purchase_order_item_id=item_id,
+                batch_number=batch['batch_number'],
+                manufacturing_date=batch['manufacturing_date'],
+                expiry_date=batch['expiry_date'],
+                purchase_price=batch['purchase_price'],
+                selling_price=batch['selling_price'],
+                quantity_received=batch['quantity'],
+                current_quantity=batch['quantity'],
+                received_date=batch.get('received_date') or timezone.now().date(),
+                sync_version=version,
+            )
+            for _, item_id, batch in lines
+        ])
+        # bulk_create skips MedicineBatch.save, so add the new stock to the totals here
+        per_medicine = defaultdict(int)
+        for created in batches:
+            per_medicine[created.medicine_id] += created.current_quantity
+        adjust_medicine_totals(per_medicine)
+        # ... and sends no signals, so drop the cached dashboard figures on commit
+        transaction.on_commit(partial(kpis.invalidate, order.user_id))
+    return batches
@@ -0,0 +1,25 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import kpis
+from .models import CatalogVersion, DeletedBatch, Medicine, MedicineBatch, Sale, SaleItem
+
+
+@receiver([post_save, post_delete], sender=Medicine)
+@receiver([post_save, post_delete], sender=MedicineBatch)
+@receiver([post_save, post_delete], sender=Sale)
+@receiver([post_save, post_delete], sender=SaleItem)
+def invalidate_dashboard_kpis(sender, instance, **kwargs):
+    """Drop the cached dashboard KPIs that depend on the written model."""
+    # Wait for the commit, otherwise a concurrent reader could cache the
+    # pre-write values under the new version
+    transaction.on_commit(partial(kpis.invalidate, instance.user_id, kpis.INVALIDATES[sender.__name__]))
+
+
+@receiver(post_delete, sender=MedicineBatch)
+def record_batch_deletion(sender, instance, **kwargs):
+    """Leave a tombstone for catalog sync; also runs for batches deleted by a cascade."""
+    DeletedBatch.objects.create(batch_id=instance.pk, user_id=instance.user_id, sync_version=CatalogVersion.next())
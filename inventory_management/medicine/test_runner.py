@@ -0,0 +1,22 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+
+from . import metrics
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner that records the suite's metrics in a throwaway directory instead of METRICS_DIR."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._metrics_dir = tempfile.TemporaryDirectory()
+        self._registry = metrics.registry
+        metrics.registry = metrics.Registry(self._metrics_dir.name)
+
+    def teardown_test_environment(self, **kwargs):
+        # Stops the pending flush timer before the directory goes away
+        metrics.registry.flush()
+        metrics.registry = self._registry
+        self._metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
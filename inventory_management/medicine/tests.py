@@ -1,3 +1,1531 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import pstats
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import BatchWriteOff, CatalogVersion, DailySalesSummary, DeletedBatch, Job, ProfileCapture, PurchaseOrder, PurchaseOrderItem, Medicine, MedicineBatch, MedicineUser, Sale, SaleItem
+from . import checks, jobs, kpis, metrics, profiling, search, views
+from .routers import ReportsRouter, reads_from_reports, reports_database
+from .imports import import_inventory
+from .middleware import QueryStats
+from .services import allocate_sale, commit_sale, receive_purchase_order
+
+
+class InventoryTestMixin:
+    """Shared fixtures for building a small catalog."""
+
+    def create_user(self, email='owner@example.com'):
+        return MedicineUser.objects.create_user(
+            email=email, password='secret', first_name='Test', last_name='Owner'
+        )
+
+    def create_medicine(self, user, name='Paracetamol', minimum_stock=10):
+        return Medicine.objects.create(
+            name=name, category='Analgesic', supplier='Acme', minimum_stock=minimum_stock, user=user
+        )
+
+    def create_batch(self, medicine, quantity=20, days_to_expiry=365, batch_number='B1', is_active=True):
+        today = timezone.now().date()
+        return MedicineBatch.objects.create(
+            medicine=medicine,
+            user=medicine.user,
+            batch_number=batch_number,
+            manufacturing_date=today - timedelta(days=30),
+            expiry_date=today + timedelta(days=days_to_expiry),
+            purchase_price=Decimal('1.00'),
+            selling_price=Decimal('2.00'),
+            quantity_received=quantity,
+            current_quantity=quantity,
+            is_active=is_active,
+        )
+
+
+class StockTotalTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.medicine = self.create_medicine(self.user)
+
+    def assertStock(self, expected):
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.current_stock, expected)
+        self.assertEqual(self.medicine.calculate_stock(), expected)
+
+    def test_batch_writes_update_total(self):
+        batch = self.create_batch(self.medicine, quantity=20)
+        self.create_batch(self.medicine, quantity=5, batch_number='B2')
+        self.create_batch(self.medicine, quantity=7, batch_number='B3', is_active=False)
+        self.assertStock(25)
+
+        batch.current_quantity = 12
+        batch.save()
+        self.assertStock(17)
+
+        batch.is_active = False
+        batch.save()
+        self.assertStock(5)
+
+        batch.is_active = True
+        batch.save()
+        batch.delete()
+        self.assertStock(5)
+
+    def test_sale_items_update_total(self):
+        batch = self.create_batch(self.medicine, quantity=20)
+        sale = Sale(invoice_number='INV-1', user=self.user)
+        sale.save()
+        item = SaleItem(sale=sale, medicine_batch=batch, quantity=3, price=Decimal('2.00'), user=self.user)
+        item.save()
+        self.assertStock(17)
+
+        item.quantity = 5
+        item.save()
+        self.assertStock(15)
+
+        item.delete()
+        self.assertStock(20)
+
+    def test_medicine_save_keeps_stored_total(self):
+        stale = Medicine.objects.get(pk=self.medicine.pk)
+        self.create_batch(self.medicine, quantity=20)
+        stale.minimum_stock = 3
+        stale.save()
+        self.assertStock(20)
+
+    def test_rebuild_command(self):
+        self.create_batch(self.medicine, quantity=20)
+        Medicine.objects.filter(pk=self.medicine.pk).update(stock_on_hand=99)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stock_totals', '--check', stdout=StringIO())
+
+        call_command('rebuild_stock_totals', stdout=StringIO())
+        self.assertStock(20)
+        call_command('rebuild_stock_totals', '--check', stdout=StringIO())
+
+
+class LowStockQueryTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+
+    def add_catalog(self, count, start=0):
+        for i in range(start, start + count):
+            medicine = self.create_medicine(self.user, name=f'Medicine {i}', minimum_stock=10)
+            self.create_batch(
+                medicine,
+                quantity=5 if i % 2 else 50,
+                days_to_expiry=-1 if i % 3 == 0 else 20,
+                batch_number=f'B{i}',
+            )
+
+    def count_queries(self, url):
+        # Measure the uncached path of the dashboard
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_low_stock_queryset(self):
+        self.add_catalog(4)
+        other = self.create_medicine(self.user, name='No batches', minimum_stock=1)
+        names = set(Medicine.objects.filter(user=self.user).low_stock().values_list('name', flat=True))
+        self.assertEqual(names, {'Medicine 1', 'Medicine 3', other.name})
+
+        stocked = Medicine.objects.with_stock().get(name='Medicine 0')
+        self.assertEqual(stocked.current_stock, 50)
+
+    def test_inventory_report_filters(self):
+        fresh = self.create_medicine(self.user, name='Fresh')
+        self.create_batch(fresh, quantity=50)
+        stale = self.create_medicine(self.user, name='Stale')
+        self.create_batch(stale, quantity=50, days_to_expiry=-3, batch_number='OLD')
+        self.create_batch(stale, quantity=50, days_to_expiry=200, batch_number='NEW')
+
+        response = self.client.get(reverse('inventory_report'), {'expiry': 'expired'})
+        medicines = list(response.context['medicines'])
+        self.assertEqual([m.name for m in medicines], ['Stale'])
+        self.assertEqual([b.batch_number for b in medicines[0].report_batches], ['OLD'])
+
+        response = self.client.get(reverse('inventory_report'))
+        self.assertEqual([m.name for m in response.context['medicines']], ['Fresh', 'Stale'])
+
+    def test_query_budget_is_constant(self):
+        report = reverse('inventory_report')
+        for url in (
+            reverse('dashboard'),
+            reverse('low_stock_alerts'),
+            report,
+            f'{report}?low_stock=true',
+            f'{report}?expiry=expired',
+            f'{report}?expiry=soon',
+        ):
+            with self.subTest(url=url):
+                Medicine.objects.all().delete()
+                self.add_catalog(2)
+                small = self.count_queries(url)
+                self.add_catalog(20, start=2)
+                large = self.count_queries(url)
+                self.assertEqual(small, large)
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class AccessPathIndexTests(InventoryTestMixin, TestCase):
+    """The hot per-user queries must be served by the composite/partial indexes."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.today = timezone.now().date()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+        self.assertNotRegex(plan, r'SCAN medicine_\w+\s*$')
+
+    def test_dashboard_expiry_counts(self):
+        self.assertUsesIndex(
+            MedicineBatch.objects.filter(user=self.user, expiry_date__lt=self.today, is_active=True),
+            'batch_user_active_expiry_idx',
+        )
+        self.assertUsesIndex(
+            MedicineBatch.objects.filter(
+                user=self.user,
+                expiry_date__gte=self.today,
+                expiry_date__lte=self.today + timedelta(days=30),
+                is_active=True,
+            ).order_by('expiry_date'),
+            'batch_user_active_expiry_idx',
+        )
+
+    def test_sale_list(self):
+        self.assertUsesIndex(Sale.objects.filter(user=self.user).order_by('-sale_date')[:10], 'sale_user_date_idx')
+
+    def test_batch_picker(self):
+        self.assertUsesIndex(
+            MedicineBatch.objects.filter(
+                user=self.user, expiry_date__gte=self.today, current_quantity__gt=0, is_active=True
+            ),
+            'batch_sellable_idx',
+        )
+
+    def test_medicine_list_and_stock_subquery(self):
+        self.assertUsesIndex(Medicine.objects.filter(user=self.user).order_by('name'), 'medicine_user_name_idx')
+        self.assertUsesIndex(Medicine.objects.filter(user=self.user).with_stock(), 'batch_medicine_active_idx')
+
+
+class ExportTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        medicine = self.create_medicine(self.user)
+        self.create_batch(medicine, quantity=4, days_to_expiry=-2, batch_number='OLD')
+        self.create_batch(medicine, quantity=9, days_to_expiry=10, batch_number='SOON')
+        sale = Sale(invoice_number='INV-9', user=self.user, total_amount=Decimal('12.50'))
+        sale.save()
+
+    def export(self, url, export_format='csv'):
+        response = self.client.get(url, {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_inventory_report_csv(self):
+        lines = self.export(reverse('inventory_report')).splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['medicine', 'batch_number'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['OLD', 'SOON'])
+
+    def test_expiry_alerts_ndjson(self):
+        rows = [json.loads(line) for line in self.export(reverse('expiry_alerts'), 'ndjson').splitlines()]
+        self.assertEqual([row['status'] for row in rows], ['expired', 'expiring_soon'])
+
+    def test_expiry_alerts_export_reads_only_the_rows_from_reports(self):
+        routed = []
+        stream_export = views.stream_export
+
+        def export_spy(rows, *args):
+            with mock.patch.dict(settings.DATABASES, {'reports': {}}):
+                routed.append(ReportsRouter().db_for_read(MedicineBatch))
+            return stream_export(rows, *args)
+
+        with mock.patch.object(views, 'stream_export', side_effect=export_spy), \
+                CaptureQueriesContext(connection) as queries:
+            lines = self.export(reverse('expiry_alerts'), 'csv').splitlines()
+        self.assertEqual(routed, ['reports'])
+        self.assertEqual(len(lines), 3)
+        # The export skips the HTML page's alert summary
+        self.assertEqual(len([query for query in queries if 'medicine_medicinebatch' in query['sql']]), 1)
+
+    def test_sale_list_csv(self):
+        lines = self.export(reverse('sale_list')).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('INV-9,'))
+
+
+class StockDeductionTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.medicine = self.create_medicine(self.create_user())
+        self.batch = self.create_batch(self.medicine, quantity=5)
+
+    def test_deduct_refuses_to_oversell(self):
+        self.assertTrue(MedicineBatch.deduct_stock(self.batch.pk, 3))
+        self.assertFalse(MedicineBatch.deduct_stock(self.batch.pk, 3))
+        self.batch.refresh_from_db()
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.batch.current_quantity, 2)
+        self.assertEqual(self.medicine.stock_on_hand, 2)
+
+    def test_check_constraint(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MedicineBatch.objects.filter(pk=self.batch.pk).update(current_quantity=F('current_quantity') - 6)
+
+
+class ConcurrentStockDeductionTests(InventoryTestMixin, TransactionTestCase):
+    """Many threads selling from one batch must neither lose updates nor oversell."""
+
+    threads = 8
+    attempts_per_thread = 25
+    initial_quantity = 120
+
+    def test_concurrent_deductions_are_exact(self):
+        medicine = self.create_medicine(self.create_user())
+        batch = self.create_batch(medicine, quantity=self.initial_quantity)
+        start = threading.Barrier(self.threads)
+        sold = []
+
+        def sell():
+            start.wait()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    while True:
+                        try:
+                            if MedicineBatch.deduct_stock(batch.pk, 1):
+                                sold.append(1)
+                            break
+                        except OperationalError:
+                            # SQLite reports lock contention instead of waiting; retry the statement
+                            time.sleep(0.001)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=sell) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        batch.refresh_from_db()
+        medicine.refresh_from_db()
+        self.assertEqual(len(sold), self.initial_quantity)
+        self.assertEqual(batch.current_quantity, 0)
+        self.assertEqual(medicine.stock_on_hand, 0)
+
+
+class SaleCommitTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.medicine = self.create_medicine(self.user)
+
+    def make_lines(self, count, quantity=2):
+        lines = []
+        for i in range(count):
+            batch = self.create_batch(self.medicine, quantity=10, batch_number=f'L{count}-{i}')
+            lines.append((i, batch.pk, quantity, Decimal('2.50')))
+        return lines
+
+    def commit_queries(self, lines, invoice):
+        with CaptureQueriesContext(connection) as context:
+            commit_sale(Sale(invoice_number=invoice, user=self.user), lines)
+        return len(context.captured_queries)
+
+    def test_query_count_is_fixed(self):
+        self.assertEqual(
+            self.commit_queries(self.make_lines(2), 'INV-A'),
+            self.commit_queries(self.make_lines(20), 'INV-B'),
+        )
+        sale = Sale.objects.get(invoice_number='INV-B')
+        self.assertEqual(sale.items.count(), 20)
+        self.assertEqual(sale.total_amount, Decimal('100.00'))
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_on_hand, self.medicine.calculate_stock())
+
+    def test_lines_on_same_batch_share_stock(self):
+        batch = self.create_batch(self.medicine, quantity=5)
+        lines = [(0, batch.pk, 3, Decimal('1.00')), (1, batch.pk, 3, Decimal('1.00'))]
+        with self.assertRaises(ValidationError) as raised:
+            commit_sale(Sale(invoice_number='INV-C', user=self.user), lines)
+        error, = raised.exception.error_list
+        self.assertEqual(error.params['line'], 1)
+        self.assertEqual(error.message, 'Requested quantity (6) exceeds available stock (5)')
+        self.assertFalse(Sale.objects.filter(invoice_number='INV-C').exists())
+
+    def test_sale_without_lines_is_rejected(self):
+        batch = self.create_batch(self.medicine, quantity=5)
+        with self.assertRaises(ValidationError) as raised:
+            commit_sale(Sale(invoice_number='INV-EMPTY', user=self.user), [])
+        self.assertEqual(raised.exception.code, 'empty')
+        self.assertFalse(Sale.objects.filter(invoice_number='INV-EMPTY').exists())
+        batch.refresh_from_db()
+        self.assertEqual(batch.current_quantity, 5)
+
+    def test_create_sale_view(self):
+        batch = self.create_batch(self.medicine, quantity=5)
+        data = {
+            'invoice_number': 'INV-D',
+            'sale_date': '2026-01-01T10:00',
+            'items-TOTAL_FORMS': '2',
+            'items-INITIAL_FORMS': '0',
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+            'items-0-medicine_batch': batch.pk,
+            'items-0-quantity': '4',
+            'items-0-price': '2.00',
+        }
+        response = self.client.post(reverse('create_sale'), data)
+        self.assertRedirects(response, reverse('sale_list'), fetch_redirect_response=False)
+        batch.refresh_from_db()
+        self.assertEqual(batch.current_quantity, 1)
+        self.assertEqual(Sale.objects.get(invoice_number='INV-D').total_amount, Decimal('8.00'))
+
+    def test_sale_form_loads_picked_batches_once(self):
+        batches = [self.create_batch(self.medicine, quantity=5, batch_number=f'S{i}') for i in range(25)]
+        data = {
+            'invoice_number': 'INV-E',
+            'sale_date': '2026-01-01T10:00',
+            'items-TOTAL_FORMS': '25',
+            'items-INITIAL_FORMS': '0',
+        }
+        for i, batch in enumerate(batches):
+            data.update({f'items-{i}-medicine_batch': batch.pk, f'items-{i}-quantity': '1', f'items-{i}-price': '2.00'})
+        data['items-24-quantity'] = '6'
+
+        # The last line asks for more than its batch holds, so all 25 are validated and rendered again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('create_sale'), data)
+        self.assertContains(response, 'Requested quantity (6) exceeds available stock (5)')
+        self.assertContains(response, 'Paracetamol (Batch: S24) - Stock: 5')
+        catalog = [query['sql'] for query in queries if 'FROM "medicine_medicinebatch"' in query['sql']]
+        self.assertEqual(len(catalog), 1)
+        self.assertIn('INNER JOIN "medicine_medicine"', catalog[0])
+
+    def test_sale_form_only_labels_the_users_own_batches(self):
+        expired = self.create_batch(self.medicine, quantity=5, days_to_expiry=-1, batch_number='OLD')
+        other = self.create_medicine(self.create_user('other@example.com'), name='SecretDrug')
+        secret = self.create_batch(other, quantity=5, batch_number='SECRET')
+        data = {
+            'invoice_number': 'INV-F',
+            'sale_date': '2026-01-01T10:00',
+            'items-TOTAL_FORMS': '2',
+            'items-INITIAL_FORMS': '0',
+            'items-0-medicine_batch': str(expired.pk),
+            'items-0-quantity': '1',
+            'items-0-price': '2.00',
+            'items-1-medicine_batch': str(secret.pk),
+            'items-1-quantity': '1',
+            'items-1-price': '2.00',
+        }
+        response = self.client.post(reverse('create_sale'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Paracetamol (Batch: OLD)')
+        self.assertNotContains(response, 'SecretDrug')
+        self.assertNotContains(response, 'SECRET')
+
+
+class FefoAllocationTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.medicine = self.create_medicine(self.user)
+        self.late = self.create_batch(self.medicine, quantity=10, days_to_expiry=300, batch_number='LATE')
+        self.early = self.create_batch(self.medicine, quantity=4, days_to_expiry=20, batch_number='EARLY')
+        self.create_batch(self.medicine, quantity=50, days_to_expiry=-1, batch_number='EXPIRED')
+
+    def test_splits_across_batches_earliest_expiry_first(self):
+        sale = allocate_sale(Sale(invoice_number='FEFO-1', user=self.user), [(self.medicine.pk, 6, None)])
+        allocated = list(sale.items.order_by('pk').values_list('medicine_batch__batch_number', 'quantity'))
+        self.assertEqual(allocated, [('EARLY', 4), ('LATE', 2)])
+        self.assertEqual(sale.total_amount, Decimal('12.00'))
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_on_hand, 58)
+
+    def test_rejects_more_than_sellable_stock(self):
+        with self.assertRaises(ValidationError) as raised:
+            allocate_sale(Sale(invoice_number='FEFO-2', user=self.user), [(self.medicine.pk, 15, None)])
+        self.assertEqual(raised.exception.messages, ['Requested quantity (15) exceeds available stock (14)'])
+        self.assertFalse(Sale.objects.exists())
+
+    def test_endpoint(self):
+        payload = {'invoice_number': 'FEFO-3', 'items': [{'medicine': self.medicine.pk, 'quantity': 5, 'price': '3.00'}]}
+        response = self.client.post(reverse('allocate_sale'), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['batch_number'] for item in response.json()['items']], ['EARLY', 'LATE'])
+        self.assertEqual(response.json()['total_amount'], '15.00')
+
+        payload['invoice_number'] = 'FEFO-4'
+        payload['items'][0]['quantity'] = 100
+        response = self.client.post(reverse('allocate_sale'), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['items'][0]['line'], 0)
+
+    def test_invalid_prices_are_rejected_before_writing(self):
+        for price, message in [
+            ('-5', 'Price must be greater than zero.'),
+            ('0', 'Price must be greater than zero.'),
+            ('NaN', 'Price must be greater than zero.'),
+            ('Infinity', 'Price must be greater than zero.'),
+            ('1e20', 'Ensure that there are no more than 10 digits in total.'),
+            ('123456789', 'Ensure that there are no more than 8 digits before the decimal point.'),
+            ('1.005', 'Ensure that there are no more than 2 decimal places.'),
+        ]:
+            with self.subTest(price=price):
+                payload = {'invoice_number': 'FEFO-5', 'items': [{'medicine': self.medicine.pk, 'quantity': 1, 'price': price}]}
+                response = self.client.post(reverse('allocate_sale'), json.dumps(payload), content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['errors']['items'], [{'line': 0, 'message': message}])
+        self.assertFalse(Sale.objects.exists())
+        self.early.refresh_from_db()
+        self.assertEqual(self.early.current_quantity, 4)
+
+
+class ConcurrentAllocationTests(InventoryTestMixin, TransactionTestCase):
+    def test_concurrent_allocations_are_exact(self):
+        user = self.create_user()
+        medicine = self.create_medicine(user)
+        for i, days in enumerate((30, 10, 20)):
+            self.create_batch(medicine, quantity=20, days_to_expiry=days, batch_number=f'C{i}')
+        threads = 6
+        start = threading.Barrier(threads)
+        sold = []
+
+        def sell(worker):
+            start.wait()
+            try:
+                for attempt in range(5):
+                    while True:
+                        try:
+                            sale = Sale(invoice_number=f'C-{worker}-{attempt}', user=user)
+                            allocate_sale(sale, [(medicine.pk, 3, None)])
+                            sold.append(3)
+                            break
+                        except OperationalError:
+                            time.sleep(0.001)
+                        except ValidationError:
+                            break
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=sell, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        medicine.refresh_from_db()
+        self.assertEqual(sum(sold), 60 - medicine.calculate_stock())
+        self.assertEqual(medicine.stock_on_hand, medicine.calculate_stock())
+        self.assertEqual(SaleItem.objects.aggregate(total=Sum('quantity'))['total'], sum(sold))
+
+
+class BatchCatalogTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.medicine = self.create_medicine(self.user)
+        self.batch = self.create_batch(self.medicine, quantity=5, batch_number='A')
+        self.create_batch(self.medicine, quantity=5, days_to_expiry=-1, batch_number='EXPIRED')
+        other = self.create_medicine(self.create_user('other@example.com'))
+        self.create_batch(other, quantity=5, batch_number='OTHER')
+
+    def test_snapshot_then_delta(self):
+        snapshot = self.client.get(reverse('batch_catalog'))
+        self.assertEqual(snapshot.status_code, 200)
+        body = snapshot.json()
+        self.assertTrue(body['full'])
+        self.assertEqual([row[3] for row in body['rows']], ['A'])
+
+        not_modified = self.client.get(reverse('batch_catalog'), HTTP_IF_NONE_MATCH=snapshot['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.assertTrue(MedicineBatch.deduct_stock(self.batch.pk, 5))
+        delta = self.client.get(reverse('batch_catalog'), {'since': body['cursor']}).json()
+        self.assertFalse(delta['full'])
+        rows = {row['batch_number']: row for row in (dict(zip(delta['columns'], r)) for r in delta['rows'])}
+        self.assertEqual((rows['A']['current_quantity'], rows['A']['sellable']), (0, False))
+
+        unchanged = self.client.get(reverse('batch_catalog'), {'since': delta['cursor']})
+        again = self.client.get(reverse('batch_catalog'), {'since': delta['cursor']}, HTTP_IF_NONE_MATCH=unchanged['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(unchanged.json()['rows'], [])
+
+    def test_rename_sends_the_medicine_batches_again(self):
+        cursor = self.client.get(reverse('batch_catalog')).json()['cursor']
+        self.medicine.name = 'Acetaminophen'
+        self.medicine.save()
+        delta = self.client.get(reverse('batch_catalog'), {'since': cursor}).json()
+        names = {row[3]: row[2] for row in delta['rows']}
+        self.assertEqual(names, {'A': 'Acetaminophen', 'EXPIRED': 'Acetaminophen'})
+
+        self.medicine.supplier = 'Other supplier'
+        self.medicine.save()
+        self.assertEqual(self.client.get(reverse('batch_catalog'), {'since': delta['cursor']}).json()['rows'], [])
+
+    def test_deleted_batches_reach_delta_clients(self):
+        doomed = self.create_batch(self.medicine, quantity=5, batch_number='DOOMED')
+        snapshot = self.client.get(reverse('batch_catalog')).json()
+        self.assertEqual(snapshot['deleted'], [])
+        doomed_pk = doomed.pk
+        doomed.delete()
+        delta = self.client.get(reverse('batch_catalog'), {'since': snapshot['cursor']}).json()
+        self.assertEqual((delta['rows'], delta['deleted']), ([], [doomed_pk]))
+
+        # Deleting the medicine takes its batches with it
+        self.medicine.delete()
+        cascaded = self.client.get(reverse('batch_catalog'), {'since': delta['cursor']}).json()
+        self.assertEqual(sorted(cascaded['deleted']), sorted(
+            DeletedBatch.objects.exclude(batch_id=doomed_pk).values_list('batch_id', flat=True)
+        ))
+        self.assertEqual(len(cascaded['deleted']), 2)
+        self.assertEqual(self.client.get(reverse('batch_catalog'), {'since': cascaded['cursor']}).json()['deleted'], [])
+
+    def test_every_batch_write_takes_a_new_version(self):
+        versions = [MedicineBatch.objects.get(pk=self.batch.pk).sync_version]
+        for write in (
+            lambda: MedicineBatch.deduct_stock(self.batch.pk, 1),
+            lambda: MedicineBatch.restock(self.batch.pk, 1),
+            lambda: MedicineBatch.objects.get(pk=self.batch.pk).save(update_fields=['is_active']),
+        ):
+            write()
+            versions.append(MedicineBatch.objects.get(pk=self.batch.pk).sync_version)
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_failed_deduction_takes_no_version(self):
+        version = CatalogVersion.objects.get().value
+        self.assertFalse(MedicineBatch.deduct_stock(self.batch.pk, 50))
+        self.assertEqual(CatalogVersion.objects.get().value, version)
+
+    def test_invalid_cursor(self):
+        for since in ('yesterday', '2024-01-01T00:00:00Z', '-1'):
+            self.assertEqual(self.client.get(reverse('batch_catalog'), {'since': since}).status_code, 400)
+
+    def test_medicine_batch_info_is_scoped(self):
+        names = [batch['name'] for batch in self.client.get(reverse('medicine_batch_info')).json()]
+        self.assertEqual(names, ['Paracetamol (Batch: A)'])
+
+
+class BatchSearchTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        for name in ('Amoxicillin', 'Paracetamol', 'Paroxetine', 'Tramadol'):
+            self.create_batch(self.create_medicine(self.user, name=name), batch_number=f'{name[:3].upper()}-1')
+
+    def search(self, term):
+        return [row['label'].split(' ')[0] for row in self.client.get(reverse('batch_search'), {'q': term}).json()['results']]
+
+    def test_prefix_matches(self):
+        self.assertEqual(self.search('par'), ['Paracetamol', 'Paroxetine'])
+        self.assertEqual(self.search('tram'), ['Tramadol'])
+        self.assertEqual(self.search('am'), ['Amoxicillin'])
+        self.assertEqual(self.search('TRA-'), ['Tramadol'])
+
+    def test_substring_fallback_without_full_text_index(self):
+        with mock.patch('medicine.views.fts_available', return_value=False):
+            self.assertEqual(self.search('par'), ['Paracetamol', 'Paroxetine'])
+            self.assertEqual(self.search('ram'), ['Tramadol'])
+
+    def test_sale_form_renders_without_loading_catalog(self):
+        for i in range(30):
+            self.create_batch(self.create_medicine(self.user, name=f'Bulk {i}'), batch_number=f'BULK-{i}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('create_sale'))
+        self.assertNotContains(response, 'BULK-')
+        self.assertFalse(any('medicine_medicinebatch' in query['sql'] for query in context.captured_queries))
+
+
+class DashboardKpiCacheTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = self.create_user()
+        self.medicine = self.create_medicine(self.user)
+        self.batch = self.create_batch(self.medicine, quantity=3)
+
+    def kpi_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            result = kpis.dashboard_kpis(self.user)
+        return result, len(context.captured_queries)
+
+    def test_cached_until_invalidated(self):
+        first, cold = self.kpi_queries()
+        self.assertEqual(first['low_stock_count'], 1)
+        _, warm = self.kpi_queries()
+        self.assertEqual(warm, 0)
+        self.assertEqual(kpis.cache_stats(), {'hits': 3, 'misses': 3})
+
+        # A batch write invalidates stock and alerts but leaves the sales KPIs cached
+        with self.captureOnCommitCallbacks(execute=True):
+            batch = self.create_batch(self.medicine, quantity=20, batch_number='B2')
+        second, partial = self.kpi_queries()
+        self.assertEqual(second['low_stock_count'], 0)
+        self.assertLess(partial, cold)
+        self.assertGreater(partial, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            commit_sale(Sale(invoice_number='KPI-1', user=self.user), [(0, batch.pk, 2, Decimal('2.50'))])
+        third, _ = self.kpi_queries()
+        self.assertEqual(third['monthly_sales'], Decimal('5.00'))
+        self.assertEqual([s.invoice_number for s in third['recent_sales']], ['KPI-1'])
+
+    def test_users_are_isolated(self):
+        self.kpi_queries()
+        other = self.create_user('other@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_batch(self.create_medicine(other), quantity=1)
+        _, queries = self.kpi_queries()
+        self.assertEqual(queries, 0)
+
+    def test_shared_file_cache_never_serves_stale_values(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+        }}
+        with override_settings(CACHES=file_cache):
+            with mock.patch.object(kpis, 'cache', caches['default']):
+                self.kpi_queries()
+                # Invalidations from two workers never land on the same version
+                before = kpis.group_version(self.user.pk, 'stock')
+                kpis.invalidate(self.user.pk, ['stock'])
+                first = kpis.group_version(self.user.pk, 'stock')
+                kpis.invalidate(self.user.pk, ['stock'])
+                self.assertEqual(len({before, first, kpis.group_version(self.user.pk, 'stock')}), 3)
+
+                # A culled version starts afresh instead of matching values cached before
+                self.kpi_queries()
+                MedicineBatch.objects.filter(pk=self.batch.pk).update(current_quantity=50)
+                Medicine.objects.filter(pk=self.medicine.pk).update(stock_on_hand=50)
+                kpis.cache.delete(kpis._version_key(self.user.pk, 'stock'))
+                result, queries = self.kpi_queries()
+                self.assertGreater(queries, 0)
+                self.assertEqual(result['low_stock_count'], 0)
+
+
+class AlertSummaryTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        medicine = self.create_medicine(self.user, minimum_stock=100)
+        self.create_batch(medicine, quantity=10, days_to_expiry=-5, batch_number='EXPIRED')
+        self.create_batch(medicine, quantity=10, days_to_expiry=5, batch_number='WEEK')
+        self.create_batch(medicine, quantity=10, days_to_expiry=60, batch_number='QUARTER')
+        self.create_batch(medicine, quantity=10, days_to_expiry=5, batch_number='OFF', is_active=False)
+        self.create_medicine(self.user, name='Empty', minimum_stock=0)
+
+    def test_single_query_summary(self):
+        with self.assertNumQueries(1):
+            summary = Medicine.objects.filter(user=self.user).alert_summary(windows=(7, 30, 90))
+        self.assertEqual(summary['expired'], 1)
+        self.assertEqual(summary['expiring'], {7: 1, 30: 1, 90: 2})
+        self.assertEqual(summary['out_of_stock'], 1)
+        self.assertEqual(summary['low_stock'], 1)
+        # Expired and within-30-day stock at a purchase price of 1.00
+        self.assertEqual(summary['value_at_risk'], Decimal('20.00'))
+
+    def test_expiry_alerts_window(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('expiry_alerts'), {'window': '90'})
+        self.assertEqual(response.context['window'], 90)
+        self.assertEqual([b.batch_number for b in response.context['expiring_soon_batches']], ['WEEK', 'QUARTER'])
+        response = self.client.get(reverse('expiry_alerts'), {'window': '45'})
+        self.assertEqual(response.context['window'], 30)
+
+
+class DailySalesSummaryTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.first = self.create_medicine(self.user, name='First')
+        self.second = self.create_medicine(self.user, name='Second')
+        self.a = self.create_batch(self.first, quantity=50, batch_number='A')
+        self.b = self.create_batch(self.second, quantity=50, batch_number='B')
+
+    def sell(self, invoice, lines):
+        return commit_sale(Sale(invoice_number=invoice, user=self.user), lines)
+
+    def rollup(self):
+        return {
+            (row.medicine_id, row.date): (row.revenue, row.cost, row.units, row.line_count)
+            for row in DailySalesSummary.objects.all()
+        }
+
+    def test_commit_updates_rollup_incrementally(self):
+        self.sell('R-1', [(0, self.a.pk, 2, Decimal('3.00')), (1, self.b.pk, 1, Decimal('4.00'))])
+        self.sell('R-2', [(0, self.a.pk, 1, Decimal('3.00'))])
+        today = timezone.localdate()
+        self.assertEqual(self.rollup(), {
+            (None, today): (Decimal('13.00'), Decimal('4.00'), 4, 3),
+            (self.first.pk, today): (Decimal('9.00'), Decimal('3.00'), 3, 2),
+            (self.second.pk, today): (Decimal('4.00'), Decimal('1.00'), 1, 1),
+        })
+
+        trend = self.client.get(reverse('sales_trend'), {'days': 7}).json()
+        self.assertEqual(trend['rows'], [[today.isoformat(), '13.00', '4.00', 4, 3]])
+
+    def test_rebuild_matches_incremental(self):
+        self.sell('R-3', [(0, self.a.pk, 2, Decimal('3.00')), (1, self.b.pk, 5, Decimal('1.50'))])
+        incremental = self.rollup()
+        DailySalesSummary.objects.update(revenue=0)
+        call_command('rebuild_sales_summary', stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_admin_edits_rebuild_the_days_they_touch(self):
+        sale = self.sell('R-4', [(0, self.a.pk, 2, Decimal('3.00')), (1, self.b.pk, 1, Decimal('4.00'))])
+        self.client.force_login(MedicineUser.objects.create_superuser(
+            email='admin@example.com', password='secret', first_name='Admin', last_name='User'
+        ))
+        yesterday = timezone.localtime() - timedelta(days=1)
+        response = self.client.post(reverse('admin:medicine_sale_change', args=[sale.pk]), {
+            'invoice_number': 'R-4',
+            'sale_date_0': yesterday.date().isoformat(),
+            'sale_date_1': yesterday.time().strftime('%H:%M:%S'),
+            'total_amount': '10.00',
+            'user': self.user.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(date for _, date in self.rollup()), {yesterday.date()})
+
+        item = sale.items.get(medicine_batch=self.b)
+        response = self.client.post(reverse('admin:medicine_saleitem_delete', args=[item.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.rollup(), {
+            (None, yesterday.date()): (Decimal('6.00'), Decimal('2.00'), 2, 1),
+            (self.first.pk, yesterday.date()): (Decimal('6.00'), Decimal('2.00'), 2, 1),
+        })
+
+        response = self.client.post(reverse('admin:medicine_sale_delete', args=[sale.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.rollup(), {})
+
+
+class KeysetPaginationTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        now = timezone.now()
+        # Two sales share each timestamp so the id tiebreaker is exercised
+        Sale.objects.bulk_create([
+            Sale(invoice_number=f'K-{i:03}', sale_date=now - timedelta(minutes=i // 2), user=self.user)
+            for i in range(25)
+        ])
+        self.expected = list(
+            Sale.objects.filter(user=self.user).order_by('-sale_date', '-id').values_list('invoice_number', flat=True)
+        )
+
+    def fetch(self, cursor=None):
+        params = {'cursor': cursor} if cursor else {}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('sale_list'), params)
+        page = response.context['page_obj']
+        return [sale.invoice_number for sale in page], page, queries
+
+    def test_walks_forward_and_back_with_constant_queries(self):
+        seen, page, first = self.fetch()
+        forward = [seen]
+        query_counts = []
+        while page.has_next():
+            rows, page, queries = self.fetch(page.next_token)
+            forward.append(rows)
+            query_counts.append(len(queries))
+            self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+
+        self.assertEqual(sum(forward, []), self.expected)
+        self.assertEqual([len(rows) for rows in forward], [10, 10, 5])
+        self.assertEqual(len(set(query_counts)), 1)
+        self.assertEqual(page.estimated_total, 25)
+
+        backward = []
+        while page.has_previous():
+            rows, page, _ = self.fetch(page.previous_token)
+            backward.append(rows)
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        rows, page, _ = self.fetch('not-a-cursor')
+        self.assertEqual(rows, self.expected[:10])
+        self.assertFalse(page.has_previous())
+
+
+def sqlite_has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(body)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+@skipUnless(connection.vendor == 'sqlite' and sqlite_has_fts5(), "SQLite without FTS5")
+class MedicineSearchTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.paracetamol = self.create_medicine(self.user, name='Paracetamol')
+        self.ibuprofen = Medicine.objects.create(
+            name='Ibuprofen', generic_name='Brufen', category='Analgesic', supplier='Acme',
+            description='Often taken instead of paracetamol', user=self.user
+        )
+        self.create_medicine(self.create_user('other@example.com'), name='Paracetamol')
+
+    def listed(self, term):
+        response = self.client.get(reverse('medicine_list'), {'search': term})
+        return [medicine.name for medicine in response.context['medicines']]
+
+    def test_ranked_prefix_matches_scoped_to_user(self):
+        self.assertEqual(
+            search.ranked_medicine_ids(self.user, 'parac'), [self.paracetamol.pk, self.ibuprofen.pk]
+        )
+        self.assertEqual(self.listed('bru'), ['Ibuprofen'])
+        # Equal category hits: bm25 favours the shorter row
+        self.assertEqual(self.listed('analg'), ['Paracetamol', 'Ibuprofen'])
+
+    def test_list_search_is_ranked(self):
+        # A name hit outranks a description hit, though name order would put Ibuprofen first
+        self.assertEqual(self.listed('paracetamol'), ['Paracetamol', 'Ibuprofen'])
+
+    def test_list_search_keeps_substring_matches(self):
+        self.assertEqual(self.listed('cetamol'), ['Paracetamol'])
+        self.assertEqual(self.listed('ufen'), ['Ibuprofen'])
+
+    def test_list_search_pages_keep_the_rank(self):
+        for i in range(30):
+            self.create_medicine(self.user, name=f'Aspirin {i:02}')
+        self.create_medicine(self.user, name='Zinc aspirin')
+        first = self.client.get(reverse('medicine_list'), {'search': 'aspirin'}).context['page_obj']
+        second = self.client.get(reverse('medicine_list'), {'search': 'aspirin', 'cursor': first.next_token})
+        names = [medicine.name for medicine in first] + [medicine.name for medicine in second.context['medicines']]
+        self.assertEqual(len(names), 31)
+        self.assertEqual(len(set(names)), 31)
+        self.assertFalse(second.context['page_obj'].has_next())
+
+    def test_index_follows_edits_but_not_stock_changes(self):
+        self.paracetamol.name = 'Acetaminophen'
+        self.paracetamol.save()
+        self.create_batch(self.paracetamol)
+        self.assertEqual(self.listed('acet'), ['Acetaminophen'])
+        self.assertEqual(self.listed('paracetamol'), ['Ibuprofen'])
+
+        self.ibuprofen.delete()
+        self.assertEqual(self.listed('paracetamol'), [])
+
+    def test_query_syntax_is_searched_literally(self):
+        self.assertEqual(self.listed('"para* OR NEAR('), [])
+        self.assertEqual(self.listed('()'), [])
+
+
+class InventoryImportTests(InventoryTestMixin, TestCase):
+    HEADER = (
+        'name,generic_name,category,supplier,minimum_stock,batch_number,'
+        'manufacturing_date,expiry_date,purchase_price,selling_price,quantity_received\n'
+    )
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.existing = self.create_medicine(self.user, name='Paracetamol')
+        self.create_batch(self.existing, quantity=5, batch_number='OLD')
+
+    def csv(self, *rows):
+        return StringIO(self.HEADER + ''.join(f'{row}\n' for row in rows))
+
+    def test_imports_valid_rows_and_reports_the_rest(self):
+        result = import_inventory(self.user, self.csv(
+            'Ibuprofen,,Analgesic,Acme,,I-1,2025-01-01,2030-01-01,1.00,2.00,30',
+            'Ibuprofen,,Analgesic,Acme,,I-2,2025-01-01,2030-06-01,1.00,2.00,20',
+            'Paracetamol,Acetaminophen,Analgesic,Acme,5,P-1,2025-01-01,2030-01-01,1.00,2.00,10',
+            'Paracetamol,Acetaminophen,Analgesic,Acme,5,OLD,2025-01-01,2030-01-01,1.00,2.00,10',
+            'Aspirin,,Analgesic,Acme,,A-1,2025-01-01,not-a-date,1.00,2.00,10',
+            'Cetirizine,,Antihistamine,Acme,,,,,,,',
+        ), 'csv', chunk_size=2)
+
+        self.assertEqual((result.rows, result.medicines_created, result.medicines_updated, result.batches_created), (6, 2, 1, 3))
+        self.assertEqual([row for row, _ in result.errors], [4, 5])
+        self.assertIn('expiry_date', result.errors[1][1])
+
+        stock = dict(Medicine.objects.filter(user=self.user).values_list('name', 'stock_on_hand'))
+        self.assertEqual(stock, {'Ibuprofen': 50, 'Paracetamol': 15, 'Cetirizine': 0})
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.generic_name, self.existing.minimum_stock), ('Acetaminophen', 5))
+        self.assertEqual(Medicine.objects.get(name='Cetirizine').minimum_stock, 10)
+        call_command('rebuild_stock_totals', '--check', stdout=StringIO())
+
+    def test_dry_run_writes_nothing(self):
+        result = import_inventory(self.user, StringIO(
+            '{"name": "Ibuprofen", "category": "Analgesic", "supplier": "Acme", "batch_number": "I-1",'
+            ' "manufacturing_date": "2025-01-01", "expiry_date": "2030-01-01", "purchase_price": 1,'
+            ' "selling_price": 2, "quantity_received": 30}\n'
+            '[1, 2]\n'
+        ), 'ndjson', dry_run=True)
+        self.assertEqual((result.medicines_created, result.batches_created), (1, 1))
+        self.assertEqual(result.errors, [(2, 'Line is not a JSON object.')])
+        self.assertEqual(Medicine.objects.filter(user=self.user).count(), 1)
+
+    def test_existing_medicine_keeps_fields_the_file_leaves_out(self):
+        Medicine.objects.filter(pk=self.existing.pk).update(
+            generic_name='Acetaminophen', description='Pain relief', minimum_stock=25
+        )
+        result = import_inventory(self.user, StringIO(
+            'name,category,supplier,batch_number,manufacturing_date,expiry_date,'
+            'purchase_price,selling_price,quantity_received\n'
+            'Paracetamol,Antipyretic,Acme,P-1,2025-01-01,2030-01-01,1.00,2.00,10\n'
+        ), 'csv')
+        result = import_inventory(self.user, StringIO(
+            '{"name": "Paracetamol", "category": "Antipyretic", "supplier": "Pharmaco", "minimum_stock": ""}\n'
+        ), 'ndjson')
+        self.assertEqual(result.medicines_updated, 1)
+        self.existing.refresh_from_db()
+        self.assertEqual(
+            (self.existing.category, self.existing.supplier, self.existing.generic_name,
+             self.existing.description, self.existing.minimum_stock),
+            ('Antipyretic', 'Pharmaco', 'Acetaminophen', 'Pain relief', 25),
+        )
+
+    def test_command_reports_unreadable_files(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        undecodable = os.path.join(directory.name, 'latin1.csv')
+        with open(undecodable, 'wb') as stream:
+            stream.write(self.HEADER.encode() + 'Ibuprofène,,Analgesic,Acme,,,,,,,\n'.encode('latin-1'))
+        oversized = os.path.join(directory.name, 'oversized.csv')
+        with open(oversized, 'w') as stream:
+            stream.write(self.HEADER + 'x' * (csv.field_size_limit() + 1) + '\n')
+
+        for path in (undecodable, oversized):
+            with self.assertRaisesMessage(CommandError, f'Could not read {path}: '):
+                call_command('import_inventory', path, '--user', self.user.email, stdout=StringIO())
+
+    def test_queries_do_not_grow_with_rows(self):
+        def import_rows(prefix, count):
+            rows = [f'{prefix}{i},,Analgesic,Acme,,B,2025-01-01,2030-01-01,1.00,2.00,3' for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                import_inventory(self.user, self.csv(*rows), 'csv')
+            return len(queries)
+
+        self.assertEqual(import_rows('Small', 5), import_rows('Large', 50))
+
+    def test_upload_view(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('stock.csv', (
+            self.HEADER + 'Ibuprofen,,Analgesic,Acme,,I-1,2025-01-01,2030-01-01,1.00,2.00,30\n'
+        ).encode())
+        response = self.client.post(reverse('import_inventory'), {'file': upload})
+        self.assertContains(response, 'New batches: 1')
+        self.assertEqual(Medicine.objects.get(name='Ibuprofen').stock_on_hand, 30)
+
+
+class ExpiryTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.medicine = self.create_medicine(self.user)
+        self.live = self.create_batch(self.medicine, quantity=10, batch_number='LIVE')
+        self.expired = self.create_batch(self.medicine, quantity=4, days_to_expiry=-1, batch_number='OLD')
+        self.empty = self.create_batch(self.medicine, quantity=0, days_to_expiry=-10, batch_number='EMPTY')
+        self.create_batch(self.medicine, quantity=7, days_to_expiry=-5, batch_number='OFF', is_active=False)
+
+    def test_sweep_deactivates_and_writes_off(self):
+        out = StringIO()
+        call_command('expire_batches', '--dry-run', stdout=out)
+        self.assertIn('Would write off 4 unit(s) worth 4.00 from 2', out.getvalue())
+        self.assertFalse(BatchWriteOff.objects.exists())
+
+        call_command('expire_batches', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(
+            list(MedicineBatch.objects.filter(is_active=True).values_list('batch_number', flat=True)), ['LIVE']
+        )
+        self.assertEqual(
+            list(BatchWriteOff.objects.values_list('batch__batch_number', 'quantity', 'value')),
+            [('OLD', 4, Decimal('4.00'))],
+        )
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_on_hand, 10)
+        call_command('rebuild_stock_totals', '--check', stdout=StringIO())
+
+        # A second run finds nothing left to do
+        call_command('expire_batches', stdout=StringIO())
+        self.assertEqual(BatchWriteOff.objects.count(), 1)
+
+
+class BackgroundJobTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        results = tempfile.TemporaryDirectory()
+        self.addCleanup(results.cleanup)
+        override = override_settings(JOB_RESULTS_DIR=results.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.medicine = self.create_medicine(self.user)
+        self.create_batch(self.medicine, quantity=5)
+
+    def test_export_job_runs_in_worker_and_downloads(self):
+        response = self.client.post(reverse('job_create'), {'kind': 'export_inventory', 'format': 'csv'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], Job.QUEUED)
+
+        call_command('run_workers', '--once', stdout=StringIO())
+
+        status = self.client.get(status_url).json()
+        self.assertEqual((status['status'], status['progress'], status['message']), (Job.SUCCEEDED, 100, 'Exported 1 row(s).'))
+        download = self.client.get(status['download_url'])
+        self.assertIn(b'Paracetamol,B1', b''.join(download.streaming_content))
+
+        other = self.create_user('other@example.com')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_only_public_kinds_can_be_queued(self):
+        response = self.client.post(reverse('job_create'), {'kind': 'import_inventory', 'upload': '../../etc/passwd'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_background_import_and_failures(self):
+        upload = SimpleUploadedFile('stock.csv', (
+            InventoryImportTests.HEADER + 'Ibuprofen,,Analgesic,Acme,,I-1,2025-01-01,2030-01-01,1.00,2.00,30\n'
+        ).encode())
+        response = self.client.post(reverse('import_inventory'), {'file': upload, 'background': 'on'})
+        self.assertContains(response, 'Background Import')
+        failing = jobs.enqueue(self.user, 'export_sales', format='xml')
+
+        with self.assertLogs('medicine.jobs', level='ERROR'):
+            self.assertEqual(jobs.run_pending_jobs(), 2)
+        self.assertEqual(Medicine.objects.get(name='Ibuprofen').stock_on_hand, 30)
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.message), (Job.FAILED, 'Unsupported export format: xml'))
+
+    def test_abandoned_jobs_are_requeued(self):
+        job = jobs.enqueue(self.user, 'export_sales')
+        self.assertEqual(jobs.claim_next_job('w1').pk, job.pk)
+        self.assertIsNone(jobs.claim_next_job('w2'))
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(jobs.claim_next_job('w2').worker, 'w2')
+
+    def test_running_workers_requeue_abandoned_jobs(self):
+        job = jobs.enqueue(self.user, 'export_sales')
+        jobs.claim_next_job('dead-worker')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        stop = mock.Mock(**{'is_set.side_effect': [False, True]})
+        with mock.patch.object(jobs.connections, 'close_all'), mock.patch.object(jobs.signal, 'signal'):
+            jobs.worker_loop(stop, poll_interval=0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (Job.SUCCEEDED, jobs.worker_name()))
+
+    def test_expired_jobs_and_their_files_are_deleted(self):
+        old, recent = jobs.enqueue(self.user, 'export_sales'), jobs.enqueue(self.user, 'export_sales')
+        self.assertEqual(jobs.run_pending_jobs(), 2)
+        old.refresh_from_db()
+        failed_import = Job.objects.create(
+            user=self.user, kind='import_inventory', params={'upload': 'uploads/stale.csv'}, status=Job.FAILED
+        )
+        (jobs.results_dir() / 'uploads').mkdir()
+        (jobs.results_dir() / 'uploads' / 'stale.csv').write_text('')
+        Job.objects.filter(pk__in=[old.pk, failed_import.pk]).update(
+            finished_at=timezone.now() - timedelta(days=jobs.JOB_RETENTION_DAYS + 1)
+        )
+
+        self.assertEqual(jobs.maintain_jobs(), (0, 2))
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(jobs.result_path(old).exists())
+        self.assertFalse((jobs.results_dir() / 'uploads' / 'stale.csv').exists())
+        recent.refresh_from_db()
+        self.assertTrue(jobs.result_path(recent).exists())
+
+
+class PurchaseOrderTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.medicines = [self.create_medicine(self.user, name=f'Medicine {i:03}') for i in range(4)]
+
+    def create_order(self, lines):
+        order = PurchaseOrder.objects.create(order_number='PO-1', supplier='Acme', user=self.user)
+        PurchaseOrderItem.objects.bulk_create([
+            PurchaseOrderItem(order=order, medicine=medicine, quantity=quantity, unit_price=Decimal('1.50'), user=self.user)
+            for medicine, quantity in lines
+        ])
+        return order
+
+    def receive_data(self, order, quantities):
+        today = timezone.now().date()
+        items = list(order.items.order_by('pk'))
+        data = {'receive-TOTAL_FORMS': len(items), 'receive-INITIAL_FORMS': len(items)}
+        for i, (item, quantity) in enumerate(zip(items, quantities)):
+            data.update({
+                f'receive-{i}-item': item.pk,
+                f'receive-{i}-quantity': quantity,
+                f'receive-{i}-batch_number': f'R{i}',
+                f'receive-{i}-manufacturing_date': today - timedelta(days=10),
+                f'receive-{i}-expiry_date': today + timedelta(days=365),
+                f'receive-{i}-purchase_price': '1.50',
+                f'receive-{i}-selling_price': '3.00',
+            })
+        return data
+
+    def test_create_and_view_order(self):
+        response = self.client.post(reverse('purchase_order_add'), {
+            'order_number': 'PO-9', 'supplier': 'Acme', 'order_date': timezone.now().date(),
+            'items-TOTAL_FORMS': 2, 'items-INITIAL_FORMS': 0, 'items-MIN_NUM_FORMS': 1, 'items-MAX_NUM_FORMS': 1000,
+            'items-0-medicine': self.medicines[0].pk, 'items-0-quantity': 5, 'items-0-unit_price': '2.00',
+            'items-1-medicine': self.medicines[1].pk, 'items-1-quantity': 3,
+        })
+        order = PurchaseOrder.objects.get(order_number='PO-9')
+        self.assertRedirects(response, reverse('purchase_order_detail', args=[order.pk]))
+        self.assertEqual(order.items.filter(user=self.user).count(), 2)
+        self.assertContains(self.client.get(response.url), 'Rs 10.00')
+        self.assertContains(self.client.get(reverse('purchase_order_list'), {'status': 'ordered'}), 'PO-9')
+
+    def medicine_queries(self, queries):
+        return [query['sql'] for query in queries if 'FROM "medicine_medicine"' in query['sql']]
+
+    def test_item_choices_are_computed_once_and_cached(self):
+        self.create_medicine(self.create_user('other@example.com'), name='Not mine')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_batch(self.medicines[0], quantity=50)
+        data = {'supplier': 'Acme', 'items-TOTAL_FORMS': 30, 'items-INITIAL_FORMS': 0}
+        for i in range(30):
+            data.update({f'items-{i}-medicine': self.medicines[i % 4].pk, f'items-{i}-quantity': 1})
+
+        # Missing order number: all 30 lines are validated and rendered again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('purchase_order_add'), data)
+        self.assertEqual(response.status_code, 200)
+        # The choices, then the four selected medicines in one lookup
+        self.assertEqual(len(self.medicine_queries(queries)), 2)
+        choices = [label for _, label in response.context['formset'].forms[0].fields['medicine'].choices]
+        # Below minimum stock first; other users' medicines are not offered
+        self.assertEqual(choices, ['---------', 'Medicine 001', 'Medicine 002', 'Medicine 003', 'Medicine 000'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('purchase_order_add'))
+        self.assertEqual(self.medicine_queries(queries), [])
+
+        # A stock change reorders the choices on the next form
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_batch(self.medicines[1], quantity=50)
+        formset = self.client.get(reverse('purchase_order_add')).context['formset']
+        self.assertEqual(
+            [label for _, label in formset.empty_form.fields['medicine'].choices][1:3],
+            ['Medicine 002', 'Medicine 003'],
+        )
+
+    def test_partial_receipts_resume(self):
+        order = self.create_order([(self.medicines[0], 10), (self.medicines[1], 5)])
+        url = reverse('receive_purchase_order', args=[order.pk])
+
+        self.client.post(url, self.receive_data(order, [4, 0]))
+        self.assertEqual(PurchaseOrder.objects.get().status, PurchaseOrder.PARTIAL)
+        self.assertEqual(list(order.items.order_by('pk').values_list('received_quantity', flat=True)), [4, 0])
+
+        # Only the outstanding quantities are offered the next time
+        response = self.client.get(url)
+        self.assertEqual([form.initial['quantity'] for form in response.context['formset']], [6, 5])
+
+        response = self.client.post(url, self.receive_data(order, [7, 5]))
+        self.assertContains(response, 'exceeds the outstanding quantity (6)')
+        self.client.post(url, self.receive_data(order, [6, 5]))
+
+        self.assertEqual(PurchaseOrder.objects.with_status(PurchaseOrder.RECEIVED).get(), order)
+        stock = dict(Medicine.objects.filter(pk__in=[m.pk for m in self.medicines[:2]]).values_list('name', 'stock_on_hand'))
+        self.assertEqual(stock, {'Medicine 000': 10, 'Medicine 001': 5})
+        self.assertEqual(MedicineBatch.objects.filter(purchase_order_item__order=order).count(), 3)
+        call_command('rebuild_stock_totals', '--check', stdout=StringIO())
+
+    def test_receiving_a_large_delivery_uses_constant_queries(self):
+        def receive(count):
+            PurchaseOrder.objects.all().delete()
+            order = self.create_order([(self.medicines[i % 4], 2) for i in range(count)])
+            today = timezone.now().date()
+            lines = [
+                (i, item.pk, {
+                    'quantity': 2, 'batch_number': f'L{i}', 'manufacturing_date': today,
+                    'expiry_date': today + timedelta(days=90), 'purchase_price': Decimal('1.00'),
+                    'selling_price': Decimal('2.00'),
+                })
+                for i, item in enumerate(order.items.order_by('pk'))
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                receive_purchase_order(order, lines)
+            return len(queries)
+
+        # Both sizes fit in one INSERT under SQLite's bound-parameter limit
+        self.assertEqual(receive(5), receive(60))
+        self.assertEqual(Medicine.objects.get(name='Medicine 000').stock_on_hand, 4 + 30)
+
+
+class ReportsRouterTests(SimpleTestCase):
+    router = ReportsRouter()
+
+    def test_reads_stay_on_default_without_reports_database(self):
+        with reports_database():
+            self.assertIsNone(self.router.db_for_read(Sale))
+
+    def test_report_reads_use_reports_database(self):
+        with mock.patch.dict(settings.DATABASES, {'reports': {}}):
+            self.assertIsNone(self.router.db_for_read(Sale))
+            with reports_database():
+                self.assertEqual(self.router.db_for_read(Sale), 'reports')
+                self.assertEqual(self.router.db_for_write(Sale), 'default')
+            self.assertFalse(self.router.allow_migrate('reports', 'medicine'))
+            self.assertIsNone(self.router.allow_migrate('default', 'medicine'))
+
+    def test_streamed_export_reads_from_reports_database(self):
+        def rows():
+            yield f'{self.router.db_for_read(Sale)}\n'
+
+        view = reads_from_reports(lambda request: StreamingHttpResponse(rows()))
+        with mock.patch.dict(settings.DATABASES, {'reports': {}}):
+            response = view(None)
+            self.assertEqual(b''.join(response.streaming_content), b'reports\n')
+
+
+class SqliteBenchmarkTests(SimpleTestCase):
+    def test_compares_profiles(self):
+        out = StringIO()
+        call_command('benchmark_sqlite', '--processes', '2', '--operations', '20', stdout=out)
+        rows = {line.split()[0]: line.split()[1:] for line in out.getvalue().splitlines()[2:]}
+        self.assertEqual(set(rows), {'default', 'production'})
+        completed, locked = rows['production'][:2]
+        self.assertEqual((int(completed), int(locked)), (40, 0))
+
+
+class QueryInstrumentationTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+
+    def test_server_timing_reports_queries(self):
+        with self.assertLogs('medicine.sql', level='INFO') as logs:
+            response = self.client.get(reverse('inventory_report'))
+        timing = response.headers['Server-Timing']
+        self.assertIn('sql;dur=', timing)
+        self.assertRegex(timing, r'sql;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('sql-duplicates;desc="', timing)
+        record = logs.records[0].sql
+        self.assertEqual(record['path'], reverse('inventory_report'))
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(SQL_QUERY_BUDGET=1)
+    def test_requests_over_budget_are_flagged(self):
+        with self.assertLogs('medicine.sql', level='WARNING') as logs:
+            self.client.get(reverse('inventory_report'))
+        self.assertIn('Over SQL budget', logs.output[0])
+
+    @override_settings(SQL_INSTRUMENTATION=False)
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('inventory_report')).headers)
+
+    def test_counts_repeated_statements(self):
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            for medicine_id in (1, 2, 3):
+                Medicine.objects.filter(pk=medicine_id).exists()
+            Sale.objects.exists()
+        self.assertEqual((stats.count, stats.duplicates), (4, 2))
+        self.assertEqual(stats.most_repeated()[1], 3)
+
+
+class ProfilingTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = MedicineUser.objects.create_superuser(
+            email='staff@example.com', password='secret', first_name='Staff', last_name='User'
+        )
+        self.client.force_login(self.staff)
+
+    def stacks(self, capture):
+        return profiling.capture_path(capture.stacks_file).read_text()
+
+    def test_staff_capture_covers_view_and_templates(self):
+        self.create_batch(self.create_medicine(self.staff))
+        response = self.client.get(reverse('dashboard'), {'profile': '1'})
+        capture = ProfileCapture.objects.get(pk=response.headers['X-Profile-Capture'])
+        self.assertEqual((capture.path, capture.status_code, capture.sampled), ('/', 200, False))
+
+        stats = pstats.Stats(str(profiling.capture_path(capture.stats_file)))
+        self.assertTrue(any(name == 'dashboard' for _, _, name in stats.stats))
+        stacks = self.stacks(capture)
+        self.assertRegex(stacks, r'dashboard \(views.py:\d+\);.*render \(base.py:\d+\).* \d+\n')
+
+        response = self.client.get(reverse('inventory_report'), headers={'X-Profile': '1'})
+        self.assertIn('inventory_report (views.py', self.stacks(ProfileCapture.objects.get(
+            pk=response.headers['X-Profile-Capture']
+        )))
+
+    def test_only_staff_can_ask_for_a_capture(self):
+        self.client.force_login(self.create_user())
+        response = self.client.get(reverse('dashboard'), {'profile': '1'})
+        self.assertNotIn('X-Profile-Capture', response.headers)
+        self.assertFalse(ProfileCapture.objects.exists())
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampled_captures(self):
+        self.client.logout()
+        self.client.get(reverse('login'))
+        capture = ProfileCapture.objects.get()
+        self.assertTrue(capture.sampled)
+        self.assertIsNone(capture.user)
+
+    def test_admin_lists_and_serves_captures(self):
+        response = self.client.get(reverse('create_sale'), {'profile': '1'})
+        capture = ProfileCapture.objects.get(pk=response.headers['X-Profile-Capture'])
+        self.assertContains(self.client.get(reverse('admin:medicine_profilecapture_changelist')), '/sales/add/')
+        download = self.client.get(reverse('profile_capture_download', args=[capture.pk, 'stacks']))
+        self.assertIn(b'create_sale (views.py', b''.join(download.streaming_content))
+
+        self.client.force_login(self.create_user())
+        response = self.client.get(reverse('profile_capture_download', args=[capture.pk, 'stats']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_old_captures_are_pruned(self):
+        for _ in range(3):
+            self.client.get(reverse('dashboard'), {'profile': '1'})
+        newest = ProfileCapture.objects.first()
+        profiling.prune_captures(keep=1)
+        self.assertEqual(list(ProfileCapture.objects.all()), [newest])
+        self.assertEqual(len(list(profiling.profile_dir().iterdir())), 2)
+
+
+class MetricsTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(METRICS_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Stops the pending flush timer before the directory goes away
+        self.addCleanup(metrics.registry.flush)
+        self.user = self.create_user()
+        # Without METRICS_TOKEN the endpoint is for staff only
+        self.user.is_staff = True
+        self.user.save(update_fields=['is_staff'])
+        self.client.force_login(self.user)
+        self.medicine = self.create_medicine(self.user)
+        self.batch = self.create_batch(self.medicine, quantity=10)
+
+    def scrape(self, **kwargs):
+        response = self.client.get(reverse('metrics'), **kwargs)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_request_metrics(self):
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('dashboard'))
+        text = self.scrape()
+        self.assertIn('# TYPE pharmacy_http_request_duration_seconds histogram', text)
+        self.assertIn('pharmacy_http_requests_total{method="GET",status="200",view="dashboard"} 2', text)
+        self.assertIn('pharmacy_http_request_duration_seconds_bucket{le="+Inf",view="dashboard"} 2', text)
+        self.assertIn('pharmacy_http_request_duration_seconds_count{view="dashboard"} 2', text)
+        self.assertRegex(text, r'pharmacy_db_queries_total\{view="dashboard"\} [1-9]')
+        self.assertIn('pharmacy_cache_requests_total{cache="dashboard",result="miss"} 3', text)
+        self.assertIn('pharmacy_cache_requests_total{cache="dashboard",result="hit"} 3', text)
+        # Scrapes are not counted
+        self.assertNotIn('view="metrics"', self.scrape())
+
+    def test_business_counters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            commit_sale(Sale(invoice_number='M-1', user=self.user), [(0, self.batch.pk, 3, Decimal('2.00'))])
+        with mock.patch('medicine.services._deduct_batches', return_value=False):
+            with self.assertRaises(ValidationError):
+                commit_sale(Sale(invoice_number='M-2', user=self.user), [(0, self.batch.pk, 1, Decimal('2.00'))])
+        text = self.scrape()
+        self.assertIn('\npharmacy_sales_committed_total 1\n', text)
+        self.assertIn('\npharmacy_units_sold_total 3\n', text)
+        self.assertIn('pharmacy_stock_update_conflicts_total{operation="sale"} 1', text)
+
+    def test_adds_up_workers(self):
+        worker = metrics.Registry()
+        worker.add('pharmacy_sales_committed_total', {}, 4)
+        worker.add('pharmacy_http_requests_total', {'view': 'batch_search', 'method': 'GET', 'status': 200}, 2)
+        worker.flush()
+        metrics.inc('pharmacy_sales_committed_total')
+        text = self.scrape()
+        self.assertIn('\npharmacy_sales_committed_total 5\n', text)
+        self.assertIn('pharmacy_http_requests_total{method="GET",status="200",view="batch_search"} 2', text)
+
+    def test_scrape_adopts_files_of_exited_workers(self):
+        exited = metrics.metrics_dir() / '999999999-deadbeef.json'
+        exited.write_text(json.dumps([['pharmacy_sales_committed_total', [], 4]]))
+        metrics.inc('pharmacy_sales_committed_total')
+        self.assertIn('\npharmacy_sales_committed_total 5\n', self.scrape())
+        self.assertFalse(exited.exists())
+        # The exited worker's samples now live in this process's file
+        self.assertEqual(
+            [path.name for path in metrics.metrics_dir().glob('*.json')], [metrics.registry.file_name]
+        )
+        self.assertIn('\npharmacy_sales_committed_total 5\n', self.scrape())
+
+    def test_idle_worker_writes_its_samples(self):
+        with mock.patch.object(metrics, 'METRICS_FLUSH_INTERVAL', 0.01):
+            worker = metrics.Registry()
+            worker.add('pharmacy_sales_committed_total', {}, 2)
+            timer = worker._timer
+        timer.join(5)
+        samples = json.loads((metrics.metrics_dir() / worker.file_name).read_text())
+        self.assertEqual(samples, [['pharmacy_sales_committed_total', [], 2]])
+
+    def test_registry_keeps_the_directory_it_was_created_with(self):
+        worker = metrics.Registry()
+        worker.add('pharmacy_sales_committed_total', {}, 1)
+        with tempfile.TemporaryDirectory() as other, override_settings(METRICS_DIR=other):
+            worker.flush()
+            self.assertEqual(os.listdir(other), [])
+        self.assertTrue((metrics.metrics_dir() / worker.file_name).exists())
+
+    def test_only_staff_without_token(self):
+        self.client.force_login(self.create_user('clerk@example.com'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_REQUIRE_TOKEN=True, METRICS_TOKEN=None)
+    def test_required_token_must_be_set(self):
+        self.assertEqual([error.id for error in checks.metrics_token_check(None)], ['medicine.E001'])
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(checks.metrics_token_check(None), [])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertIn('# HELP', self.scrape(headers={'Authorization': 'Bearer s3cret'}))
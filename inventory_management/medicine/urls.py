@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     # Dashboard
     path('', views.dashboard, name='dashboard'),
+    path('api/dashboard-cache-stats/', views.dashboard_cache_stats, name='dashboard_cache_stats'),
     path('login/', views.login_view, name='login'),
     path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
@@ -13,6 +14,7 @@ urlpatterns = [
     path('medicines/', views.MedicineListView.as_view(), name='medicine_list'),
     #path('medicines/<int:pk>/', views.MedicineDetailView.as_view(), name='medicine_detail'),
     path('medicines/add/', views.MedicineCreateView.as_view(), name='medicine_add'),
+    path('medicines/import/', views.import_inventory_view, name='import_inventory'),
     #path('medicines/<int:pk>/edit/', views.MedicineUpdateView.as_view(), name='medicine_edit'),
     
     # Medicine Batch Management
@@ -25,7 +27,23 @@ urlpatterns = [
     path('sales/', views.SaleListView.as_view(), name='sale_list'),
     path('sales/add/', views.create_sale, name='create_sale'),
     path('sales/<int:pk>/', views.SaleDetailView.as_view(), name='sale_detail'),
+    # Purchase Orders
+    path('purchase-orders/', views.PurchaseOrderListView.as_view(), name='purchase_order_list'),
+    path('purchase-orders/add/', views.purchase_order_create, name='purchase_order_add'),
+    path('purchase-orders/<int:pk>/', views.PurchaseOrderDetailView.as_view(), name='purchase_order_detail'),
+    path('purchase-orders/<int:pk>/receive/', views.receive_purchase_order_view, name='receive_purchase_order'),
     path('api/medicine-batch-info/', views.medicine_batch_info, name='medicine_batch_info'),
+    path('api/sales/allocate/', views.allocate_sale_view, name='allocate_sale'),
+    path('api/batch-catalog/', views.batch_catalog, name='batch_catalog'),
+    path('api/batch-search/', views.batch_search, name='batch_search'),
+    path('api/sales-trend/', views.sales_trend, name='sales_trend'),
+
+    # Background jobs
+    path('api/jobs/', views.job_create, name='job_create'),
+    path('api/jobs/<int:pk>/', views.job_status, name='job_status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+    path('profiles/<int:pk>/<str:kind>/', views.profile_capture_download, name='profile_capture_download'),
+    path('metrics', views.metrics_view, name='metrics'),
     # Alerts
     path('alerts/low-stock/', views.low_stock_alerts, name='low_stock_alerts'),
     path('alerts/expiry/', views.expiry_alerts, name='expiry_alerts'),
@@ -1,29 +1,53 @@
 # views.py
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db.models import Sum, F, Q
+from django.db.models import Sum, F, Q, Prefetch, Case, When, Value, Count, Max
 from django.contrib import messages
-from django.http import JsonResponse
-
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.conf import settings
+from django.views.decorators.http import condition, require_POST
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+
+import csv
+import hashlib
+import json
 from datetime import timedelta
+from decimal import Decimal, InvalidOperation
 
 from .models import (
     Medicine, Sale, SaleItem, 
-     PurchaseOrder, PurchaseOrderItem,MedicineBatch
+     PurchaseOrder, PurchaseOrderItem,MedicineBatch, DailySalesSummary, DeletedBatch, Job, ProfileCapture
 )
 from .forms import (
     MedicineForm, SaleForm, SaleItemFormSet,
-      PurchaseOrderForm, PurchaseOrderItemFormSet,MedicineBatchForm
+      PurchaseOrderForm, PurchaseOrderItemFormSet,MedicineBatchForm,
+    InventoryImportForm, ReceiveItemFormSet
+)
+from .exports import (
+    EXPORT_FORMATS, inventory_export, inventory_report_querysets, requested_export_format,
+    sales_export, stream_export
 )
+from .services import allocate_sale, commit_sale, receive_purchase_order, sellable_batches
+from .kpis import dashboard_kpis, cache_stats as kpi_cache_stats
+from .pagination import KeysetPage, KeysetPaginationMixin
+from .routers import reads_from_reports
+from .search import fts_available, ranked_medicine_ids, rank_by, search_medicines
+from .imports import import_format, import_inventory, text_stream
+from .jobs import api_params, enqueue, enqueue_import, result_path
+from .profiling import capture_path
+from .metrics import render as render_metrics
 
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
-from .forms import LoginForm, CustomUserCreationForm
+from .forms import LoginForm, CustomUserCreationForm, batch_label
 
 def login_view(request):
     # if request.user.is_authenticated:
@@ -80,53 +104,16 @@ from .models import Medicine, MedicineBatch, Sale
 
 @login_required
 def dashboard(request):
-    user = request.user
-    today = timezone.now().date()
-    thirty_days_later = today + timedelta(days=30)
-    first_day_of_month = today.replace(day=1)
-
-    # Fetch list of low stock medicines
-    all_medicines = Medicine.objects.filter(user=user).prefetch_related('batches')
-    low_stock_medicines = [med for med in all_medicines if med.is_low_stock]
-    low_stock_count = len(low_stock_medicines)
-
-
-    # Count of low stock medicines
-    
-
-    # Count of expired medicine batches
-    expired_batches = MedicineBatch.objects.filter(
-    medicine__user=user,
-    expiry_date__lt=today,
-    is_active=True
-).count()
-
-    # Count of soon-to-expire medicine batches
-    expiring_soon_count = MedicineBatch.objects.filter(
-        user=user,
-        expiry_date__gte=today,
-        expiry_date__lte=thirty_days_later,
-        is_active=True
-    ).count()
-
-    # Recent sales by user
-    recent_sales = Sale.objects.filter(user=user).order_by('-sale_date')[:5]
+    context = dashboard_kpis(request.user)
+    return render(request, 'medicine/dashboard.html', context)
 
-    # Total monthly sales by user
-    monthly_sales = Sale.objects.filter(
-        user=user,
-        sale_date__gte=first_day_of_month
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
 
-    context = {
-        'low_stock_count': low_stock_count,
-        'expired_batches': expired_batches,
-        'expiring_soon_count': expiring_soon_count,
-        'recent_sales': recent_sales,
-        'monthly_sales': monthly_sales,
-        'low_stock_medicines': low_stock_medicines,
-    }
-    return render(request, 'medicine/dashboard.html', context)
+@login_required
+def dashboard_cache_stats(request):
+    """API endpoint exposing the dashboard KPI cache hit/miss counters to staff."""
+    if not request.user.is_staff:
+        return JsonResponse({'errors': {'__all__': ['Staff only.']}}, status=403)
+    return JsonResponse(kpi_cache_stats())
 
 
 # @login_required
@@ -182,20 +169,45 @@ def dashboard(request):
 
 
 # Medicine Views
-class MedicineListView(LoginRequiredMixin, ListView):
+class MedicineListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Medicine
     template_name = 'medicine/medicine_list.html'
     context_object_name = 'medicines'
+    keyset_ordering = ('name', 'id')
+    paginate_by = 25
+    # Ids of the full-text matches, best first, while a search is ranked
+    ranked_ids = None
     
     def get_queryset(self):
         queryset = super().get_queryset().filter(user=self.request.user)
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(generic_name__icontains=search_query)
-            )
-        return queryset
+        search_query = self.request.GET.get('search', '').strip()
+        if not search_query:
+            return queryset
+        if not fts_available():
+            return search_medicines(queryset, search_query)
+        # Word-prefix matches in bm25 order, then name substrings the index
+        # cannot find ("cetamol"), once the term is selective enough
+        self.ranked_ids = ranked_medicine_ids(self.request.user, search_query)
+        matches = Q(pk__in=self.ranked_ids)
+        if len(search_query) >= 3:
+            matches |= Q(name__icontains=search_query) | Q(generic_name__icontains=search_query)
+        return queryset.filter(matches).annotate(search_rank=rank_by('pk', self.ranked_ids))
+    
+    def paginate_queryset(self, queryset, page_size):
+        if self.ranked_ids is None:
+            return super().paginate_queryset(queryset, page_size)
+        # Keyset pages follow the name order and would undo the ranking. The
+        # ranked matches are capped at SEARCH_RESULT_LIMIT, so offset pages
+        # stay cheap; the cursor is the offset.
+        cursor = self.request.GET.get(self.cursor_kwarg, '')
+        offset = int(cursor) if cursor.isdigit() else 0
+        rows = list(queryset.order_by('search_rank', 'name', 'id')[offset:offset + page_size + 1])
+        page = KeysetPage(
+            rows[:page_size],
+            next_token=str(offset + page_size) if len(rows) > page_size else None,
+            previous_token=str(max(offset - page_size, 0)) if offset else None,
+        )
+        return None, page, page.object_list, page.has_other_pages()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -263,6 +275,52 @@ class MedicineCreateView(LoginRequiredMixin, CreateView):
         messages.success(self.request, 'Medicine added successfully.')
         return super().form_valid(form)
 
+# Most rejected rows listed on the import page; the counts still cover all of them
+IMPORT_ERRORS_SHOWN = 200
+
+
+@login_required
+def import_inventory_view(request):
+    """Upload a CSV or JSON-lines file of medicines and batches, optionally as a dry run or a background job."""
+    result = None
+    job = None
+    if request.method == 'POST':
+        form = InventoryImportForm(request.POST, request.FILES)
+        if form.is_valid() and form.cleaned_data['background']:
+            upload = form.cleaned_data['file']
+            job = enqueue_import(
+                request.user, upload, import_format(upload.name), dry_run=form.cleaned_data['dry_run']
+            )
+            messages.info(request, 'Import queued; this page shows its progress.')
+        elif form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = import_inventory(
+                    request.user,
+                    text_stream(upload),
+                    import_format(upload.name),
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+            except (UnicodeDecodeError, csv.Error) as e:
+                form.add_error('file', f"Could not read the file: {e}")
+            else:
+                if result.dry_run:
+                    messages.info(request, 'Dry run finished; nothing was saved.')
+                elif result.ok:
+                    messages.success(request, 'Inventory imported successfully.')
+                else:
+                    messages.warning(request, 'Inventory imported; some rows were rejected.')
+    else:
+        form = InventoryImportForm()
+
+    return render(request, 'medicine/import_inventory.html', {
+        'form': form,
+        'result': result,
+        'job': job,
+        'errors_shown': result.errors[:IMPORT_ERRORS_SHOWN] if result else [],
+    })
+
+
 class MedicineUpdateView(LoginRequiredMixin, UpdateView):
     model = Medicine
     form_class = MedicineForm
@@ -314,27 +372,21 @@ from django.utils import timezone
 from .models import Medicine
 
 @login_required
+@reads_from_reports
 def inventory_report(request):
-    medicines = Medicine.objects.filter(user=request.user)
-    
-
-    # Remove category filter logic
-    # Remove supplier references (if any)
-
     low_stock = request.GET.get('low_stock')
     expiry_filter = request.GET.get('expiry')
+    medicines, batches = inventory_report_querysets(request.user, low_stock, expiry_filter)
 
-    if low_stock:
-        medicines = [m for m in medicines if m.is_low_stock]
-
-    today = timezone.now().date()
     today = timezone.now().date()
     soon_expiry_date = today + timedelta(days=30)
 
-    if expiry_filter == 'expired':
-        medicines = [m for m in medicines if m.expired_batches.exists()]
-    elif expiry_filter == 'soon':
-        medicines = [m for m in medicines if m.soon_to_expire_batches.exists()]
+    export_format = requested_export_format(request)
+    if export_format:
+        rows, header = inventory_export(request.user, medicines, batches)
+        return stream_export(rows, header, export_format, 'inventory_report')
+
+    medicines = medicines.prefetch_related(Prefetch('batches', queryset=batches, to_attr='report_batches'))
 
     context = {
         'medicines': medicines,
@@ -374,120 +426,49 @@ from django.core.exceptions import ValidationError
 from .forms import SaleForm, SaleItemFormSet
 from .models import Sale
 
-@transaction.atomic
+@login_required
 def create_sale(request):
     """View for creating a new sale with proper validation."""
     if request.method == 'POST':
-        print(request.POST)  # Keep for debugging
         form = SaleForm(request.POST)
-
-        if form.is_valid():
-            sale = form.save(commit=False)
-            sale.user = request.user
-            sale.save()
-
-            # Initialize total amount here
-            total_amount = 0
-
-            # Bind formset to request.POST and unsaved sale
-            formset = SaleItemFormSet(request.POST, instance=sale, request=request)
-
-            # Apply medicine batch filtering to each form
-            today = timezone.now().date()
-            medicine_batches = MedicineBatch.objects.filter(
-                user=request.user,
-                expiry_date__gte=today,
-                current_quantity__gt=0,
-                is_active=True
-            )
-            
-            for form in formset.forms:
-                form.fields['medicine_batch'].queryset = medicine_batches
-
-            if formset.is_valid():
-                has_empty_medicine_batch = False
-                
-                # Debug: Print total forms in formset
-                print(f"Total forms: {len(formset.forms)}")
-                
-                for i, form_data in enumerate(formset.forms):
-                    # Debug: Print form data for diagnosis
-                    print(f"Form {i} data: {form_data.cleaned_data}")
-                    
-                    # Skip deleted forms
-                    if form_data.cleaned_data.get('DELETE', False):
-                        print(f"Form {i} marked for deletion, skipping")
-                        continue
-
-                    if not form_data.cleaned_data.get('medicine_batch') and (
-                        form_data.cleaned_data.get('quantity') or form_data.cleaned_data.get('price')): 
-                        form_data.add_error('medicine_batch', 'This field is required.')
-                        messages.error(request, f"Item #{i+1}: Medicine batch is required but was not selected.")
-                        has_empty_medicine_batch = True
-
-                    # Calculate total_amount for each item with better validation
-                    medicine_batch = form_data.cleaned_data.get('medicine_batch')
-                    quantity = form_data.cleaned_data.get('quantity')
-                    price = form_data.cleaned_data.get('price')
-                    
-                    if medicine_batch and quantity and price:
-                        item_total = quantity * price
-                        total_amount += item_total
-                        print(f"Adding item total: {item_total}, running total: {total_amount}")
-
-                if has_empty_medicine_batch:
-                    pass  # Skip saving
-                else:
-                    try:
-                        # Debug: Print final total before saving
-                        print(f"Final total amount: {total_amount}")
-                        
-                        # Update sale total
-                        sale.total_amount = total_amount
-                        sale.save()
-
-                        sale_items = formset.save(commit=False)
-
-                        for sale_item in sale_items:
-                            sale_item.user = request.user
-
-                            if not sale_item.medicine_batch_id:
-                                raise ValidationError("A medicine batch must be selected for each item.")
-
-                            batch = sale_item.medicine_batch
-
-                            if batch.current_quantity < sale_item.quantity:
-                                raise ValidationError(f"Not enough stock for {batch}. Available: {batch.current_quantity}")
-
-                            # Deduct stock and save
-                            batch.current_quantity -= sale_item.quantity
-                            batch.save()
-                            
-                            # Skip the automatic inventory update in the SaleItem.save method
-                            sale_item.save(skip_inventory_update=True)
-
-                        # Handle deletions
-                        for obj in formset.deleted_objects:
-                            if obj.medicine_batch_id:
-                                batch = obj.medicine_batch
-                                batch.current_quantity += obj.quantity
-                                batch.save()
-                            obj.delete()
-
-                        messages.success(request, 'Sale recorded successfully!')
-                        return redirect('sale_list')
-
-                    except ValidationError as e:
-                        transaction.set_rollback(True)
-                        messages.error(request, str(e))
-
+        formset = SaleItemFormSet(request.POST, instance=form.instance, request=request)
+
+        if form.is_valid() and formset.is_valid():
+            lines = []
+            for i, item_form in enumerate(formset.forms):
+                # Skip deleted and untouched extra forms
+                if not item_form.cleaned_data or item_form.cleaned_data.get('DELETE', False):
+                    continue
+                lines.append((
+                    i,
+                    item_form.cleaned_data['medicine_batch'].pk,
+                    item_form.cleaned_data['quantity'],
+                    item_form.cleaned_data['price'],
+                ))
+
+            if not lines:
+                messages.error(request, "Add at least one item to the sale.")
             else:
-                for i, form_errors in enumerate(formset.errors):
-                    for field, error in form_errors.items():
-                        messages.error(request, f"Item #{i+1} - {field}: {error}")
-                for error in formset.non_form_errors():
-                    messages.error(request, error)
+                sale = form.save(commit=False)
+                sale.user = request.user
+                try:
+                    commit_sale(sale, lines)
+                    messages.success(request, 'Sale recorded successfully!')
+                    return redirect('sale_list')
+                except ValidationError as e:
+                    for error in e.error_list:
+                        line = (error.params or {}).get('line')
+                        if line is None:
+                            messages.error(request, error.message)
+                            continue
+                        formset.forms[line].add_error('quantity', error.message)
+                        messages.error(request, f"Item #{line+1} - quantity: {error.message}")
         else:
+            for i, form_errors in enumerate(formset.errors):
+                for field, error in form_errors.items():
+                    messages.error(request, f"Item #{i+1} - {field}: {error}")
+            for error in formset.non_form_errors():
+                messages.error(request, error)
             for field, errors in form.errors.items():
                 for error in errors:
                     messages.error(request, f"{field}: {error}")
@@ -495,32 +476,72 @@ def create_sale(request):
         sale_instance = Sale()
         form = SaleForm(initial={'sale_date': timezone.now()})
         formset = SaleItemFormSet(instance=sale_instance, request=request)
-        
-        # Apply medicine batch filtering for GET requests too
-        today = timezone.now().date()
-        medicine_batches = MedicineBatch.objects.filter(
-            user=request.user,
-            expiry_date__gte=today,
-            current_quantity__gt=0,
-            is_active=True
-        )
-        
-        for form in formset.forms:
-            form.fields['medicine_batch'].queryset = medicine_batches
 
     return render(request, 'medicine/sale_form.html', {
         'form': form,
         'formset': formset,
     })
 
+@login_required
+@require_POST
+def allocate_sale_view(request):
+    """API endpoint recording a sale by medicine and quantity, allocated first-expiry-first-out."""
+    try:
+        payload = json.loads(request.body)
+        requests = [
+            (
+                int(item['medicine']),
+                int(item['quantity']),
+                Decimal(str(item['price'])) if item.get('price') is not None else None,
+            )
+            for item in payload.get('items', [])
+        ]
+    except (ValueError, TypeError, KeyError, AttributeError, InvalidOperation):
+        return JsonResponse({'errors': {'__all__': ['Malformed request body.']}}, status=400)
+
+    if not requests:
+        return JsonResponse({'errors': {'items': ['Add at least one item to the sale.']}}, status=400)
+
+    payload.setdefault('sale_date', timezone.now())
+    form = SaleForm(payload)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+
+    sale = form.save(commit=False)
+    sale.user = request.user
+    try:
+        allocate_sale(sale, requests)
+    except ValidationError as e:
+        return JsonResponse({'errors': {'items': [
+            # Iterating an error interpolates its params into the message
+            {'line': (error.params or {}).get('line'), 'message': next(iter(error))}
+            for error in e.error_list
+        ]}}, status=400)
+
+    items = sale.items.select_related('medicine_batch').order_by('pk')
+    return JsonResponse({
+        'sale': sale.pk,
+        'invoice_number': sale.invoice_number,
+        'total_amount': str(sale.total_amount),
+        'items': [
+            {
+                'medicine': item.medicine_batch.medicine_id,
+                'medicine_batch': item.medicine_batch_id,
+                'batch_number': item.medicine_batch.batch_number,
+                'expiry_date': item.medicine_batch.expiry_date.isoformat(),
+                'quantity': item.quantity,
+                'price': str(item.price),
+            }
+            for item in items
+        ],
+    }, status=201)
+
+@login_required
 def medicine_batch_info(request):
     """API endpoint to get information about active medicine batches."""
-    today = timezone.now().date()
-    batches = MedicineBatch.objects.filter(
-        expiry_date__gte=today,
-        current_quantity__gt=0,
-        is_active=True
-    ).values('id', 'medicine__name', 'batch_number', 'current_quantity', 'retail_price')
+    batches = sellable_batches(request.user).values(
+        'id', 'medicine__name', 'batch_number', 'current_quantity', 'selling_price'
+    )
     
     # Format the data for frontend use
     batch_data = []
@@ -529,11 +550,253 @@ def medicine_batch_info(request):
             'id': batch['id'],
             'name': f"{batch['medicine__name']} (Batch: {batch['batch_number']})",
             'current_quantity': batch['current_quantity'],
-            'retail_price': float(batch['retail_price'])
+            'retail_price': float(batch['selling_price'])
         })
     
     return JsonResponse(batch_data, safe=False)
 
+
+# Longest period the sales trend endpoint reports, in days
+SALES_TREND_MAX_DAYS = 366
+
+
+@login_required
+@reads_from_reports
+def sales_trend(request):
+    """API endpoint with daily sales totals for charts, read from the daily rollup."""
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), SALES_TREND_MAX_DAYS)
+        medicine_id = int(request.GET['medicine']) if request.GET.get('medicine') else None
+    except ValueError:
+        return JsonResponse({'errors': {'__all__': ['days and medicine must be integers.']}}, status=400)
+
+    start = timezone.localdate() - timedelta(days=days - 1)
+    rows = DailySalesSummary.objects.filter(user=request.user, date__gte=start)
+    rows = rows.filter(medicine_id=medicine_id) if medicine_id else rows.filter(medicine__isnull=True)
+
+    return JsonResponse({
+        'columns': ['date', 'revenue', 'cost', 'units', 'line_count'],
+        'rows': [
+            [day.isoformat(), str(revenue), str(cost), units, line_count]
+            for day, revenue, cost, units, line_count in rows.order_by('date').values_list(
+                'date', 'revenue', 'cost', 'units', 'line_count'
+            )
+        ],
+    })
+
+
+# Background jobs
+def _job_json(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'status_url': reverse('job_status', args=[job.pk]),
+        'download_url': (
+            reverse('job_download', args=[job.pk]) if job.status == Job.SUCCEEDED and job.result_file else None
+        ),
+    }
+
+
+@login_required
+@require_POST
+def job_create(request):
+    """API endpoint queueing a report or export job; responds at once with its status URL."""
+    kind = request.POST.get('kind', '')
+    allowed = api_params(kind)
+    if allowed is None:
+        return JsonResponse({'errors': {'kind': [f"Unknown job kind: {kind}"]}}, status=400)
+    if request.POST.get('format', 'csv') not in EXPORT_FORMATS:
+        return JsonResponse({'errors': {'format': ['Unsupported export format.']}}, status=400)
+
+    params = {name: request.POST[name] for name in allowed if request.POST.get(name)}
+    job = enqueue(request.user, kind, **params)
+    return JsonResponse(_job_json(job), status=202)
+
+
+@login_required
+def job_status(request, pk):
+    """API endpoint with a job's status and progress, polled by the page that queued it."""
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    return JsonResponse(_job_json(job))
+
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user, status=Job.SUCCEEDED)
+    path = result_path(job) if job.result_file else None
+    if path is None or not path.exists():
+        raise Http404("The result file of this job is no longer available.")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.result_file)
+
+
+# Request profiles
+@staff_member_required
+def profile_capture_download(request, pk, kind):
+    """Serve a profile capture's pstats dump (``stats``) or collapsed stacks (``stacks``) to staff."""
+    capture = get_object_or_404(ProfileCapture, pk=pk)
+    file_name = {'stats': capture.stats_file, 'stacks': capture.stacks_file}.get(kind)
+    if file_name is None or not capture_path(file_name).exists():
+        raise Http404("This capture file is no longer available.")
+    return FileResponse(open(capture_path(file_name), 'rb'), as_attachment=True, filename=file_name)
+
+
+# Prometheus scrape endpoint
+def metrics_view(request):
+    """
+    Metrics of all workers in the Prometheus text format.
+
+    Scrapers send the bearer METRICS_TOKEN; without one configured, only
+    logged-in staff may read them.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        if not (request.user.is_active and request.user.is_staff):
+            return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Results returned per keystroke by the sale form batch picker
+BATCH_SEARCH_LIMIT = 20
+
+
+@login_required
+def batch_search(request):
+    """API endpoint backing the sale form batch picker: prefix matches first, then substrings."""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'results': []})
+
+    if fts_available():
+        # Word-prefix matches over name, generic name, category and description,
+        # best ranked medicine first; batch numbers still match by prefix
+        medicine_ids = ranked_medicine_ids(request.user, query)
+        matches = Q(medicine_id__in=medicine_ids) | Q(batch_number__istartswith=query)
+        rank = rank_by('medicine_id', medicine_ids)
+    else:
+        prefix = (
+            Q(medicine__name__istartswith=query) |
+            Q(medicine__generic_name__istartswith=query) |
+            Q(batch_number__istartswith=query)
+        )
+        # Substring matching only kicks in once the term is selective enough to be worth it
+        matches = prefix | Q(medicine__name__icontains=query) if len(query) >= 3 else prefix
+        rank = Case(When(prefix, then=Value(0)), default=Value(1))
+
+    batches = sellable_batches(request.user).filter(matches).annotate(
+        rank=rank
+    ).select_related('medicine').order_by('rank', 'medicine__name', 'expiry_date')[:BATCH_SEARCH_LIMIT]
+
+    return JsonResponse({'results': [
+        {
+            'id': batch.pk,
+            'label': batch_label(batch),
+            'price': str(batch.selling_price),
+            'available': batch.current_quantity,
+        }
+        for batch in batches
+    ]})
+
+
+# Batch catalog sync for POS terminals
+CATALOG_FIELDS = [
+    'id', 'medicine_id', 'medicine__name', 'batch_number',
+    'expiry_date', 'current_quantity', 'selling_price', 'is_active',
+]
+CATALOG_COLUMNS = [
+    'id', 'medicine', 'name', 'batch_number',
+    'expiry_date', 'current_quantity', 'selling_price', 'sellable',
+]
+
+
+def _catalog_state(request):
+    """
+    Resolve the cursor and summarize the matching rows with aggregate queries.
+
+    Without a cursor the client gets a snapshot of the sellable batches; with
+    one it gets every batch changed after the cursor, including batches
+    that stopped being sellable, and the ids of batches deleted since, so it
+    can drop them.
+    """
+    if not hasattr(request, '_catalog_state'):
+        since = request.GET.get('since')
+        cursor = int(since) if since and since.isdigit() else None
+        batches = MedicineBatch.objects.filter(user=request.user)
+        deleted = DeletedBatch.objects.filter(user=request.user)
+        if since and cursor is None:
+            state = None
+        elif cursor is None:
+            sellable = Q(is_active=True, current_quantity__gt=0, expiry_date__gte=timezone.now().date())
+            summary = batches.aggregate(count=Count('pk', filter=sellable), latest=Max('sync_version'))
+            tombstones = deleted.aggregate(latest=Max('sync_version'))
+            state = {
+                'full': True, 'rows': sellable_batches(request.user), 'deleted': deleted.none(), 'since': None,
+                'count': summary['count'], 'latest': max(summary['latest'] or 0, tombstones['latest'] or 0),
+            }
+        else:
+            rows = batches.filter(sync_version__gt=cursor)
+            deleted = deleted.filter(sync_version__gt=cursor)
+            summary = rows.aggregate(count=Count('pk'), latest=Max('sync_version'))
+            tombstones = deleted.aggregate(count=Count('pk'), latest=Max('sync_version'))
+            state = {
+                'full': False, 'rows': rows, 'deleted': deleted, 'since': cursor,
+                'count': summary['count'] + tombstones['count'],
+                'latest': max(summary['latest'] or 0, tombstones['latest'] or 0),
+            }
+        request._catalog_state = state
+    return request._catalog_state
+
+
+def _catalog_etag(request):
+    state = _catalog_state(request)
+    if state is None:
+        return None
+    key = f"{request.user.pk}:{state['since']}:{state['latest']}:{state['count']}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+@login_required
+@condition(etag_func=_catalog_etag)
+def batch_catalog(request):
+    """
+    API endpoint for incremental batch catalog sync.
+
+    Call without ``since`` for a snapshot, then pass the returned ``cursor``
+    as ``since`` to receive only batches changed after it. The cursor is a
+    change version rather than a time, so a change that commits late is
+    never skipped. Clients upsert rows by id and drop the ids in ``deleted``.
+    """
+    state = _catalog_state(request)
+    if state is None:
+        return JsonResponse({'errors': {'since': ['Invalid cursor.']}}, status=400)
+
+    today = timezone.now().date()
+    rows = []
+    for (pk, medicine_id, name, batch_number, expiry_date,
+         current_quantity, selling_price, is_active) in state['rows'].order_by('pk').values_list(*CATALOG_FIELDS):
+        rows.append([
+            pk, medicine_id, name, batch_number, expiry_date.isoformat(), current_quantity,
+            str(selling_price), is_active and current_quantity > 0 and expiry_date >= today,
+        ])
+
+    cursor = state['latest'] or state['since']
+    response = JsonResponse({
+        'full': state['full'],
+        'cursor': str(cursor or 0),
+        'columns': CATALOG_COLUMNS,
+        'rows': rows,
+        'deleted': list(state['deleted'].order_by('batch_id').values_list('batch_id', flat=True).distinct()),
+    })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 # def create_sale(request):
 #     if request.method == 'POST':
 #         form = SaleForm(request.POST)
@@ -580,23 +843,163 @@ class SaleDetailView(LoginRequiredMixin, DetailView):
         return Sale.objects.filter(user=self.request.user)
 
 
-class SaleListView(LoginRequiredMixin, ListView):
+class SaleListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Sale
-    template_name = 'pharmacy/sale_list.html'
+    template_name = 'medicine/sale_list.html'
     context_object_name = 'sales'
-    ordering = ['-sale_date']
+    keyset_ordering = ('-sale_date', '-id')
     paginate_by = 10
+    estimate_total = True
+
+    def get_queryset(self):
+        return Sale.objects.filter(user=self.request.user).order_by('-sale_date', '-id')
+
+    def get(self, request, *args, **kwargs):
+        export_format = requested_export_format(request)
+        if export_format:
+            return self.export(export_format)
+        return super().get(request, *args, **kwargs)
+
+    @method_decorator(reads_from_reports)
+    def export(self, export_format):
+        rows, header = sales_export(self.get_queryset())
+        return stream_export(rows, header, export_format, 'sales')
+
+
+
+# Purchase Orders
+class PurchaseOrderListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    model = PurchaseOrder
+    template_name = 'medicine/purchase_order_list.html'
+    context_object_name = 'purchase_orders'
+    keyset_ordering = ('-order_date', '-id')
+    paginate_by = 20
+
+    def get_queryset(self):
+        queryset = PurchaseOrder.objects.filter(user=self.request.user).with_receipt_totals()
+        search_query = self.request.GET.get('search', '')
+        if search_query:
+            queryset = queryset.filter(
+                Q(order_number__icontains=search_query) |
+                Q(supplier__icontains=search_query)
+            )
+        status = self.request.GET.get('status')
+        if status:
+            queryset = queryset.with_status(status)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.request.GET.get('search', '')
+        context['status_filter'] = self.request.GET.get('status', '')
+        context['status_choices'] = PurchaseOrder.STATUS_CHOICES
+        return context
+
+
+@login_required
+def purchase_order_create(request):
+    if request.method == 'POST':
+        form = PurchaseOrderForm(request.POST)
+        formset = PurchaseOrderItemFormSet(request.POST, instance=form.instance, user=request.user)
+        if form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                order = form.save(commit=False)
+                order.user = request.user
+                order.save()
+                items = formset.save(commit=False)
+                for item in items:
+                    item.order = order
+                    item.user = request.user
+                PurchaseOrderItem.objects.bulk_create(items)
+            messages.success(request, 'Purchase order created successfully.')
+            return redirect('purchase_order_detail', pk=order.pk)
+    else:
+        form = PurchaseOrderForm()
+        formset = PurchaseOrderItemFormSet(instance=PurchaseOrder(), user=request.user)
+
+    return render(request, 'medicine/purchase_order_form.html', {
+        'form': form,
+        'formset': formset,
+    })
+
+
+class PurchaseOrderDetailView(LoginRequiredMixin, DetailView):
+    model = PurchaseOrder
+    template_name = 'medicine/purchase_order_detail.html'
+    context_object_name = 'purchase_order'
 
     def get_queryset(self):
-        return Sale.objects.filter(user=self.request.user).order_by('-sale_date')
+        return PurchaseOrder.objects.filter(user=self.request.user).with_receipt_totals()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        items = list(self.object.items.select_related('medicine').order_by('pk'))
+        context['items'] = items
+        context['order_total'] = sum(item.line_total or 0 for item in items)
+        context['received_batches'] = MedicineBatch.objects.filter(
+            purchase_order_item__order=self.object
+        ).select_related('medicine').order_by('received_date', 'pk')
+        return context
 
 
+@login_required
+def receive_purchase_order_view(request, pk):
+    """Book a full or partial delivery; lines left blank stay outstanding for a later visit."""
+    order = get_object_or_404(PurchaseOrder.objects.with_receipt_totals(), pk=pk, user=request.user)
+    items = {
+        item.pk: item
+        for item in order.items.select_related('medicine').order_by('pk')
+        if item.outstanding_quantity
+    }
+    if not items:
+        messages.info(request, 'Every item of this purchase order has been received.')
+        return redirect('purchase_order_detail', pk=order.pk)
+
+    if request.method == 'POST':
+        formset = ReceiveItemFormSet(request.POST, prefix='receive')
+        if formset.is_valid():
+            lines = [
+                (i, item_form.cleaned_data['item'], item_form.cleaned_data)
+                for i, item_form in enumerate(formset.forms)
+                if item_form.receives
+            ]
+            try:
+                batches = receive_purchase_order(order, lines)
+            except ValidationError as e:
+                for error in e.error_list:
+                    line = (error.params or {}).get('line')
+                    if line is None:
+                        messages.error(request, error.message)
+                    else:
+                        formset.forms[line].add_error('quantity', error.message)
+            else:
+                messages.success(request, f'Received {len(batches)} batch(es) into stock.')
+                return redirect('purchase_order_detail', pk=order.pk)
+    else:
+        formset = ReceiveItemFormSet(prefix='receive', initial=[
+            {
+                'item': item.pk,
+                'quantity': item.outstanding_quantity,
+                'purchase_price': item.unit_price,
+            }
+            for item in items.values()
+        ])
+
+    for item_form in formset.forms:
+        try:
+            item_form.order_item = items.get(int(item_form['item'].value()))
+        except (TypeError, ValueError):
+            item_form.order_item = None
+    return render(request, 'medicine/receive_purchase_order.html', {
+        'purchase_order': order,
+        'formset': formset,
+    })
+
 
 # Low Stock and Expiry Alerts
 @login_required
 def low_stock_alerts(request):
-    medicines = Medicine.objects.filter(user=request.user)
-    low_stock_medicines = [medicine for medicine in medicines if medicine.is_low_stock]
+    low_stock_medicines = Medicine.objects.filter(user=request.user).low_stock().order_by('name')
     
     context = {
         'low_stock_medicines': low_stock_medicines,
@@ -604,28 +1007,55 @@ def low_stock_alerts(request):
     return render(request, 'medicine/low_stock_alerts.html', context)
 
 
+@reads_from_reports
+def _expiry_alerts_export(request, export_format, today, window_end):
+    rows = MedicineBatch.objects.filter(
+        user=request.user,
+        expiry_date__lte=window_end,
+        is_active=True
+    ).annotate(
+        status=Case(
+            When(expiry_date__lt=today, then=Value('expired')),
+            default=Value('expiring_soon'),
+        )
+    ).order_by('expiry_date', 'pk').values_list(
+        'medicine__name', 'batch_number', 'expiry_date', 'status', 'current_quantity'
+    )
+    header = ['medicine', 'batch_number', 'expiry_date', 'status', 'current_quantity']
+    return stream_export(rows, header, export_format, 'expiry_alerts')
+
+
 @login_required
 def expiry_alerts(request):
     today = timezone.now().date()
-    thirty_days_later = today + timedelta(days=30)
 
-    user_medicine_ids = Medicine.objects.filter(user=request.user).values_list('id', flat=True)
+    # ?window= picks one of the configured windows for the "expiring soon" list
+    window = settings.EXPIRY_ALERT_DAYS
+    if request.GET.get('window', '').isdigit() and int(request.GET['window']) in settings.EXPIRY_ALERT_WINDOWS:
+        window = int(request.GET['window'])
+    window_end = today + timedelta(days=window)
+
+    export_format = requested_export_format(request)
+    if export_format:
+        return _expiry_alerts_export(request, export_format, today, window_end)
 
     expired_batches = MedicineBatch.objects.filter(
+        user=request.user,
         expiry_date__lt=today,
-        is_active=True,
-        medicine_id__in=user_medicine_ids
-    ).order_by('expiry_date')
+        is_active=True
+    ).select_related('medicine').order_by('expiry_date')
 
     expiring_soon_batches = MedicineBatch.objects.filter(
+        user=request.user,
         expiry_date__gte=today,
-        expiry_date__lte=thirty_days_later,
-        is_active=True,
-        medicine_id__in=user_medicine_ids
-    ).order_by('expiry_date')
+        expiry_date__lte=window_end,
+        is_active=True
+    ).select_related('medicine').order_by('expiry_date')
 
     context = {
         'expired_batches': expired_batches,
         'expiring_soon_batches': expiring_soon_batches,
+        'summary': Medicine.objects.filter(user=request.user).alert_summary(),
+        'window': window,
     }
     return render(request, 'medicine/expiry_alerts.html', context)